@@ -1,9 +1,11 @@
 from .config import settings
-from .database import get_db, get_db_dependency, get_connection
+from .database import get_db, get_db_dependency, get_connection, named_lock, iter_query_unbuffered, after_commit
+from .http_cache import conditional_response, make_etag, PRIVATE_REVALIDATE
 from .security import (
     verify_password,
     get_password_hash,
     create_access_token,
     get_current_user,
+    get_user_by_token,
     get_current_admin
 )
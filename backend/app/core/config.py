@@ -1,3 +1,5 @@
+import os
+import tempfile
 from pydantic_settings import BaseSettings
 from functools import lru_cache
 
@@ -22,6 +24,79 @@ class Settings(BaseSettings):
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB
     ALLOWED_IMAGE_EXTENSIONS: list = [".jpg", ".jpeg", ".png", ".bmp", ".webp"]
 
+    # 导出缓存配置
+    EXPORT_CACHE_ENABLED: bool = True
+    EXPORT_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "torch_markup", "export_cache")
+    EXPORT_CACHE_MAX_BYTES: int = 20 * 1024 * 1024 * 1024  # 20GB
+
+    # 导出任务配置
+    EXPORT_WORK_DIR: str = os.path.join(tempfile.gettempdir(), "torch_markup", "export_tasks")
+    EXPORT_TASK_TTL_SECONDS: int = 24 * 3600  # 导出任务保留时间
+    EXPORT_GC_INTERVAL_SECONDS: int = 300  # 清理间隔
+    EXPORT_MAX_DISK_BYTES: int = 50 * 1024 * 1024 * 1024  # 导出产物（含缓存）磁盘配额 50GB
+
+    # 全局计数（用户数、数据集数）更新间隔（秒）
+    STATS_COMPACT_INTERVAL_SECONDS: int = 60
+    # 统计汇总表按数据集轮流校准的间隔（秒），每次校准一个数据集
+    STATS_RECONCILE_INTERVAL_SECONDS: int = 600
+    # 用户已标注图片计数的校准间隔（秒），只校准期间计数有变化的用户
+    STATS_USER_RECONCILE_INTERVAL_SECONDS: int = 3600
+
+    # 工作量统计写入间隔（秒）与待写入条目上限
+    WORK_STATS_FLUSH_INTERVAL_SECONDS: int = 5
+    WORK_STATS_MAX_PENDING: int = 500
+
+    # 标注停留时间：心跳间隔超过该值视为离开（秒），单张图片停留时间上限（秒）
+    DWELL_HEARTBEAT_GAP_SECONDS: int = 60
+    DWELL_MAX_SECONDS: int = 1800
+
+    # 标注历史写后批量写入：写入间隔（秒）、触发立即写入的条目数、
+    # 数据库不可用时内存中最多缓冲的条目数（超出或进程退出时保存到 spool 目录，之后读回写入）
+    HISTORY_FLUSH_INTERVAL_SECONDS: float = 1.0
+    HISTORY_MAX_PENDING: int = 1000
+    HISTORY_MAX_BUFFERED: int = 100000
+    HISTORY_SPOOL_DIR: str = os.path.join(tempfile.gettempdir(), "torch_markup", "history_spool")
+
+    # 数据集 / 类别 / 配置查询缓存的版本检查间隔（秒），即其他 worker 修改后的最大延迟
+    LOOKUP_CACHE_CHECK_SECONDS: float = 1.0
+
+    # 图片文件：路径缓存条目数、文件状态复查间隔（秒）、浏览器缓存时间（秒，0 表示每次重新验证）
+    IMAGE_PATH_CACHE_SIZE: int = 20000
+    IMAGE_FILE_STAT_TTL_SECONDS: float = 5.0
+    IMAGE_FILE_CACHE_MAX_AGE: int = 31536000
+
+    # 图片缩略图 / 预览图（长边像素）及其磁盘缓存
+    IMAGE_THUMB_SIZE: int = 256
+    IMAGE_PREVIEW_SIZE: int = 1280
+    IMAGE_DERIVATIVE_QUALITY: int = 85
+    IMAGE_DERIVATIVE_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "torch_markup", "image_derivatives")
+    IMAGE_DERIVATIVE_CACHE_MAX_BYTES: int = 5 * 1024 * 1024 * 1024  # 5GB
+
+    # 按 Accept 协商的显示用转码：格式优先级（空列表表示不转码）、原图转码的扩展名、质量
+    IMAGE_TRANSCODE_FORMATS: list = ["avif", "webp"]
+    IMAGE_TRANSCODE_EXTENSIONS: list = [".bmp", ".png", ".tif", ".tiff"]
+    IMAGE_WEBP_QUALITY: int = 90
+    IMAGE_AVIF_QUALITY: int = 70
+
+    # 大图切片金字塔：切片边长（像素）及其磁盘缓存
+    IMAGE_TILE_SIZE: int = 512
+    IMAGE_TILE_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "torch_markup", "image_tiles")
+    IMAGE_TILE_CACHE_MAX_BYTES: int = 10 * 1024 * 1024 * 1024  # 10GB
+
+    # 批量保存：单次请求的最大条数、幂等键保留时间（小时，需覆盖客户端离线排队的时长）
+    BATCH_SAVE_MAX_ITEMS: int = 500
+    SAVE_IDEMPOTENCY_TTL_HOURS: int = 168
+
+    # 标注会话（WebSocket）：服务端保持的客户端待标注队列长度
+    SESSION_QUEUE_DEPTH: int = 20
+
+    # 进度推送：合并计算间隔（秒，即推送频率上限）、有订阅者的数据集定期重新计算的间隔（秒，反映其他 worker 的变化）
+    PROGRESS_PUSH_INTERVAL_SECONDS: float = 1.0
+    PROGRESS_REFRESH_SECONDS: float = 10.0
+
+    # 进程池配置（0 表示使用 CPU 核数）
+    WORKER_PROCESSES: int = 0
+
     class Config:
         env_file = ".env"
 
@@ -1,8 +1,12 @@
+import logging
 import pymysql
-from pymysql.cursors import DictCursor
+from pymysql.cursors import DictCursor, SSDictCursor
 from contextlib import contextmanager
+from typing import Callable
 from .config import settings
 
+logger = logging.getLogger(__name__)
+
 # 解析数据库URL
 def parse_database_url(url: str) -> dict:
     """解析数据库连接URL"""
@@ -36,15 +40,47 @@ def get_connection():
     return pymysql.connect(**db_config)
 
 
+def after_commit(conn, callback: Callable[[], None]):
+    """
+    注册在连接当前事务提交后执行的回调（写后批量写入的历史、工作量统计等），事务回滚时丢弃
+
+    只对通过 commit() / rollback() 结束事务的连接有效（get_db、get_db_dependency 与标注会话）。
+    """
+    callbacks = getattr(conn, "_after_commit", None)
+    if callbacks is None:
+        callbacks = conn._after_commit = []
+    callbacks.append(callback)
+
+
+def commit(conn):
+    """提交事务并执行 after_commit 注册的回调"""
+    conn.commit()
+    callbacks = getattr(conn, "_after_commit", None)
+    if not callbacks:
+        return
+    conn._after_commit = []
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.exception("事务提交后的回调执行失败")
+
+
+def rollback(conn):
+    """回滚事务并丢弃 after_commit 注册的回调"""
+    conn._after_commit = []
+    conn.rollback()
+
+
 @contextmanager
 def get_db():
     """数据库连接上下文管理器"""
     conn = get_connection()
     try:
         yield conn
-        conn.commit()
+        commit(conn)
     except Exception:
-        conn.rollback()
+        rollback(conn)
         raise
     finally:
         conn.close()
@@ -55,9 +91,53 @@ def get_db_dependency():
     conn = get_connection()
     try:
         yield conn
-        conn.commit()
+        commit(conn)
     except Exception:
-        conn.rollback()
+        rollback(conn)
         raise
     finally:
         conn.close()
+
+
+@contextmanager
+def named_lock(conn, name: str, timeout: int = 0):
+    """
+    MySQL 命名锁（GET_LOCK），用于多个 worker 间互斥执行后台任务
+
+    Yields:
+        是否获得锁
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s) as acquired", (name, timeout))
+        acquired = cursor.fetchone()['acquired'] == 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (name,))
+
+
+def iter_query_unbuffered(sql: str, params=None, batch_size: int = 1000):
+    """
+    使用独立连接和服务端游标（SSDictCursor）分批读取查询结果，内存占用与结果集大小无关
+
+    用于流式响应：请求的依赖连接在响应开始前就已关闭，因此这里自行打开并在读取结束后关闭。
+
+    Yields:
+        每批最多 batch_size 行
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            # 客户端下载较慢时，服务端发送结果的等待时间需要更长
+            cursor.execute("SET SESSION net_write_timeout = 600")
+        with conn.cursor(SSDictCursor) as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+    finally:
+        conn.close()
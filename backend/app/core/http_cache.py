@@ -0,0 +1,62 @@
+"""ETag / 304 条件响应"""
+
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+# 需要登录的 JSON 接口：允许浏览器缓存，但每次使用前必须带 If-None-Match 重新验证
+PRIVATE_REVALIDATE = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """由版本标记生成弱 ETag（内容语义相同即可复用，与压缩等编码无关）"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否命中（按弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    value = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == value:
+            return True
+    return False
+
+
+def conditional_response(request: Request, response: Response, *parts,
+                         cache_control: str = PRIVATE_REVALIDATE) -> Optional[Response]:
+    """
+    按版本标记处理条件请求
+
+    在执行完整查询之前调用：为响应设置 ETag / Cache-Control；
+    客户端缓存仍然有效时返回 304 响应，调用方应直接返回它。
+
+    Args:
+        request: 当前请求
+        response: 接口注入的 Response（用于设置响应头）
+        parts: 版本标记（updated_at、计数、版本号等），任一变化即生成新的 ETag
+        cache_control: Cache-Control 策略
+
+    Returns:
+        304 响应；需要返回完整内容时为 None
+    """
+    etag = make_etag(*parts)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Vary": "Authorization",
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
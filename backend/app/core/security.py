@@ -47,33 +47,43 @@ def decode_token(token: str) -> Optional[dict]:
         return None
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), conn = Depends(get_db_dependency)):
-    """获取当前用户"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="无法验证凭据",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+def get_user_by_token(cursor, token: str) -> Optional[dict]:
+    """
+    由 JWT Token 查询用户
 
+    Returns:
+        用户信息；Token 无效或用户不存在时返回 None（不检查是否禁用）
+    """
     payload = decode_token(token)
     if payload is None:
-        raise credentials_exception
+        return None
 
     user_id_str = payload.get("sub")
     if user_id_str is None:
-        raise credentials_exception
+        return None
 
     try:
         user_id = int(user_id_str)
     except (ValueError, TypeError):
-        raise credentials_exception
+        return None
+
+    cursor.execute(
+        "SELECT id, username, email, is_admin, is_active FROM users WHERE id = %s",
+        (user_id,)
+    )
+    return cursor.fetchone()
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), conn = Depends(get_db_dependency)):
+    """获取当前用户"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="无法验证凭据",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
 
     with conn.cursor() as cursor:
-        cursor.execute(
-            "SELECT id, username, email, is_admin, is_active FROM users WHERE id = %s",
-            (user_id,)
-        )
-        user = cursor.fetchone()
+        user = get_user_by_token(cursor, token)
 
     if user is None:
         raise credentials_exception
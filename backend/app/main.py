@@ -1,10 +1,20 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from app.core.config import settings
 from app.routers import auth_router, admin_router, images_router, datasets_router, categories_router
 from app.routers.export import router as export_router
 from app.routers.dataset_configs import router as dataset_configs_router
+from app.routers.session import router as session_router
+from app.services.background import start_periodic, stop_periodic
+from app.services.export_tasks import collect_export_garbage
+from app.services.progress import progress_bus
+from app.services.save_requests import purge_save_requests
+from app.services.history_writer import history_writer, purge_spool_applied
+from app.services.statistics import compact_statistics, reconcile_statistics, reconcile_user_counters
+from app.services.work_stats import work_stats
+from app.services.workers import shutdown_process_pool
 
 app = FastAPI(
     title=settings.APP_NAME,
@@ -19,6 +29,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # 跨域客户端需要读取的响应头（用户列表的分页游标）
+    expose_headers=["X-Next-Cursor"],
 )
 
 # 注册路由
@@ -29,6 +41,38 @@ app.include_router(categories_router)
 app.include_router(images_router)
 app.include_router(export_router)
 app.include_router(dataset_configs_router)
+app.include_router(session_router)
+
+
+@app.on_event("startup")
+async def startup():
+    # 过期导出任务清理与磁盘配额
+    start_periodic("export_gc", settings.EXPORT_GC_INTERVAL_SECONDS, collect_export_garbage)
+    # 管理后台统计：全局计数、按数据集校准汇总表、校准用户计数
+    start_periodic("stats_compact", settings.STATS_COMPACT_INTERVAL_SECONDS, compact_statistics,
+                   run_immediately=True)
+    start_periodic("stats_reconcile", settings.STATS_RECONCILE_INTERVAL_SECONDS, reconcile_statistics)
+    start_periodic("user_counter_reconcile", settings.STATS_USER_RECONCILE_INTERVAL_SECONDS, reconcile_user_counters)
+    # 工作量统计批量写入
+    start_periodic("work_stats_flush", settings.WORK_STATS_FLUSH_INTERVAL_SECONDS, work_stats.flush)
+    # 数据集进度合并计算与推送
+    start_periodic("progress_push", settings.PROGRESS_PUSH_INTERVAL_SECONDS, progress_bus.flush)
+    # 标注历史批量写入（同时读回上次退出时保存的条目）
+    start_periodic("history_flush", settings.HISTORY_FLUSH_INTERVAL_SECONDS, history_writer.flush,
+                   run_immediately=True)
+    # 过期的批量保存幂等键
+    start_periodic("save_requests_purge", 3600, purge_save_requests)
+    # 过期的已写入 spool 文件名
+    start_periodic("history_spool_purge", 3600, purge_spool_applied)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_periodic()
+    # 写入剩余的统计和历史（访问数据库，在线程池中执行，不阻塞事件循环）
+    await run_in_threadpool(work_stats.flush)
+    await run_in_threadpool(history_writer.close)
+    shutdown_process_pool()
 
 
 @app.get("/")
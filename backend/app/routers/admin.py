@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Literal
 from datetime import date, datetime, timedelta
-from app.core import get_db_dependency, get_current_admin, get_password_hash
+import base64
+import csv
+import io
+import json
+import zlib
+from app.core import get_db_dependency, get_current_admin, get_password_hash, iter_query_unbuffered
+from app.services.dwell import histogram_percentile
+from app.services.lookup_cache import lookup_cache
+from app.services.image_derivatives import derivative_stats
+from app.services.progress import progress_bus
+from app.services.statistics import remove_user_statistics
 
 router = APIRouter(prefix="/api/admin", tags=["管理后台"])
 
@@ -65,7 +76,7 @@ async def create_user(
         user_id = cursor.lastrowid
 
         cursor.execute(
-            "SELECT id, username, email, is_admin, is_active, created_at, 0 as images_labeled FROM users WHERE id = %s",
+            "SELECT id, username, email, is_admin, is_active, created_at, images_labeled FROM users WHERE id = %s",
             (user_id,)
         )
         user = cursor.fetchone()
@@ -73,21 +84,88 @@ async def create_user(
     return user
 
 
+# 用户列表可排序的列（均有 (列, id) 索引）
+USER_SORT_COLUMNS = {
+    "id": "id",
+    "username": "username",
+    "created_at": "created_at",
+    "images_labeled": "images_labeled",
+}
+
+
+def encode_cursor(values: list) -> str:
+    """编码分页游标（最后一行的排序值与 ID）"""
+    payload = json.dumps(values, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> list:
+    """解码分页游标"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    if not isinstance(values, list) or len(values) != 2:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    return values
+
+
 @router.get("/users", response_model=List[UserListResponse])
 async def list_users(
+    response: Response,
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    sort: Literal["id", "username", "created_at", "images_labeled"] = "id",
+    order: Literal["asc", "desc"] = "asc",
+    search: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    is_admin: Optional[bool] = None,
     conn = Depends(get_db_dependency),
     current_admin = Depends(get_current_admin)
 ):
-    """获取用户列表"""
-    with conn.cursor() as cursor:
-        cursor.execute("""
-            SELECT u.id, u.username, u.email, u.is_admin, u.is_active, u.created_at,
-                   COALESCE(COUNT(i.id), 0) as images_labeled
-            FROM users u
-            LEFT JOIN images i ON i.labeled_by = u.id
-            GROUP BY u.id
-        """)
-        users = cursor.fetchall()
+    """
+    获取用户列表（键集分页）
+
+    还有下一页时通过响应头 X-Next-Cursor 返回游标，作为下一次请求的 cursor 参数。
+    """
+    column = USER_SORT_COLUMNS[sort]
+    comparator = ">" if order == "asc" else "<"
+
+    sql = """
+        SELECT id, username, email, is_admin, is_active, created_at, images_labeled
+        FROM users
+        WHERE 1=1
+    """
+    params = []
+
+    if search:
+        sql += " AND (username LIKE %s OR email LIKE %s)"
+        params.extend([f"{search}%", f"{search}%"])
+    if is_active is not None:
+        sql += " AND is_active = %s"
+        params.append(is_active)
+    if is_admin is not None:
+        sql += " AND is_admin = %s"
+        params.append(is_admin)
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        sql += f" AND ({column} {comparator} %s OR ({column} = %s AND id {comparator} %s))"
+        params.extend([last_value, last_value, last_id])
+
+    direction = "ASC" if order == "asc" else "DESC"
+    sql += f" ORDER BY {column} {direction}, id {direction} LIMIT %s"
+    # 多取一行判断是否还有下一页
+    params.append(limit + 1)
+
+    with conn.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        users = db_cursor.fetchall()
+
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor([last[sort], last['id']])
 
     return users
 
@@ -159,6 +237,7 @@ async def delete_user(
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="用户不存在")
 
+        remove_user_statistics(cursor, user_id)
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
 
     return {"message": "删除成功"}
@@ -173,6 +252,7 @@ class StatisticsResponse(BaseModel):
     labeled_images: int
     pending_images: int
     total_annotations: int
+    updated_at: Optional[datetime] = None  # 统计汇总时间
 
 
 class DailyStatistics(BaseModel):
@@ -188,38 +268,56 @@ class UserStatistics(BaseModel):
     annotations_created: int
 
 
+class ThroughputStatistics(BaseModel):
+    user_id: int
+    username: str
+    dataset_id: int
+    dataset_name: str
+    images: int
+    boxes: int
+    time_spent: int
+    seconds_per_image: Optional[float]
+    seconds_per_box: Optional[float]
+    image_p50: Optional[float]
+    image_p90: Optional[float]
+    image_p99: Optional[float]
+    box_p50: Optional[float]
+    box_p90: Optional[float]
+    box_p99: Optional[float]
+
+
 @router.get("/statistics/overview", response_model=StatisticsResponse)
 async def get_overview_statistics(
     conn = Depends(get_db_dependency),
     current_admin = Depends(get_current_admin)
 ):
-    """获取整体统计概览"""
+    """获取整体统计概览（读取汇总表，随写入按增量更新）"""
     with conn.cursor() as cursor:
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        total_users = cursor.fetchone()['count']
+        cursor.execute("SELECT name, value, updated_at FROM stats_global")
+        global_stats = {row['name']: row for row in cursor.fetchall()}
 
-        cursor.execute("SELECT COUNT(*) as count FROM datasets WHERE is_active = TRUE")
-        total_datasets = cursor.fetchone()['count']
-
-        cursor.execute("SELECT COUNT(*) as count FROM images")
-        total_images = cursor.fetchone()['count']
-
-        cursor.execute("SELECT COUNT(*) as count FROM images WHERE status = 'labeled'")
-        labeled_images = cursor.fetchone()['count']
-
-        cursor.execute("SELECT COUNT(*) as count FROM images WHERE status = 'pending'")
-        pending_images = cursor.fetchone()['count']
+        cursor.execute("""
+            SELECT COALESCE(SUM(image_count), 0) as total,
+                   COALESCE(SUM(CASE WHEN status = 'labeled' THEN image_count ELSE 0 END), 0) as labeled,
+                   COALESCE(SUM(CASE WHEN status = 'pending' THEN image_count ELSE 0 END), 0) as pending
+            FROM stats_dataset_status
+        """)
+        images = cursor.fetchone()
 
-        cursor.execute("SELECT COUNT(*) as count FROM annotations")
+        cursor.execute("SELECT COALESCE(SUM(annotation_count), 0) as count FROM stats_dataset_category")
         total_annotations = cursor.fetchone()['count']
 
+    total_users = global_stats.get('total_users')
+    total_datasets = global_stats.get('total_datasets')
+
     return StatisticsResponse(
-        total_users=total_users,
-        total_datasets=total_datasets,
-        total_images=total_images,
-        labeled_images=labeled_images,
-        pending_images=pending_images,
-        total_annotations=total_annotations
+        total_users=total_users['value'] if total_users else 0,
+        total_datasets=total_datasets['value'] if total_datasets else 0,
+        total_images=images['total'],
+        labeled_images=images['labeled'],
+        pending_images=images['pending'],
+        total_annotations=total_annotations,
+        updated_at=total_users['updated_at'] if total_users else None
     )
 
 
@@ -236,7 +334,7 @@ async def get_daily_statistics(
     with conn.cursor() as cursor:
         sql = """
             SELECT date, SUM(images_labeled) as images_labeled, SUM(annotations_created) as annotations_created
-            FROM work_statistics
+            FROM stats_daily
             WHERE date >= %s
         """
         params = [start_date]
@@ -268,12 +366,15 @@ async def get_user_statistics(
     current_admin = Depends(get_current_admin)
 ):
     """获取用户工作量统计"""
+    # 不限日期时读取累计汇总表，否则按日期范围汇总明细
+    source = "work_statistics" if start_date or end_date else "stats_user_totals"
+
     with conn.cursor() as cursor:
-        sql = """
+        sql = f"""
             SELECT ws.user_id, u.username,
                    SUM(ws.images_labeled) as images_labeled,
                    SUM(ws.annotations_created) as annotations_created
-            FROM work_statistics ws
+            FROM {source} ws
             JOIN users u ON ws.user_id = u.id
             WHERE 1=1
         """
@@ -304,67 +405,198 @@ async def get_user_statistics(
     ]
 
 
-@router.get("/statistics/export")
-async def export_statistics(
-    format: str = Query(default="csv", pattern="^(csv|json)$"),
+@router.get("/statistics/throughput", response_model=List[ThroughputStatistics])
+async def get_throughput_statistics(
     dataset_id: Optional[int] = None,
-    start_date: Optional[date] = None,
-    end_date: Optional[date] = None,
+    user_id: Optional[int] = None,
     conn = Depends(get_db_dependency),
     current_admin = Depends(get_current_admin)
 ):
-    """导出统计数据"""
-    from fastapi.responses import StreamingResponse
-    import io
-    import csv
-
+    """获取标注吞吐量（每张图片 / 每个标注框的耗时及分位数），按用户和数据集分组"""
     with conn.cursor() as cursor:
         sql = """
-            SELECT ws.date, u.username, d.name as dataset_name,
-                   ws.images_labeled, ws.annotations_created, ws.time_spent
-            FROM work_statistics ws
-            JOIN users u ON ws.user_id = u.id
-            JOIN datasets d ON ws.dataset_id = d.id
+            SELECT h.user_id, u.username, h.dataset_id, d.name as dataset_name,
+                   h.metric, h.bucket, h.samples, h.total_seconds
+            FROM stats_dwell_histogram h
+            JOIN users u ON h.user_id = u.id
+            JOIN datasets d ON h.dataset_id = d.id
             WHERE 1=1
         """
         params = []
 
         if dataset_id:
-            sql += " AND ws.dataset_id = %s"
+            sql += " AND h.dataset_id = %s"
             params.append(dataset_id)
-        if start_date:
-            sql += " AND ws.date >= %s"
-            params.append(start_date)
-        if end_date:
-            sql += " AND ws.date <= %s"
-            params.append(end_date)
+        if user_id:
+            sql += " AND h.user_id = %s"
+            params.append(user_id)
 
-        sql += " ORDER BY ws.date DESC"
         cursor.execute(sql, params)
-        results = cursor.fetchall()
-
+        rows = cursor.fetchall()
+
+    groups = {}
+    for row in rows:
+        group = groups.setdefault((row['user_id'], row['dataset_id']), {
+            "user_id": row['user_id'],
+            "username": row['username'],
+            "dataset_id": row['dataset_id'],
+            "dataset_name": row['dataset_name'],
+            "image": {},
+            "box": {},
+            "image_seconds": 0.0,
+            "box_seconds": 0.0,
+        })
+        group[row['metric']][row['bucket']] = row['samples']
+        group[f"{row['metric']}_seconds"] += row['total_seconds']
+
+    results = []
+    for group in groups.values():
+        images = sum(group["image"].values())
+        boxes = sum(group["box"].values())
+        time_spent = group["image_seconds"]
+        results.append(ThroughputStatistics(
+            user_id=group["user_id"],
+            username=group["username"],
+            dataset_id=group["dataset_id"],
+            dataset_name=group["dataset_name"],
+            images=images,
+            boxes=boxes,
+            time_spent=int(time_spent),
+            seconds_per_image=round(time_spent / images, 2) if images else None,
+            # 只统计有标注框的图片（跳过的图片不计入）
+            seconds_per_box=round(group["box_seconds"] / boxes, 2) if boxes else None,
+            image_p50=histogram_percentile(group["image"], 50),
+            image_p90=histogram_percentile(group["image"], 90),
+            image_p99=histogram_percentile(group["image"], 99),
+            box_p50=histogram_percentile(group["box"], 50),
+            box_p90=histogram_percentile(group["box"], 90),
+            box_p99=histogram_percentile(group["box"], 99)
+        ))
+
+    results.sort(key=lambda r: (r.dataset_id, r.user_id))
+    return results
+
+
+STATISTICS_EXPORT_COLUMNS = [
+    ("date", "日期"),
+    ("username", "用户"),
+    ("dataset_name", "数据集"),
+    ("images_labeled", "标注图片数"),
+    ("annotations_created", "标注框数"),
+    ("time_spent", "花费时间(秒)"),
+]
+
+STATISTICS_EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _statistics_export_chunks(batches, format: str):
+    """将查询结果批次编码为 CSV / JSON 数组 / NDJSON 文本块"""
     if format == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["日期", "用户", "数据集", "标注图片数", "标注框数", "花费时间(秒)"])
-        for r in results:
-            writer.writerow([r['date'], r['username'], r['dataset_name'], r['images_labeled'], r['annotations_created'], r['time_spent']])
-
-        output.seek(0)
-        return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=statistics.csv"}
-        )
-    else:
-        return [
-            {
-                "date": str(r['date']),
-                "username": r['username'],
-                "dataset_name": r['dataset_name'],
-                "images_labeled": r['images_labeled'],
-                "annotations_created": r['annotations_created'],
-                "time_spent": r['time_spent']
-            }
-            for r in results
-        ]
+        header = io.StringIO()
+        csv.writer(header).writerow([title for _, title in STATISTICS_EXPORT_COLUMNS])
+        yield header.getvalue()
+    elif format == "json":
+        yield "["
+
+    first = True
+    for rows in batches:
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for r in rows:
+                writer.writerow([r[key] for key, _ in STATISTICS_EXPORT_COLUMNS])
+            yield buffer.getvalue()
+        else:
+            lines = []
+            for r in rows:
+                item = {key: r[key] for key, _ in STATISTICS_EXPORT_COLUMNS}
+                item["date"] = str(item["date"])
+                lines.append(json.dumps(item, ensure_ascii=False))
+            if format == "json":
+                yield ("" if first else ",") + ",".join(lines)
+            else:
+                yield "\n".join(lines) + "\n"
+        first = False
+
+    if format == "json":
+        yield "]"
+
+
+def _gzip_chunks(chunks):
+    """流式 gzip 压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/statistics/export")
+async def export_statistics(
+    format: str = Query(default="csv", pattern="^(csv|json|ndjson)$"),
+    dataset_id: Optional[int] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    gzip: bool = False,
+    current_admin = Depends(get_current_admin)
+):
+    """
+    导出统计数据（流式输出）
+
+    使用服务端游标逐批读取并直接写入响应，内存占用与数据量无关；gzip=true 时输出 .gz 文件。
+    """
+    sql = """
+        SELECT ws.date, u.username, d.name as dataset_name,
+               ws.images_labeled, ws.annotations_created, ws.time_spent
+        FROM work_statistics ws
+        JOIN users u ON ws.user_id = u.id
+        JOIN datasets d ON ws.dataset_id = d.id
+        WHERE 1=1
+    """
+    params = []
+
+    if dataset_id:
+        sql += " AND ws.dataset_id = %s"
+        params.append(dataset_id)
+    if start_date:
+        sql += " AND ws.date >= %s"
+        params.append(start_date)
+    if end_date:
+        sql += " AND ws.date <= %s"
+        params.append(end_date)
+
+    sql += " ORDER BY ws.date DESC"
+
+    chunks = _statistics_export_chunks(iter_query_unbuffered(sql, params), format)
+    filename = f"statistics.{format}"
+    media_type = STATISTICS_EXPORT_MEDIA_TYPES[format]
+    if gzip:
+        chunks = _gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+# ===================== 缓存 =====================
+
+@router.get("/cache/stats")
+async def get_cache_stats(current_admin = Depends(get_current_admin)):
+    """查询数据集 / 类别 / 配置缓存与图片派生图缓存的命中率，以及进度推送的订阅数（当前 worker）"""
+    return {
+        **lookup_cache.stats(),
+        "image_derivatives": derivative_stats.snapshot(),
+        "progress_push": {
+            "subscribers": progress_bus.subscriber_count(),
+            "computations": progress_bus.computations,
+        },
+    }
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
-from app.core import get_db_dependency, get_current_admin, get_current_user
+from app.core import get_db_dependency, get_current_admin, get_current_user, conditional_response
+from app.services.lookup_cache import lookup_cache, get_dataset, get_categories, CATEGORIES
+from app.services.statistics import remove_category_statistics
 
 router = APIRouter(prefix="/api/categories", tags=["类别"])
 
@@ -35,20 +37,26 @@ class CategoryResponse(BaseModel):
 @router.get("/dataset/{dataset_id}", response_model=List[CategoryResponse])
 async def list_categories(
     dataset_id: int,
+    request: Request,
+    response: Response,
     conn = Depends(get_db_dependency),
     current_user = Depends(get_current_user)
 ):
     """获取数据集的类别列表"""
     with conn.cursor() as cursor:
-        cursor.execute("SELECT id FROM datasets WHERE id = %s", (dataset_id,))
-        if not cursor.fetchone():
+        # 先检查数据集，已删除的数据集不会因客户端缓存返回 304
+        dataset = get_dataset(cursor, dataset_id)
+        if not dataset:
             raise HTTPException(status_code=404, detail="数据集不存在")
 
-        cursor.execute(
-            "SELECT * FROM categories WHERE dataset_id = %s ORDER BY sort_order",
-            (dataset_id,)
+        not_modified = conditional_response(
+            request, response, "categories", dataset_id, dataset['is_active'],
+            lookup_cache.version(cursor, CATEGORIES)
         )
-        categories = cursor.fetchall()
+        if not_modified:
+            return not_modified
+
+        categories = get_categories(cursor, dataset_id)
 
     return categories
 
@@ -62,8 +70,7 @@ async def create_category(
     """创建类别"""
     with conn.cursor() as cursor:
         # 检查数据集是否存在
-        cursor.execute("SELECT id FROM datasets WHERE id = %s", (category_data.dataset_id,))
-        if not cursor.fetchone():
+        if not get_dataset(cursor, category_data.dataset_id):
             raise HTTPException(status_code=404, detail="数据集不存在")
 
         # 检查类别名是否重复
@@ -88,6 +95,7 @@ async def create_category(
             (category_data.dataset_id, category_data.name, category_data.shortcut_key, category_data.color, category_data.sort_order)
         )
         category_id = cursor.lastrowid
+        lookup_cache.invalidate(cursor, CATEGORIES)
 
         cursor.execute("SELECT * FROM categories WHERE id = %s", (category_id,))
         category = cursor.fetchone()
@@ -145,6 +153,7 @@ async def update_category(
         if updates:
             params.append(category_id)
             cursor.execute(f"UPDATE categories SET {', '.join(updates)} WHERE id = %s", params)
+            lookup_cache.invalidate(cursor, CATEGORIES)
 
         cursor.execute("SELECT * FROM categories WHERE id = %s", (category_id,))
         category = cursor.fetchone()
@@ -164,7 +173,9 @@ async def delete_category(
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="类别不存在")
 
+        remove_category_statistics(cursor, category_id)
         cursor.execute("DELETE FROM categories WHERE id = %s", (category_id,))
+        lookup_cache.invalidate(cursor, CATEGORIES)
 
     return {"message": "删除成功"}
 
@@ -182,8 +193,7 @@ async def batch_create_categories(
     dataset_id = categories[0].dataset_id
 
     with conn.cursor() as cursor:
-        cursor.execute("SELECT id FROM datasets WHERE id = %s", (dataset_id,))
-        if not cursor.fetchone():
+        if not get_dataset(cursor, dataset_id):
             raise HTTPException(status_code=404, detail="数据集不存在")
 
         created_ids = []
@@ -196,6 +206,7 @@ async def batch_create_categories(
                 (cat_data.dataset_id, cat_data.name, cat_data.shortcut_key, cat_data.color, cat_data.sort_order)
             )
             created_ids.append(cursor.lastrowid)
+        lookup_cache.invalidate(cursor, CATEGORIES)
 
         cursor.execute(
             f"SELECT * FROM categories WHERE id IN ({','.join(['%s'] * len(created_ids))})",
@@ -220,13 +231,11 @@ async def import_from_dataset(
     """从其他数据集导入类别"""
     with conn.cursor() as cursor:
         # 检查目标数据集是否存在
-        cursor.execute("SELECT id FROM datasets WHERE id = %s", (dataset_id,))
-        if not cursor.fetchone():
+        if not get_dataset(cursor, dataset_id):
             raise HTTPException(status_code=404, detail="目标数据集不存在")
 
         # 检查源数据集是否存在
-        cursor.execute("SELECT id FROM datasets WHERE id = %s", (data.source_dataset_id,))
-        if not cursor.fetchone():
+        if not get_dataset(cursor, data.source_dataset_id):
             raise HTTPException(status_code=404, detail="源数据集不存在")
 
         # 获取源数据集的类别
@@ -276,6 +285,9 @@ async def import_from_dataset(
                 existing_keys.add(shortcut_key)
             existing_names.add(cat['name'])
 
+        if imported:
+            lookup_cache.invalidate(cursor, CATEGORIES)
+
     return {
         "message": f"成功导入 {imported} 个类别，跳过 {skipped} 个已存在的类别",
         "imported": imported,
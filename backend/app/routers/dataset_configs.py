@@ -1,16 +1,19 @@
 """数据集配置 API"""
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
 
-from app.core import get_db_dependency, get_current_user, get_current_admin
+from app.core import get_db_dependency, get_current_user, get_current_admin, conditional_response
+from app.services import lookup_cache as lookups
 from app.services.dji_roco_parser import (
     get_default_categories,
     import_dji_roco_annotations,
     find_xml_for_image
 )
+from app.services.statistics import adjust_dataset_category
+from app.routers.images import bump_annotation_version
 
 router = APIRouter(prefix="/api/dataset-configs", tags=["数据集配置"])
 
@@ -47,16 +50,25 @@ class DatasetConfigResponse(BaseModel):
 @router.get("/{dataset_id}")
 async def get_dataset_config(
     dataset_id: int,
+    request: Request,
+    response: Response,
     conn=Depends(get_db_dependency),
     current_user=Depends(get_current_user)
 ):
     """获取数据集配置"""
     with conn.cursor() as cursor:
-        cursor.execute(
-            "SELECT * FROM dataset_configs WHERE dataset_id = %s",
-            (dataset_id,)
+        # 先检查数据集，已删除的数据集不会因客户端缓存返回 304
+        if not lookups.get_dataset(cursor, dataset_id):
+            raise HTTPException(status_code=404, detail="数据集不存在")
+
+        not_modified = conditional_response(
+            request, response, "dataset_config", dataset_id,
+            lookups.lookup_cache.version(cursor, lookups.DATASET_CONFIGS)
         )
-        config = cursor.fetchone()
+        if not_modified:
+            return not_modified
+
+        config = lookups.get_dataset_config(cursor, dataset_id)
 
     if not config:
         # 返回默认配置
@@ -81,11 +93,7 @@ async def create_or_update_config(
     """创建或更新数据集配置"""
     with conn.cursor() as cursor:
         # 检查数据集是否存在
-        cursor.execute(
-            "SELECT id FROM datasets WHERE id = %s",
-            (data.dataset_id,)
-        )
-        if not cursor.fetchone():
+        if not lookups.get_dataset(cursor, data.dataset_id):
             raise HTTPException(status_code=404, detail="数据集不存在")
 
         # 检查是否已有配置
@@ -116,6 +124,7 @@ async def create_or_update_config(
                 (data.dataset_id, data.format_type, data.annotation_path,
                  data.source_width, data.source_height, data.auto_import_annotations)
             )
+        lookups.lookup_cache.invalidate(cursor, lookups.DATASET_CONFIGS)
 
         cursor.execute(
             "SELECT * FROM dataset_configs WHERE dataset_id = %s",
@@ -169,6 +178,7 @@ async def update_config(
                 f"UPDATE dataset_configs SET {', '.join(updates)} WHERE dataset_id = %s",
                 tuple(values)
             )
+            lookups.lookup_cache.invalidate(cursor, lookups.DATASET_CONFIGS)
 
         cursor.execute(
             "SELECT * FROM dataset_configs WHERE dataset_id = %s",
@@ -199,11 +209,7 @@ async def copy_config_from(
             raise HTTPException(status_code=404, detail="源数据集配置不存在")
 
         # 检查目标数据集是否存在
-        cursor.execute(
-            "SELECT id FROM datasets WHERE id = %s",
-            (dataset_id,)
-        )
-        if not cursor.fetchone():
+        if not lookups.get_dataset(cursor, dataset_id):
             raise HTTPException(status_code=404, detail="目标数据集不存在")
 
         # 删除现有配置
@@ -221,6 +227,7 @@ async def copy_config_from(
              source_config['source_width'], source_config['source_height'],
              source_config['auto_import_annotations'])
         )
+        lookups.lookup_cache.invalidate(cursor, lookups.DATASET_CONFIGS)
 
         cursor.execute(
             "SELECT * FROM dataset_configs WHERE dataset_id = %s",
@@ -239,11 +246,7 @@ async def get_format_default_categories(
 ):
     """获取数据集格式的默认类别"""
     with conn.cursor() as cursor:
-        cursor.execute(
-            "SELECT format_type FROM dataset_configs WHERE dataset_id = %s",
-            (dataset_id,)
-        )
-        config = cursor.fetchone()
+        config = lookups.get_dataset_config(cursor, dataset_id)
 
     format_type = config['format_type'] if config else 'yolo'
 
@@ -262,11 +265,7 @@ async def import_default_categories(
     """导入数据集格式的默认类别"""
     with conn.cursor() as cursor:
         # 获取配置
-        cursor.execute(
-            "SELECT format_type FROM dataset_configs WHERE dataset_id = %s",
-            (dataset_id,)
-        )
-        config = cursor.fetchone()
+        config = lookups.get_dataset_config(cursor, dataset_id)
 
         if not config or config['format_type'] != 'dji_roco':
             raise HTTPException(status_code=400, detail="仅支持 DJI ROCO 格式")
@@ -290,6 +289,9 @@ async def import_default_categories(
             )
             imported += 1
 
+        if imported:
+            lookups.lookup_cache.invalidate(cursor, lookups.CATEGORIES)
+
     return {"message": f"成功导入 {imported} 个类别", "imported": imported}
 
 
@@ -302,21 +304,13 @@ async def import_annotations_for_dataset(
     """为数据集中的图片导入标注"""
     with conn.cursor() as cursor:
         # 获取配置
-        cursor.execute(
-            "SELECT * FROM dataset_configs WHERE dataset_id = %s",
-            (dataset_id,)
-        )
-        config = cursor.fetchone()
+        config = lookups.get_dataset_config(cursor, dataset_id)
 
         if not config or config['format_type'] != 'dji_roco':
             raise HTTPException(status_code=400, detail="仅支持 DJI ROCO 格式")
 
         # 获取类别映射
-        cursor.execute(
-            "SELECT id, name FROM categories WHERE dataset_id = %s",
-            (dataset_id,)
-        )
-        categories = cursor.fetchall()
+        categories = lookups.get_categories(cursor, dataset_id)
         category_map = {c['name']: c['id'] for c in categories}
 
         # 获取待处理的图片
@@ -327,6 +321,8 @@ async def import_annotations_for_dataset(
         images = cursor.fetchall()
 
         imported_count = 0
+        category_delta = {}
+        imported_image_ids = []
         for image in images:
             annotations = import_dji_roco_annotations(
                 image['id'],
@@ -345,6 +341,15 @@ async def import_annotations_for_dataset(
                      ann['width'], ann['height'], current_user['id'])
                 )
                 imported_count += 1
+                category_delta[ann['category_id']] = category_delta.get(ann['category_id'], 0) + 1
+            if annotations:
+                imported_image_ids.append(image['id'])
+
+        bump_annotation_version(cursor, imported_image_ids)
+
+        adjust_dataset_category(cursor, {
+            (dataset_id, category_id): count for category_id, count in category_delta.items()
+        })
 
     return {
         "message": f"成功导入 {imported_count} 个标注",
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
 import os
 import json
-from app.core import get_db_dependency, get_current_admin, get_current_user, settings, get_connection
+from app.core import (
+    get_db_dependency, get_current_admin, get_current_user, settings, get_connection, conditional_response
+)
+from app.services.lookup_cache import lookup_cache, DATASETS, NAMESPACES
+from app.services.statistics import adjust_dataset_status, release_dataset_labels, remove_dataset_statistics
 
 router = APIRouter(prefix="/api/datasets", tags=["数据集"])
 
@@ -45,11 +49,31 @@ class ScanResult(BaseModel):
 
 @router.get("", response_model=List[DatasetResponse])
 async def list_datasets(
+    request: Request,
+    response: Response,
     conn = Depends(get_db_dependency),
     current_user = Depends(get_current_user)
 ):
     """获取数据集列表"""
     with conn.cursor() as cursor:
+        # 计数列的变化会刷新 updated_at；名称等修改由 cache_versions 的版本号覆盖（同一秒内的多次修改）；
+        # 数据集 ID 之和与已激活数据集的 ID 之和直接计入 ETag，新增、删除、启用 / 停用后不会返回 304
+        cursor.execute(
+            """SELECT COUNT(*) as count, MAX(updated_at) as updated_at, SUM(labeled_images) as labeled,
+                      SUM(id) as ids,
+                      SUM(CASE WHEN is_active THEN id ELSE 0 END) as active_ids,
+                      (SELECT version FROM cache_versions WHERE name = 'datasets') as version
+               FROM datasets"""
+        )
+        marker = cursor.fetchone()
+        not_modified = conditional_response(
+            request, response, "datasets", current_user['is_admin'],
+            marker['count'], marker['updated_at'], marker['labeled'],
+            marker['ids'], marker['active_ids'], marker['version']
+        )
+        if not_modified:
+            return not_modified
+
         if current_user['is_admin']:
             cursor.execute("SELECT * FROM datasets")
         else:
@@ -101,6 +125,7 @@ async def create_dataset(
             (dataset_data.name, dataset_data.description, dataset_data.image_path, dataset_data.label_path)
         )
         dataset_id = cursor.lastrowid
+        lookup_cache.invalidate(cursor, DATASETS)
 
         cursor.execute("SELECT * FROM datasets WHERE id = %s", (dataset_id,))
         dataset = cursor.fetchone()
@@ -145,6 +170,7 @@ async def update_dataset(
         if updates:
             params.append(dataset_id)
             cursor.execute(f"UPDATE datasets SET {', '.join(updates)} WHERE id = %s", params)
+            lookup_cache.invalidate(cursor, DATASETS)
 
         cursor.execute("SELECT * FROM datasets WHERE id = %s", (dataset_id,))
         dataset = cursor.fetchone()
@@ -164,7 +190,11 @@ async def delete_dataset(
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="数据集不存在")
 
+        release_dataset_labels(cursor, dataset_id)
+        remove_dataset_statistics(cursor, dataset_id)
         cursor.execute("DELETE FROM datasets WHERE id = %s", (dataset_id,))
+        # 类别与配置随数据集级联删除
+        lookup_cache.invalidate(cursor, *NAMESPACES)
 
     return {"message": "删除成功"}
 
@@ -225,6 +255,7 @@ async def scan_dataset(
             imported += 1
 
         # 更新数据集统计
+        adjust_dataset_status(cursor, {(dataset_id, 'pending'): imported})
         cursor.execute("SELECT COUNT(*) as count FROM images WHERE dataset_id = %s", (dataset_id,))
         total = cursor.fetchone()['count']
 
@@ -372,9 +403,13 @@ async def batch_import_datasets(
                         "UPDATE datasets SET total_images = %s, labeled_images = 0 WHERE id = %s",
                         (images_imported, dataset_id)
                     )
+                    adjust_dataset_status(cursor, {(dataset_id, 'pending'): images_imported})
 
                     total_images_imported += images_imported
                     conn.commit()
+                    # 导入提交后在单独的短事务中递增缓存版本，不在导入期间持有 cache_versions 的行锁
+                    lookup_cache.invalidate(cursor, DATASETS)
+                    conn.commit()
 
                     yield f"data: {json.dumps({'status': 'importing', 'current_folder': dataset_name, 'total_folders': total_folders, 'processed_folders': idx + 1, 'datasets_created': datasets_created, 'total_images_imported': total_images_imported, 'message': f'{dataset_name}: 导入 {images_imported} 张图片'})}\n\n"
 
@@ -1,15 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from typing import Optional, Literal
+from typing import List, Optional, Literal
 from enum import Enum
 import os
-import tempfile
 import shutil
 import zipfile
 import json
 from datetime import datetime
-from app.core import get_db_dependency, get_current_admin
+from app.core import get_db_dependency, get_current_admin, settings
+from app.services.export_cache import (
+    get_dataset_version,
+    make_export_cache_key,
+    get_cached_export,
+    store_export
+)
+from app.services.export_tasks import ExportDirs, create_export_task, export_dirs_dependency, get_export_task
+from app.services.tar_shards import TarShardWriter
+from app.services.coco_writer import CocoJsonWriter
+from app.services.export_images import ExportImageWriter
+from app.services.zip_volumes import MANIFEST_SUFFIX, write_volumes
+from app.services.annotation_table import AnnotationTableBuilder, check_table_format
 
 router = APIRouter(prefix="/api/export", tags=["导出"])
 
@@ -18,16 +29,34 @@ class ExportFormat(str, Enum):
     YOLOV8 = "yolov8"      # YOLOv5/v7/v8 (Ultralytics)
     DARKNET = "darknet"    # YOLOv3/v4 (Darknet)
     COCO = "coco"          # COCO JSON
+    WEBDATASET = "webdataset"  # WebDataset tar 分片
 
 
 class ExportRequest(BaseModel):
-    dataset_id: int
+    dataset_id: Optional[int] = None
+    dataset_ids: Optional[List[int]] = None  # 多个数据集合并导出
     format: ExportFormat = ExportFormat.YOLOV8
     output_name: Optional[str] = None
     train_ratio: float = 0.8
     val_ratio: float = 0.1
     test_ratio: float = 0.1
     include_unlabeled: bool = False
+    statuses: Optional[List[Literal["pending", "assigned", "labeled", "skipped"]]] = None  # 指定时覆盖 include_unlabeled
+    category_names: Optional[List[str]] = None  # 只导出这些类别（按名称）
+    labeled_by: Optional[List[int]] = None  # 标注人筛选
+    labeled_from: Optional[datetime] = None  # 标注时间范围
+    labeled_to: Optional[datetime] = None
+    shard_size_mb: int = 256  # WebDataset 单个分片大小上限
+    table_format: Optional[Literal["parquet", "npz"]] = None  # 额外导出列式标注表
+    pretty_json: bool = False  # COCO JSON 是否换行排版（默认紧凑输出）
+    volume_size_mb: Optional[int] = None  # 分卷大小，为空时生成单个 ZIP
+    image_size: Optional[int] = None  # 导出图片目标尺寸（长边），为空时复制原图
+    resize_mode: Literal["letterbox", "resize"] = "letterbox"
+    image_format: Optional[Literal["jpeg", "webp"]] = None  # 为空时保持原格式
+    image_quality: int = 90
+    tile_size: Optional[int] = None  # 切片窗口边长（像素），为空时不切片
+    tile_overlap: float = 0.2  # 相邻切片重叠比例
+    tile_min_visibility: float = 0.3  # 标注框可见面积比例低于该值时丢弃
 
 
 class ExportResponse(BaseModel):
@@ -39,10 +68,8 @@ class ExportResponse(BaseModel):
     categories: int
     format: str
     download_url: str
-
-
-# 存储导出任务状态
-export_tasks = {}
+    cached: bool = False
+    volumes: Optional[List[dict]] = None  # 分卷导出时的分卷列表（含校验和与下载地址）
 
 
 def get_export_formats():
@@ -51,6 +78,7 @@ def get_export_formats():
         {"id": "yolov8", "name": "YOLOv5/v7/v8 (Ultralytics)", "description": "适用于 Ultralytics YOLO 系列，使用 data.yaml 配置"},
         {"id": "darknet", "name": "YOLO Darknet (v3/v4)", "description": "适用于原版 Darknet YOLO，使用 .names 和 .data 配置"},
         {"id": "coco", "name": "COCO JSON", "description": "通用格式，适用于多种框架（Detectron2, MMDetection 等）"},
+        {"id": "webdataset", "name": "WebDataset (tar 分片)", "description": "图片与标签按顺序打包为固定大小的 tar 分片，适合大规模训练的流式读取"},
     ]
 
 
@@ -64,43 +92,84 @@ async def list_export_formats():
 async def export_dataset(
     request: ExportRequest,
     conn = Depends(get_db_dependency),
-    current_admin = Depends(get_current_admin)
+    current_admin = Depends(get_current_admin),
+    export_dirs: ExportDirs = Depends(export_dirs_dependency)
 ):
     """导出数据集（支持多种格式）"""
     # 验证比例
     total_ratio = request.train_ratio + request.val_ratio + request.test_ratio
     if abs(total_ratio - 1.0) > 0.01:
         raise HTTPException(status_code=400, detail="分割比例之和必须为1")
+    if request.shard_size_mb <= 0:
+        raise HTTPException(status_code=400, detail="分片大小必须大于0")
+    if request.volume_size_mb is not None and request.volume_size_mb <= 0:
+        raise HTTPException(status_code=400, detail="分卷大小必须大于0")
+    if request.image_size is not None and request.image_size <= 0:
+        raise HTTPException(status_code=400, detail="图片尺寸必须大于0")
+    if not 1 <= request.image_quality <= 100:
+        raise HTTPException(status_code=400, detail="图片质量必须在 1-100 之间")
+    if request.tile_size is not None and request.tile_size <= 0:
+        raise HTTPException(status_code=400, detail="切片尺寸必须大于0")
+    if not 0 <= request.tile_overlap < 1:
+        raise HTTPException(status_code=400, detail="切片重叠比例必须在 0-1 之间")
+    if not 0 <= request.tile_min_visibility <= 1:
+        raise HTTPException(status_code=400, detail="最小可见比例必须在 0-1 之间")
+    if request.table_format and not check_table_format(request.table_format):
+        raise HTTPException(status_code=400, detail=f"服务器未安装 {request.table_format} 导出所需的依赖")
+
+    dataset_ids = get_request_dataset_ids(request)
+    if not dataset_ids:
+        raise HTTPException(status_code=400, detail="请选择要导出的数据集")
+    dataset_placeholders = ','.join(['%s'] * len(dataset_ids))
 
     with conn.cursor() as cursor:
         # 获取数据集
-        cursor.execute("SELECT * FROM datasets WHERE id = %s", (request.dataset_id,))
-        dataset = cursor.fetchone()
-        if not dataset:
+        cursor.execute(f"SELECT * FROM datasets WHERE id IN ({dataset_placeholders})", dataset_ids)
+        datasets = {row['id']: row for row in cursor.fetchall()}
+        if len(datasets) != len(dataset_ids):
             raise HTTPException(status_code=404, detail="数据集不存在")
 
-        # 获取类别
+        # 获取类别，多个数据集按名称合并为统一的类别索引
         cursor.execute(
-            "SELECT * FROM categories WHERE dataset_id = %s ORDER BY sort_order",
-            (request.dataset_id,)
+            f"SELECT * FROM categories WHERE dataset_id IN ({dataset_placeholders}) ORDER BY sort_order, id",
+            dataset_ids
         )
-        categories = cursor.fetchall()
-        category_map = {cat['id']: idx for idx, cat in enumerate(categories)}
-
-        # 获取图片
-        if request.include_unlabeled:
-            cursor.execute("SELECT * FROM images WHERE dataset_id = %s", (request.dataset_id,))
+        dataset_categories = cursor.fetchall()
+        dataset_order = {dataset_id: idx for idx, dataset_id in enumerate(dataset_ids)}
+        dataset_categories.sort(key=lambda cat: dataset_order[cat['dataset_id']])
+        categories, category_map = unify_categories(dataset_categories, request.category_names)
+        if request.category_names:
+            missing = set(request.category_names) - {cat['name'] for cat in categories}
+            if missing:
+                raise HTTPException(status_code=400, detail=f"类别不存在: {', '.join(sorted(missing))}")
+
+        if request.output_name:
+            output_name = request.output_name
         else:
-            cursor.execute("SELECT * FROM images WHERE dataset_id = %s AND status = 'labeled'", (request.dataset_id,))
-        images = cursor.fetchall()
+            output_name = "dataset_" + "_".join(str(dataset_id) for dataset_id in dataset_ids)
+
+        # 筛选条件下推到 SQL（图片按批次读取，不一次性载入内存）
+        image_filter, image_params, annotation_filter, annotation_params = build_export_filters(
+            request, dataset_ids, list(category_map.keys())
+        )
 
-        total = len(images)
+        # 相同导出内容版本 + 相同参数直接复用已缓存的产物
+        cache_key = None
+        if settings.EXPORT_CACHE_ENABLED:
+            dataset_version = get_dataset_version(cursor, image_filter, image_params,
+                                                  annotation_filter, annotation_params, dataset_categories)
+            cache_key = make_export_cache_key(dataset_version, request.model_dump(mode="json"))
+            cached = get_cached_export(cache_key)
+            if cached:
+                return register_export(cursor, dataset_ids, cached, None, current_admin, cached=True)
+
+        cursor.execute(f"SELECT COUNT(*) as count FROM images WHERE {image_filter}", image_params)
+        total = cursor.fetchone()['count']
         if total == 0:
             raise HTTPException(status_code=400, detail="没有可导出的图片")
 
         # 创建临时目录
-        export_dir = tempfile.mkdtemp(prefix=f"{request.format.value}_export_")
-        output_name = request.output_name or f"dataset_{request.dataset_id}"
+        export_dir = export_dirs.create(prefix=f"{request.format.value}_export_")
         output_path = os.path.join(export_dir, output_name)
         os.makedirs(output_path, exist_ok=True)
 
@@ -108,46 +177,236 @@ async def export_dataset(
         train_end = int(total * request.train_ratio)
         val_end = train_end + int(total * request.val_ratio)
 
+        # 图片与标注按批次流式读取，各导出器和标注表共用同一数据流
+        # 多个数据集合并时文件名加上数据集 ID 前缀，避免重名
+        rows = iter_export_rows(cursor, image_filter, image_params, train_end, val_end,
+                                annotation_filter, annotation_params,
+                                prefix_dataset=len(dataset_ids) > 1)
+        # 标注表记录各导出器实际写出的样本（切片 / 缩放之后）
+        table = AnnotationTableBuilder(category_map) if request.table_format else None
+
+        # 导出图片的切片 / 缩放 / letterbox / 转码
+        images_out = ExportImageWriter(request.image_size, request.resize_mode,
+                                       request.image_format, request.image_quality,
+                                       request.tile_size, request.tile_overlap,
+                                       request.tile_min_visibility)
+
         # 根据格式导出
         if request.format == ExportFormat.YOLOV8:
-            stats = export_yolov8(output_path, images, categories, category_map,
-                                  train_end, val_end, cursor)
+            stats = export_yolov8(output_path, rows, categories, category_map, images_out, table)
         elif request.format == ExportFormat.DARKNET:
-            stats = export_darknet(output_path, images, categories, category_map,
-                                   train_end, val_end, cursor)
+            stats = export_darknet(output_path, rows, categories, category_map, images_out, table)
         elif request.format == ExportFormat.COCO:
-            stats = export_coco(output_path, images, categories, category_map,
-                               train_end, val_end, cursor, dataset['name'])
-
-        # 创建ZIP文件
-        zip_path = os.path.join(export_dir, f"{output_name}.zip")
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            dataset_name = ", ".join(datasets[dataset_id]['name'] for dataset_id in dataset_ids)
+            stats = export_coco(output_path, rows, categories, category_map, images_out, dataset_name,
+                                request.pretty_json, table)
+        elif request.format == ExportFormat.WEBDATASET:
+            stats = export_webdataset(output_path, rows, categories, category_map, images_out,
+                                      request.shard_size_mb, table)
+
+        if table:
+            table.write(os.path.join(output_path, f"annotations.{request.table_format}"), request.table_format)
+
+    # 创建ZIP文件（产物单独放在 artifact 目录，便于移入缓存）
+    artifact_dir = os.path.join(export_dir, "artifact")
+    os.makedirs(artifact_dir, exist_ok=True)
+    # tar 分片中多为已压缩的图片，直接存储避免无效的二次压缩
+    compression = zipfile.ZIP_STORED if request.format == ExportFormat.WEBDATASET else zipfile.ZIP_DEFLATED
+    if request.volume_size_mb:
+        # 分卷：各卷在进程池中并行压缩，产物为清单文件 + 分卷
+        zip_path = write_volumes(output_path, export_dir, artifact_dir, output_name,
+                                 request.volume_size_mb * 1024 * 1024, compression)
+        zip_filename = os.path.basename(zip_path)
+    else:
+        zip_filename = f"{output_name}.zip"
+        zip_path = os.path.join(artifact_dir, zip_filename)
+        with zipfile.ZipFile(zip_path, 'w', compression) as zipf:
             for root, dirs, files in os.walk(output_path):
                 for file in files:
                     file_path = os.path.join(root, file)
                     arcname = os.path.relpath(file_path, export_dir)
                     zipf.write(file_path, arcname)
 
-        # 存储导出任务信息
-        task_id = f"export_{request.dataset_id}_{os.path.basename(export_dir)}"
-        export_tasks[task_id] = {
-            "zip_path": zip_path,
-            "export_dir": export_dir
-        }
+    result = {
+        "filename": zip_filename,
+        "total_images": total,
+        "train_images": stats["train"],
+        "val_images": stats["val"],
+        "test_images": stats["test"],
+        "total_annotations": stats["annotations"],
+        "categories": len(categories),
+        "format": request.format.value,
+        "zip_path": zip_path
+    }
+
+    if cache_key:
+        result = store_export(cache_key, artifact_dir, {k: v for k, v in result.items() if k != "zip_path"})
+        shutil.rmtree(export_dir, ignore_errors=True)
+        export_dir = None
+
+    with conn.cursor() as cursor:
+        return register_export(cursor, dataset_ids, result, export_dir, current_admin)
+
+
+def get_request_dataset_ids(request: ExportRequest) -> List[int]:
+    """合并 dataset_id 与 dataset_ids，去重并保持顺序"""
+    dataset_ids = list(request.dataset_ids or [])
+    if request.dataset_id is not None:
+        dataset_ids.insert(0, request.dataset_id)
+    return list(dict.fromkeys(dataset_ids))
+
+
+def unify_categories(dataset_categories: List[dict], category_names: Optional[List[str]] = None):
+    """
+    按名称合并多个数据集的类别
+
+    Args:
+        dataset_categories: 各数据集的类别，按数据集顺序和 sort_order 排列
+        category_names: 只保留这些类别，为空时保留全部
+
+    Returns:
+        (categories, category_map)：合并后的类别列表，以及类别 ID -> 统一类别索引
+    """
+    categories = []
+    index_by_name = {}
+    category_map = {}
+    for cat in dataset_categories:
+        if category_names and cat['name'] not in category_names:
+            continue
+        if cat['name'] not in index_by_name:
+            index_by_name[cat['name']] = len(categories)
+            categories.append({"name": cat['name']})
+        category_map[cat['id']] = index_by_name[cat['name']]
+    return categories, category_map
+
+
+def build_export_filters(request: ExportRequest, dataset_ids: List[int], category_ids: List[int]):
+    """
+    构造导出的图片与标注筛选条件
+
+    Returns:
+        (image_filter, image_params, annotation_filter, annotation_params)
+    """
+    image_filter = f"dataset_id IN ({','.join(['%s'] * len(dataset_ids))})"
+    image_params = list(dataset_ids)
+
+    if request.statuses:
+        image_filter += f" AND status IN ({','.join(['%s'] * len(request.statuses))})"
+        image_params.extend(request.statuses)
+    elif not request.include_unlabeled:
+        image_filter += " AND status = 'labeled'"
+
+    if request.labeled_by:
+        image_filter += f" AND labeled_by IN ({','.join(['%s'] * len(request.labeled_by))})"
+        image_params.extend(request.labeled_by)
+    if request.labeled_from:
+        image_filter += " AND labeled_at >= %s"
+        image_params.append(request.labeled_from)
+    if request.labeled_to:
+        image_filter += " AND labeled_at <= %s"
+        image_params.append(request.labeled_to)
+
+    annotation_filter = ""
+    annotation_params = []
+    if request.category_names:
+        category_placeholders = ','.join(['%s'] * len(category_ids)) or "NULL"
+        # 只导出包含所选类别的图片，且只读取所选类别的标注
+        image_filter += (
+            " AND EXISTS (SELECT 1 FROM annotations a WHERE a.image_id = images.id"
+            f" AND a.category_id IN ({category_placeholders}))"
+        )
+        image_params.extend(category_ids)
+        annotation_filter = f" AND category_id IN ({category_placeholders})"
+        annotation_params = list(category_ids)
+
+    return image_filter, image_params, annotation_filter, annotation_params
+
+
+def iter_export_rows(cursor, image_filter, image_params, train_end, val_end,
+                     annotation_filter="", annotation_params=(), prefix_dataset=False, batch_size=500):
+    """
+    按 ID 顺序分批读取图片及其标注，内存占用与数据集大小无关
+
+    Args:
+        image_filter: images 表的 WHERE 条件
+        image_params: 条件参数
+        annotation_filter: annotations 表的附加条件（以 AND 开头）
+        annotation_params: 附加条件参数
+        prefix_dataset: 文件名是否加上数据集 ID 前缀（多数据集合并导出时使用）
+
+    Yields:
+        (split, image, annotations)
+    """
+    last_id = 0
+    idx = 0
+    while True:
+        cursor.execute(
+            f"SELECT * FROM images WHERE {image_filter} AND id > %s ORDER BY id LIMIT %s",
+            [*image_params, last_id, batch_size]
+        )
+        batch = cursor.fetchall()
+        if not batch:
+            break
+        last_id = batch[-1]['id']
+
+        image_ids = [image['id'] for image in batch]
+        cursor.execute(
+            f"SELECT * FROM annotations WHERE image_id IN ({','.join(['%s'] * len(image_ids))})"
+            f"{annotation_filter} ORDER BY id",
+            [*image_ids, *annotation_params]
+        )
+        annotations_by_image = {}
+        for ann in cursor.fetchall():
+            annotations_by_image.setdefault(ann['image_id'], []).append(ann)
+
+        for image in batch:
+            split = "train" if idx < train_end else ("val" if idx < val_end else "test")
+            idx += 1
+            if prefix_dataset:
+                image['filename'] = f"{image['dataset_id']}_{image['filename']}"
+            yield split, image, annotations_by_image.get(image['id'], [])
+
+
+def write_label_file(label_path, boxes):
+    """写出 YOLO 格式标签文件"""
+    with open(label_path, "w") as f:
+        for class_id, x_center, y_center, width, height in boxes:
+            f.write(f"{class_id} {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+
+
+def register_export(cursor, dataset_ids: List[int], result: dict, export_dir: Optional[str],
+                    current_admin: dict, cached: bool = False) -> ExportResponse:
+    """登记导出任务并生成响应；export_dir 为 None 表示产物归缓存所有"""
+    # 合并导出时任务记录第一个数据集
+    task_id = create_export_task(
+        cursor, dataset_ids[0], result["format"], result["filename"],
+        result["zip_path"], export_dir, current_admin['id']
+    )
+
+    volumes = None
+    if result["filename"].endswith(MANIFEST_SUFFIX):
+        with open(result["zip_path"], "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        volumes = [
+            {**volume, "download_url": f"/api/export/download/{task_id}/volumes/{volume['index']}"}
+            for volume in manifest["volumes"]
+        ]
 
     return ExportResponse(
-        total_images=total,
-        train_images=stats["train"],
-        val_images=stats["val"],
-        test_images=stats["test"],
-        total_annotations=stats["annotations"],
-        categories=len(categories),
-        format=request.format.value,
-        download_url=f"/api/export/download/{task_id}"
+        total_images=result["total_images"],
+        train_images=result["train_images"],
+        val_images=result["val_images"],
+        test_images=result["test_images"],
+        total_annotations=result["total_annotations"],
+        categories=result["categories"],
+        format=result["format"],
+        download_url=f"/api/export/download/{task_id}",
+        cached=cached,
+        volumes=volumes
     )
 
 
-def export_yolov8(output_path, images, categories, category_map, train_end, val_end, cursor):
+def export_yolov8(output_path, rows, categories, category_map, images_out, table=None):
     """导出为 YOLOv5/v7/v8 格式"""
     # 创建目录结构
     for split in ["train", "val", "test"]:
@@ -170,33 +429,26 @@ names: {names}
 
     stats = {"train": 0, "val": 0, "test": 0, "annotations": 0}
 
-    for idx, image in enumerate(images):
-        split = "train" if idx < train_end else ("val" if idx < val_end else "test")
-
-        # 复制图片
-        src_path = image['file_path']
-        if os.path.exists(src_path):
-            shutil.copy2(src_path, os.path.join(output_path, "images", split, image['filename']))
-            stats[split] += 1
-
-        # 创建标签文件
-        cursor.execute("SELECT * FROM annotations WHERE image_id = %s", (image['id'],))
-        annotations = cursor.fetchall()
-
-        label_filename = os.path.splitext(image['filename'])[0] + ".txt"
-        label_path = os.path.join(output_path, "labels", split, label_filename)
-
-        with open(label_path, "w") as f:
-            for ann in annotations:
-                if ann['category_id'] in category_map:
-                    class_id = category_map[ann['category_id']]
-                    f.write(f"{class_id} {ann['x_center']:.6f} {ann['y_center']:.6f} {ann['width']:.6f} {ann['height']:.6f}\n")
-                    stats["annotations"] += 1
-
+    for split, image, annotations in rows:
+        src_exists = os.path.exists(image['file_path'])
+        for sample in images_out.samples(image, annotations, category_map):
+            # 复制图片
+            if src_exists:
+                images_out.write(sample, os.path.join(output_path, "images", split, sample.filename))
+                stats[split] += 1
+                if table:
+                    table.add_sample(split, image, annotations, sample)
+
+            # 创建标签文件
+            label_filename = os.path.splitext(sample.filename)[0] + ".txt"
+            write_label_file(os.path.join(output_path, "labels", split, label_filename), sample.boxes)
+            stats["annotations"] += len(sample.boxes)
+
+    images_out.wait()
     return stats
 
 
-def export_darknet(output_path, images, categories, category_map, train_end, val_end, cursor):
+def export_darknet(output_path, rows, categories, category_map, images_out, table=None):
     """导出为 YOLO Darknet 格式 (v3/v4)"""
     # 创建目录结构
     images_dir = os.path.join(output_path, "images")
@@ -216,38 +468,31 @@ def export_darknet(output_path, images, categories, category_map, train_end, val
 
     stats = {"train": 0, "val": 0, "test": 0, "annotations": 0}
 
-    for idx, image in enumerate(images):
-        split = "train" if idx < train_end else ("val" if idx < val_end else "test")
-
-        # 复制图片
-        src_path = image['file_path']
-        dst_image_path = os.path.join(images_dir, image['filename'])
-        if os.path.exists(src_path):
-            shutil.copy2(src_path, dst_image_path)
-            stats[split] += 1
-
-            # 记录路径（相对路径）
-            rel_path = f"images/{image['filename']}"
-            if split == "train":
-                train_list.append(rel_path)
-            elif split == "val":
-                val_list.append(rel_path)
-            else:
-                test_list.append(rel_path)
-
-        # 创建标签文件
-        cursor.execute("SELECT * FROM annotations WHERE image_id = %s", (image['id'],))
-        annotations = cursor.fetchall()
-
-        label_filename = os.path.splitext(image['filename'])[0] + ".txt"
-        label_path = os.path.join(labels_dir, label_filename)
-
-        with open(label_path, "w") as f:
-            for ann in annotations:
-                if ann['category_id'] in category_map:
-                    class_id = category_map[ann['category_id']]
-                    f.write(f"{class_id} {ann['x_center']:.6f} {ann['y_center']:.6f} {ann['width']:.6f} {ann['height']:.6f}\n")
-                    stats["annotations"] += 1
+    for split, image, annotations in rows:
+        src_exists = os.path.exists(image['file_path'])
+        for sample in images_out.samples(image, annotations, category_map):
+            # 复制图片
+            if src_exists:
+                images_out.write(sample, os.path.join(images_dir, sample.filename))
+                stats[split] += 1
+                if table:
+                    table.add_sample(split, image, annotations, sample)
+
+                # 记录路径（相对路径）
+                rel_path = f"images/{sample.filename}"
+                if split == "train":
+                    train_list.append(rel_path)
+                elif split == "val":
+                    val_list.append(rel_path)
+                else:
+                    test_list.append(rel_path)
+
+            # 创建标签文件
+            label_filename = os.path.splitext(sample.filename)[0] + ".txt"
+            write_label_file(os.path.join(labels_dir, label_filename), sample.boxes)
+            stats["annotations"] += len(sample.boxes)
+
+    images_out.wait()
 
     # 创建路径列表文件
     with open(os.path.join(output_path, "train.txt"), "w") as f:
@@ -270,8 +515,9 @@ backup = backup/
     return stats
 
 
-def export_coco(output_path, images, categories, category_map, train_end, val_end, cursor, dataset_name):
-    """导出为 COCO JSON 格式"""
+def export_coco(output_path, rows, categories, category_map, images_out, dataset_name, pretty_json=False,
+                table=None):
+    """导出为 COCO JSON 格式（流式写出，内存占用与数据集大小无关）"""
     # 创建目录结构
     for split in ["train", "val", "test"]:
         os.makedirs(os.path.join(output_path, split), exist_ok=True)
@@ -287,83 +533,160 @@ def export_coco(output_path, images, categories, category_map, train_end, val_en
         for idx, cat in enumerate(categories)
     ]
 
-    # 分割数据
-    splits_data = {
-        "train": {"images": [], "annotations": []},
-        "val": {"images": [], "annotations": []},
-        "test": {"images": [], "annotations": []}
-    }
+    # 每个分割一个流式写入器
+    writers = {}
+    for split in ["train", "val", "test"]:
+        info = {
+            "description": f"{dataset_name} - {split}",
+            "version": "1.0",
+            "year": datetime.now().year,
+            "date_created": datetime.now().isoformat()
+        }
+        json_path = os.path.join(annotations_dir, f"instances_{split}.json")
+        writers[split] = CocoJsonWriter(json_path, info, coco_categories, pretty=pretty_json)
 
     annotation_id = 1
-
-    for idx, image in enumerate(images):
-        split = "train" if idx < train_end else ("val" if idx < val_end else "test")
-
-        # 复制图片
-        src_path = image['file_path']
-        dst_image_path = os.path.join(output_path, split, image['filename'])
-        if os.path.exists(src_path):
-            shutil.copy2(src_path, dst_image_path)
-            stats[split] += 1
-
-            # COCO 图片信息
-            img_width = image['width'] or 640
-            img_height = image['height'] or 480
-
-            coco_image = {
-                "id": image['id'],
-                "file_name": image['filename'],
-                "width": img_width,
-                "height": img_height
-            }
-            splits_data[split]["images"].append(coco_image)
-
-            # 获取标注
-            cursor.execute("SELECT * FROM annotations WHERE image_id = %s", (image['id'],))
-            annotations = cursor.fetchall()
-
-            for ann in annotations:
-                if ann['category_id'] in category_map:
+    tile_image_id = 1
+
+    try:
+        for split, image, annotations in rows:
+            if not os.path.exists(image['file_path']):
+                continue
+
+            for sample in images_out.samples(image, annotations, category_map):
+                # 复制图片
+                images_out.write(sample, os.path.join(output_path, split, sample.filename))
+                stats[split] += 1
+                if table:
+                    table.add_sample(split, image, annotations, sample)
+
+                # COCO 图片信息；切片时每个切片作为独立图片，重新编号
+                img_width = sample.width or 640
+                img_height = sample.height or 480
+                coco_image_id = image['id']
+                if images_out.tiled:
+                    coco_image_id = tile_image_id
+                    tile_image_id += 1
+
+                writers[split].add_image({
+                    "id": coco_image_id,
+                    "file_name": sample.filename,
+                    "width": img_width,
+                    "height": img_height
+                })
+
+                for class_id, x_center, y_center, width, height in sample.boxes:
                     # 转换归一化坐标为像素坐标
-                    x_center = ann['x_center'] * img_width
-                    y_center = ann['y_center'] * img_height
-                    width = ann['width'] * img_width
-                    height = ann['height'] * img_height
+                    x_center *= img_width
+                    y_center *= img_height
+                    width *= img_width
+                    height *= img_height
 
                     # COCO 使用左上角坐标 [x, y, width, height]
                     x = x_center - width / 2
                     y = y_center - height / 2
 
-                    coco_ann = {
+                    writers[split].add_annotation({
                         "id": annotation_id,
-                        "image_id": image['id'],
-                        "category_id": category_map[ann['category_id']] + 1,  # COCO ID 从 1 开始
+                        "image_id": coco_image_id,
+                        "category_id": class_id + 1,  # COCO ID 从 1 开始
                         "bbox": [round(x, 2), round(y, 2), round(width, 2), round(height, 2)],
                         "area": round(width * height, 2),
                         "iscrowd": 0
-                    }
-                    splits_data[split]["annotations"].append(coco_ann)
+                    })
                     annotation_id += 1
                     stats["annotations"] += 1
 
-    # 写入 JSON 文件
-    for split in ["train", "val", "test"]:
-        coco_data = {
-            "info": {
-                "description": f"{dataset_name} - {split}",
-                "version": "1.0",
-                "year": datetime.now().year,
-                "date_created": datetime.now().isoformat()
-            },
-            "licenses": [],
-            "images": splits_data[split]["images"],
-            "annotations": splits_data[split]["annotations"],
-            "categories": coco_categories
-        }
+        images_out.wait()
+    finally:
+        for writer in writers.values():
+            writer.close()
 
-        json_path = os.path.join(annotations_dir, f"instances_{split}.json")
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(coco_data, f, ensure_ascii=False, indent=2)
+    return stats
+
+
+def export_webdataset(output_path, rows, categories, category_map, images_out, shard_size_mb, table=None):
+    """导出为 WebDataset 风格的 tar 分片"""
+    names = [cat['name'] for cat in categories]
+    max_bytes = shard_size_mb * 1024 * 1024
+    writers = {
+        split: TarShardWriter(os.path.join(output_path, split), split, max_bytes)
+        for split in ["train", "val", "test"]
+    }
+
+    stats = {"train": 0, "val": 0, "test": 0, "annotations": 0}
+
+    # tar 分片需要按顺序写入，图片先在进程池中处理到临时目录
+    staging_dir = os.path.join(output_path, ".staging")
+    os.makedirs(staging_dir, exist_ok=True)
+    pending = []
+
+    def flush_pending():
+        images_out.wait()
+        for split, key, members, staged_path in pending:
+            writers[split].write(key, members)
+            if staged_path:
+                os.remove(staged_path)
+        pending.clear()
+
+    for split, image, annotations in rows:
+        if not os.path.exists(image['file_path']):
+            continue
+
+        for sample in images_out.samples(image, annotations, category_map):
+            lines = [
+                f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n"
+                for class_id, x, y, w, h in sample.boxes
+            ]
+            stats["annotations"] += len(lines)
+
+            # 样本键不能包含 "."，使用图片 ID；原文件名记录在 json 中
+            key = f"{image['id']:08d}"
+            if sample.tile_index is not None:
+                key += f"_{sample.tile_index:04d}"
+            ext = os.path.splitext(sample.filename)[1].lstrip(".").lower() or "jpg"
+            staged_path = None
+            src = sample.src_path
+            if sample.op is not None:
+                staged_path = os.path.join(staging_dir, f"{key}.{ext}")
+                images_out.write(sample, staged_path)
+                src = staged_path
+
+            metadata = {
+                "id": image['id'],
+                "filename": sample.filename,
+                "width": sample.width,
+                "height": sample.height
+            }
+            pending.append((split, key, {
+                ext: src,
+                "txt": "".join(lines).encode("utf-8"),
+                "json": json.dumps(metadata, ensure_ascii=False).encode("utf-8")
+            }, staged_path))
+            stats[split] += 1
+            if table:
+                table.add_sample(split, image, annotations, sample)
+
+        if len(pending) >= 256:
+            flush_pending()
+
+    flush_pending()
+    os.rmdir(staging_dir)
+
+    index = {
+        "format": "webdataset",
+        "nc": len(names),
+        "names": names,
+        "shard_size_mb": shard_size_mb,
+        "splits": {}
+    }
+    for split, writer in writers.items():
+        writer.close()
+        # 样本偏移写在各分片的索引文件中
+        index["splits"][split] = {"shards": writer.shards}
+
+    with open(os.path.join(output_path, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
 
     return stats
 
@@ -373,38 +696,72 @@ def export_coco(output_path, images, categories, category_map, train_end, val_en
 async def export_yolo_legacy(
     request: ExportRequest,
     conn = Depends(get_db_dependency),
-    current_admin = Depends(get_current_admin)
+    current_admin = Depends(get_current_admin),
+    export_dirs: ExportDirs = Depends(export_dirs_dependency)
 ):
     """导出数据集为YOLO格式（兼容旧接口）"""
     request.format = ExportFormat.YOLOV8
-    return await export_dataset(request, conn, current_admin)
+    return await export_dataset(request, conn, current_admin, export_dirs)
+
+
+def _get_download_task(conn, task_id: str) -> dict:
+    with conn.cursor() as cursor:
+        task = get_export_task(cursor, task_id)
+        if not task:
+            raise HTTPException(status_code=404, detail="导出任务不存在或已过期")
+
+        if not os.path.exists(task["zip_path"]):
+            raise HTTPException(status_code=404, detail="文件不存在")
+
+        cursor.execute("UPDATE export_tasks SET downloaded_at = NOW() WHERE task_id = %s", (task_id,))
+
+    return task
 
 
 @router.get("/download/{task_id}")
 async def download_export(
     task_id: str,
-    background_tasks: BackgroundTasks,
+    conn = Depends(get_db_dependency),
     current_admin = Depends(get_current_admin)
 ):
-    """下载导出的文件"""
-    if task_id not in export_tasks:
-        raise HTTPException(status_code=404, detail="导出任务不存在或已过期")
+    """下载导出的文件（任务在过期前可重复下载，过期后由后台清理；分卷导出时返回清单）"""
+    task = _get_download_task(conn, task_id)
 
-    task = export_tasks[task_id]
-    zip_path = task["zip_path"]
+    if task["filename"].endswith(MANIFEST_SUFFIX):
+        return FileResponse(task["zip_path"], media_type="application/json", filename=task["filename"])
 
-    if not os.path.exists(zip_path):
-        raise HTTPException(status_code=404, detail="文件不存在")
+    return FileResponse(
+        task["zip_path"],
+        media_type="application/zip",
+        filename=task["filename"]
+    )
 
-    # 下载后清理
-    def cleanup():
-        shutil.rmtree(task["export_dir"], ignore_errors=True)
-        export_tasks.pop(task_id, None)
 
-    background_tasks.add_task(cleanup)
+@router.get("/download/{task_id}/volumes/{index}")
+async def download_export_volume(
+    task_id: str,
+    index: int,
+    conn = Depends(get_db_dependency),
+    current_admin = Depends(get_current_admin)
+):
+    """下载单个分卷（可并发下载，失败时只需重新下载该卷）"""
+    task = _get_download_task(conn, task_id)
+    if not task["filename"].endswith(MANIFEST_SUFFIX):
+        raise HTTPException(status_code=404, detail="该导出任务没有分卷")
+
+    with open(task["zip_path"], "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    volume = next((v for v in manifest["volumes"] if v["index"] == index), None)
+    if not volume:
+        raise HTTPException(status_code=404, detail="分卷不存在")
+
+    volume_path = os.path.join(os.path.dirname(task["zip_path"]), volume["filename"])
+    if not os.path.exists(volume_path):
+        raise HTTPException(status_code=404, detail="文件不存在")
 
     return FileResponse(
-        zip_path,
+        volume_path,
         media_type="application/zip",
-        filename=os.path.basename(zip_path)
+        filename=volume["filename"],
+        headers={"X-Checksum-SHA256": volume["sha256"]}
     )
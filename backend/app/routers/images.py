@@ -1,14 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import List, Optional, Literal
 from datetime import datetime, date
-import os
+from functools import partial
+import asyncio
 import json
-from app.core import get_db_dependency, get_current_user
+import logging
+import mimetypes
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from app.core import get_db_dependency, get_current_user, settings, conditional_response, after_commit
+from app.services.statistics import adjust_images_labeled, adjust_dataset_status, adjust_dataset_category
+from app.services.work_stats import work_stats
+from app.services.dwell import compute_dwell_seconds
+from app.services.lookup_cache import lookup_cache, get_dataset, get_categories, CATEGORIES
+from app.services.image_files import ImageFile, image_paths, image_file_response
+from app.services.image_derivatives import get_derivative, negotiate_format, should_transcode, derivative_stats
+from app.services.image_tiles import pyramid_info, get_tile, schedule_pyramid
+from app.services.workers import get_pool_size
+from app.services.progress import dataset_progress, progress_bus
+from app.services.save_requests import DuplicateSaveRequest, find_applied, record_applied
+from app.services.history_writer import history_writer
 
 router = APIRouter(prefix="/api/images", tags=["图片标注"])
 
+logger = logging.getLogger(__name__)
+
 
 class AnnotationCreate(BaseModel):
     category_id: int
@@ -42,6 +62,16 @@ class ImageResponse(BaseModel):
 class SaveAnnotationsRequest(BaseModel):
     annotations: List[AnnotationCreate]
     skip: bool = False
+    active_seconds: Optional[float] = None  # 客户端统计的有效操作时间（秒）
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=64)  # 重复提交时返回上次的结果
+
+
+class BatchSaveItem(SaveAnnotationsRequest):
+    image_id: int
+
+
+class BatchSaveRequest(BaseModel):
+    items: List[BatchSaveItem]
 
 
 @router.get("/next/{dataset_id}")
@@ -53,8 +83,8 @@ async def get_next_image(
     """获取下一张待标注图片"""
     with conn.cursor() as cursor:
         # 检查数据集
-        cursor.execute("SELECT id FROM datasets WHERE id = %s AND is_active = TRUE", (dataset_id,))
-        if not cursor.fetchone():
+        dataset = get_dataset(cursor, dataset_id)
+        if not dataset or not dataset['is_active']:
             raise HTTPException(status_code=404, detail="数据集不存在或未激活")
 
         # 优先返回当前用户已分配但未完成的图片
@@ -80,6 +110,9 @@ async def get_next_image(
                 )
                 image['status'] = 'assigned'
                 image['assigned_to'] = current_user['id']
+                adjust_dataset_status(cursor, {(dataset_id, 'pending'): -1, (dataset_id, 'assigned'): 1})
+                # 提交后再通知，重新计算的进度包含本次变化；回滚时不通知
+                after_commit(conn, partial(progress_bus.publish, dataset_id))
 
         if not image:
             return None
@@ -94,6 +127,63 @@ async def get_next_image(
     }
 
 
+def assign_next_batch(cursor, dataset_id: int, user_id: int, count: int) -> List[dict]:
+    """
+    分配一批待标注图片给用户（优先返回已分配未完成的图片）
+
+    Returns:
+        图片列表，每张图片带 annotations
+    """
+    # 获取当前用户已分配的图片
+    cursor.execute(
+        "SELECT * FROM images WHERE dataset_id = %s AND assigned_to = %s AND status = 'assigned'",
+        (dataset_id, user_id)
+    )
+    assigned_images = cursor.fetchall()
+
+    # 获取待标注图片
+    remaining = count - len(assigned_images)
+    pending_images = []
+    if remaining > 0:
+        cursor.execute(
+            "SELECT * FROM images WHERE dataset_id = %s AND status = 'pending' ORDER BY RAND() LIMIT %s",
+            (dataset_id, remaining)
+        )
+        pending_images = cursor.fetchall()
+
+        # 分配给当前用户
+        for image in pending_images:
+            cursor.execute(
+                "UPDATE images SET assigned_to = %s, assigned_at = NOW(), status = 'assigned' WHERE id = %s",
+                (user_id, image['id'])
+            )
+            image['status'] = 'assigned'
+            image['assigned_to'] = user_id
+        if pending_images:
+            adjust_dataset_status(cursor, {(dataset_id, 'pending'): -len(pending_images),
+                                           (dataset_id, 'assigned'): len(pending_images)})
+            after_commit(cursor.connection, partial(progress_bus.publish, dataset_id))
+
+    all_images = list(assigned_images) + list(pending_images)
+    if not all_images:
+        return []
+
+    # 一次查询所有图片的标注
+    image_ids = [image['id'] for image in all_images]
+    cursor.execute(
+        f"SELECT * FROM annotations WHERE image_id IN ({','.join(['%s'] * len(image_ids))})",
+        image_ids
+    )
+    annotations_by_image = {}
+    for annotation in cursor.fetchall():
+        annotations_by_image.setdefault(annotation['image_id'], []).append(annotation)
+
+    return [
+        {**image, "annotations": annotations_by_image.get(image['id'], [])}
+        for image in all_images
+    ]
+
+
 @router.get("/next/{dataset_id}/batch")
 async def get_next_images_batch(
     dataset_id: int,
@@ -107,59 +197,129 @@ async def get_next_images_batch(
 
     with conn.cursor() as cursor:
         # 检查数据集
-        cursor.execute("SELECT id FROM datasets WHERE id = %s AND is_active = TRUE", (dataset_id,))
-        if not cursor.fetchone():
+        dataset = get_dataset(cursor, dataset_id)
+        if not dataset or not dataset['is_active']:
             raise HTTPException(status_code=404, detail="数据集不存在或未激活")
 
-        # 获取当前用户已分配的图片
-        cursor.execute(
-            "SELECT * FROM images WHERE dataset_id = %s AND assigned_to = %s AND status = 'assigned'",
-            (dataset_id, current_user['id'])
-        )
-        assigned_images = cursor.fetchall()
+        result = assign_next_batch(cursor, dataset_id, current_user['id'], count)
 
-        # 获取待标注图片
-        remaining = count - len(assigned_images)
-        pending_images = []
-        if remaining > 0:
-            cursor.execute(
-                "SELECT * FROM images WHERE dataset_id = %s AND status = 'pending' ORDER BY RAND() LIMIT %s",
-                (dataset_id, remaining)
-            )
-            pending_images = cursor.fetchall()
+    return result
 
-            # 分配给当前用户
-            for image in pending_images:
-                cursor.execute(
-                    "UPDATE images SET assigned_to = %s, assigned_at = NOW(), status = 'assigned' WHERE id = %s",
-                    (current_user['id'], image['id'])
-                )
-                image['status'] = 'assigned'
-                image['assigned_to'] = current_user['id']
 
-        all_images = list(assigned_images) + list(pending_images)
+BUNDLE_MEDIA_TYPE = "application/vnd.torch-markup.bundle"
 
-        # 获取每张图片的标注
-        result = []
-        for image in all_images:
-            cursor.execute("SELECT * FROM annotations WHERE image_id = %s", (image['id'],))
-            annotations = cursor.fetchall()
-            result.append({
-                **image,
-                "annotations": annotations
-            })
 
-    return result
+def _bundle_frame(payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload)) + payload
+
+
+def _bundle_json_frame(data) -> bytes:
+    return _bundle_frame(json.dumps(jsonable_encoder(data), ensure_ascii=False).encode("utf-8"))
+
+
+def _load_bundle_file(image_row: dict, size: str, image_format: Optional[str]) -> Optional[ImageFile]:
+    image_id = image_row['id']
+    image = image_paths.get(image_id, image_row['file_path'])
+    if not image:
+        return None
+    if size == "full" and not (image_format and should_transcode(image)):
+        return image
+    try:
+        derivative = get_derivative(image, size, image_format)
+    except Exception:
+        logger.exception("生成图片 %s 的派生图失败", image_id)
+        return None
+    derivative_stats.record_response(image, derivative)
+    return derivative
+
+
+def _bundle_chunks(images: List[dict], size: str, image_format: Optional[str], known: set):
+    """
+    打包响应内容：每帧为 4 字节大端长度 + 内容
+
+    第一帧为图片元数据与标注 JSON 列表；之后每张图片两帧，
+    依次为 {"id", "content_type"} JSON 和图片字节（文件不存在或客户端已有时为空帧）。
+    派生图在线程中并发生成，按列表顺序输出。
+    """
+    yield _bundle_json_frame(images)
+
+    def load(image):
+        if image['id'] in known:
+            return None
+        return _load_bundle_file(image, size, image_format)
+
+    with ThreadPoolExecutor(max_workers=min(get_pool_size(), 8)) as executor:
+        files = executor.map(load, images)
+        for image, file in zip(images, files):
+            content_type = mimetypes.guess_type(file.path)[0] if file else None
+            yield _bundle_json_frame({"id": image['id'], "content_type": content_type})
+            if not file:
+                yield _bundle_frame(b"")
+                continue
+            with open(file.path, "rb") as f:
+                yield _bundle_frame(f.read())
+
+
+@router.get("/next/{dataset_id}/bundle")
+async def get_next_images_bundle(
+    dataset_id: int,
+    request: Request,
+    count: int = 20,
+    size: Literal["thumb", "preview", "full"] = "preview",
+    known: List[int] = Query([]),
+    conn = Depends(get_db_dependency),
+    current_user = Depends(get_current_user)
+):
+    """
+    批量获取待标注图片及图片内容（一次请求完成预加载）
+
+    与 /batch 分配规则相同，响应为长度前缀的二进制帧，格式见 _bundle_chunks；
+    known 为客户端已缓存的图片 ID，这些图片只返回元数据
+    """
+    if count > 50:
+        count = 50
+
+    with conn.cursor() as cursor:
+        dataset = get_dataset(cursor, dataset_id)
+        if not dataset or not dataset['is_active']:
+            raise HTTPException(status_code=404, detail="数据集不存在或未激活")
+
+        images = assign_next_batch(cursor, dataset_id, current_user['id'], count)
+
+    # 分配结果随依赖退出提交；图片读取不需要数据库连接
+    image_format = negotiate_format(request.headers.get("accept"))
+    return StreamingResponse(
+        _bundle_chunks(images, size, image_format, set(known)),
+        media_type=BUNDLE_MEDIA_TYPE,
+        headers={"Cache-Control": "no-store"}
+    )
 
 
 @router.get("/{image_id}")
 async def get_image(
     image_id: int,
+    request: Request,
+    response: Response,
     conn = Depends(get_db_dependency),
     current_user = Depends(get_current_user)
 ):
     """获取图片详情和标注"""
     with conn.cursor() as cursor:
+        # 只按主键读取图片行：标注增删递增 annotation_version（覆盖同一秒内的多次修改），
+        # 类别删除级联删除的标注由类别缓存版本覆盖；心跳不更新 updated_at，停留时间列不计入
+        cursor.execute(
+            "SELECT updated_at, status, assigned_to, labeled_by, annotation_version FROM images WHERE id = %s",
+            (image_id,)
+        )
+        marker = cursor.fetchone()
+        if not marker:
+            raise HTTPException(status_code=404, detail="图片不存在")
+
+        not_modified = conditional_response(request, response, "image", image_id, *marker.values(),
+                                            lookup_cache.version(cursor, CATEGORIES))
+        if not_modified:
+            return not_modified
+
         cursor.execute("SELECT * FROM images WHERE id = %s", (image_id,))
         image = cursor.fetchone()
 
@@ -176,22 +336,59 @@ async def get_image(
 
 
 @router.get("/{image_id}/file")
-async def get_image_file(
+def get_image_file(
     image_id: int,
-    conn = Depends(get_db_dependency)
+    request: Request,
+    size: Literal["thumb", "preview", "full"] = "full"
 ):
-    """获取图片文件（内网使用，无需认证）"""
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT file_path FROM images WHERE id = %s", (image_id,))
-        image = cursor.fetchone()
+    """
+    获取图片文件（内网使用，无需认证）
 
+    size 为 thumb / preview 时返回等比缩小的图片（首次请求时生成并缓存）；
+    客户端 Accept 支持 AVIF / WebP 时，缩略图、预览图和 BMP / PNG 原图按协商格式转码后返回
+    """
+    image = image_paths.get(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="图片或图片文件不存在")
+
+    image_format = negotiate_format(request.headers.get("accept"))
+    if size == "full":
+        if not should_transcode(image):
+            return image_file_response(request, image)
+        if not image_format:
+            return image_file_response(request, image, vary="Accept")
+
+    derivative = get_derivative(image, size, image_format)
+    response = image_file_response(request, derivative, vary="Accept")
+    if response.status_code == 200:
+        derivative_stats.record_response(image, derivative)
+    return response
+
+
+@router.get("/{image_id}/tiles")
+def get_image_tiles_info(image_id: int):
+    """获取大图切片金字塔描述（内网使用，无需认证），同时在后台生成金字塔"""
+    image = image_paths.get(image_id)
     if not image:
-        raise HTTPException(status_code=404, detail="图片不存在")
+        raise HTTPException(status_code=404, detail="图片或图片文件不存在")
+
+    info = pyramid_info(image)
+    schedule_pyramid(image, info)
+    return info
 
-    if not os.path.exists(image['file_path']):
-        raise HTTPException(status_code=404, detail="图片文件不存在")
 
-    return FileResponse(image['file_path'])
+@router.get("/{image_id}/tiles/{level}/{col}/{row}")
+def get_image_tile(image_id: int, level: int, col: int, row: int, request: Request):
+    """获取大图切片（内网使用，无需认证），金字塔尚未生成时只生成这一个切片"""
+    image = image_paths.get(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="图片或图片文件不存在")
+
+    tile = get_tile(image, pyramid_info(image), level, col, row)
+    if not tile:
+        raise HTTPException(status_code=404, detail="切片不存在")
+
+    return image_file_response(request, tile)
 
 
 @router.post("/{image_id}/annotations")
@@ -209,11 +406,8 @@ async def create_annotation(
             raise HTTPException(status_code=404, detail="图片不存在")
 
         # 验证类别
-        cursor.execute(
-            "SELECT id FROM categories WHERE id = %s AND dataset_id = %s",
-            (annotation_data.category_id, image['dataset_id'])
-        )
-        if not cursor.fetchone():
+        category_ids = {cat['id'] for cat in get_categories(cursor, image['dataset_id'])}
+        if annotation_data.category_id not in category_ids:
             raise HTTPException(status_code=400, detail="无效的类别")
 
         cursor.execute(
@@ -223,18 +417,17 @@ async def create_annotation(
              annotation_data.width, annotation_data.height, current_user['id'])
         )
         annotation_id = cursor.lastrowid
-
-        # 记录历史
-        cursor.execute(
-            "INSERT INTO annotation_history (image_id, user_id, action, annotation_data) VALUES (%s, %s, %s, %s)",
-            (image_id, current_user['id'], 'create', json.dumps({
-                "category_id": annotation_data.category_id,
-                "x_center": annotation_data.x_center,
-                "y_center": annotation_data.y_center,
-                "width": annotation_data.width,
-                "height": annotation_data.height
-            }))
-        )
+        bump_annotation_version(cursor, [image_id])
+        adjust_dataset_category(cursor, {(image['dataset_id'], annotation_data.category_id): 1})
+
+        # 记录历史（事务提交后交给写后批量写入，不在请求事务中）
+        after_commit(conn, partial(history_writer.add, image_id, current_user['id'], 'create', {
+            "category_id": annotation_data.category_id,
+            "x_center": annotation_data.x_center,
+            "y_center": annotation_data.y_center,
+            "width": annotation_data.width,
+            "height": annotation_data.height
+        }))
 
         cursor.execute("SELECT * FROM annotations WHERE id = %s", (annotation_id,))
         annotation = cursor.fetchone()
@@ -250,113 +443,333 @@ async def delete_annotation(
 ):
     """删除标注"""
     with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM annotations WHERE id = %s", (annotation_id,))
+        cursor.execute(
+            """SELECT a.*, c.dataset_id FROM annotations a JOIN categories c ON a.category_id = c.id
+               WHERE a.id = %s""",
+            (annotation_id,)
+        )
         annotation = cursor.fetchone()
         if not annotation:
             raise HTTPException(status_code=404, detail="标注不存在")
 
-        # 记录历史
-        cursor.execute(
-            "INSERT INTO annotation_history (image_id, user_id, action, annotation_data) VALUES (%s, %s, %s, %s)",
-            (annotation['image_id'], current_user['id'], 'delete', json.dumps({
-                "annotation_id": annotation_id,
-                "category_id": annotation['category_id'],
-                "x_center": annotation['x_center'],
-                "y_center": annotation['y_center'],
-                "width": annotation['width'],
-                "height": annotation['height']
-            }))
-        )
-
         cursor.execute("DELETE FROM annotations WHERE id = %s", (annotation_id,))
+        bump_annotation_version(cursor, [annotation['image_id']])
+        adjust_dataset_category(cursor, {(annotation['dataset_id'], annotation['category_id']): -1})
+
+        # 记录历史（事务提交后交给写后批量写入，不在请求事务中）
+        after_commit(conn, partial(history_writer.add, annotation['image_id'], current_user['id'], 'delete', {
+            "annotation_id": annotation_id,
+            "category_id": annotation['category_id'],
+            "x_center": annotation['x_center'],
+            "y_center": annotation['y_center'],
+            "width": annotation['width'],
+            "height": annotation['height']
+        }))
 
     return {"message": "删除成功"}
 
 
-@router.post("/{image_id}/save")
-async def save_annotations(
-    image_id: int,
-    data: SaveAnnotationsRequest,
-    conn = Depends(get_db_dependency),
-    current_user = Depends(get_current_user)
-):
-    """保存图片的所有标注并完成"""
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM images WHERE id = %s", (image_id,))
-        image = cursor.fetchone()
-        if not image:
-            raise HTTPException(status_code=404, detail="图片不存在")
-
-        # 删除旧标注
-        cursor.execute("DELETE FROM annotations WHERE image_id = %s", (image_id,))
+def bump_annotation_version(cursor, image_ids: List[int]):
+    """标注增删后递增图片的标注版本号（图片详情的 ETag 依据）"""
+    if image_ids:
+        cursor.execute(
+            f"""UPDATE images SET annotation_version = annotation_version + 1
+                WHERE id IN ({','.join(['%s'] * len(image_ids))})""",
+            image_ids
+        )
 
-        annotation_count = 0
-        if not data.skip:
-            # 创建新标注
-            for ann_data in data.annotations:
-                cursor.execute(
-                    """INSERT INTO annotations (image_id, category_id, x_center, y_center, width, height, created_by)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-                    (image_id, ann_data.category_id, ann_data.x_center, ann_data.y_center,
-                     ann_data.width, ann_data.height, current_user['id'])
-                )
-                annotation_count += 1
-
-        # 更新图片状态
-        # skip=true -> skipped
-        # skip=false 且有标注 -> labeled
-        # skip=false 且无标注 -> pending (不更新状态)
-        if data.skip:
-            new_status = 'skipped'
-        elif annotation_count > 0:
-            new_status = 'labeled'
-        else:
-            new_status = 'pending'
 
-        if new_status != 'pending':
+# 批量保存中单个条目的错误（按条目返回，不影响其他条目）
+IMAGE_NOT_FOUND = "图片不存在"
+INVALID_CATEGORY = "无效的类别"
+
+
+def _save_status(item: SaveAnnotationsRequest) -> str:
+    # skip=true -> skipped
+    # skip=false 且有标注 -> labeled
+    # skip=false 且无标注 -> pending (不更新状态)
+    if item.skip:
+        return 'skipped'
+    return 'labeled' if item.annotations else 'pending'
+
+
+def save_annotations_batch(cursor, items: List[BatchSaveItem], user: dict) -> List[dict]:
+    """
+    在同一事务中保存多张图片的标注（单张保存也使用此函数）
+
+    已应用过的幂等键直接返回上次的结果；同一图片出现多次时以最后一条为准。
+    标注删除、插入与图片状态更新都按批执行，数据集已标注数每个数据集只重新统计一次。
+
+    Returns:
+        与 items 一一对应的结果：{"image_id", "idempotency_key", "status", "duplicate"}，
+        图片不存在或类别不属于图片所在数据集时为 {"image_id", "idempotency_key", "error"}
+
+    Raises:
+        DuplicateSaveRequest: 同一幂等键被并发提交（调用方回滚后重试）
+    """
+    results: List[Optional[dict]] = [None] * len(items)
+    applied = find_applied(cursor, user['id'], (item.idempotency_key for item in items if item.idempotency_key))
+
+    # to_apply: 图片 ID -> 生效的条目序号；same_as: 条目序号 -> 与其结果相同的条目序号
+    to_apply = {}
+    same_as = {}
+    first_by_key = {}
+    for index, item in enumerate(items):
+        key = item.idempotency_key
+        if key in applied:
+            row = applied[key]
+            results[index] = {"image_id": row['image_id'], "idempotency_key": key,
+                              "status": row['status'], "duplicate": True}
+            continue
+        if key in first_by_key:
+            same_as[index] = first_by_key[key]
+            continue
+        if key:
+            first_by_key[key] = index
+        if item.image_id in to_apply:
+            same_as[to_apply[item.image_id]] = index
+        to_apply[item.image_id] = index
+
+    images = {}
+    if to_apply:
+        image_ids = list(to_apply)
+        cursor.execute(
+            f"SELECT * FROM images WHERE id IN ({','.join(['%s'] * len(image_ids))})",
+            image_ids
+        )
+        images = {image['id']: image for image in cursor.fetchall()}
+
+    saves = []
+    category_ids = {}
+    for image_id, index in to_apply.items():
+        item = items[index]
+        if image_id not in images:
+            results[index] = {"image_id": image_id, "idempotency_key": item.idempotency_key, "error": IMAGE_NOT_FOUND}
+            continue
+        dataset_id = images[image_id]['dataset_id']
+        if dataset_id not in category_ids:
+            category_ids[dataset_id] = {cat['id'] for cat in get_categories(cursor, dataset_id)}
+        if any(ann.category_id not in category_ids[dataset_id] for ann in item.annotations):
+            results[index] = {"image_id": image_id, "idempotency_key": item.idempotency_key,
+                              "error": INVALID_CATEGORY}
+            continue
+        saves.append((images[image_id], item, _save_status(item)))
+        results[index] = {"image_id": image_id, "idempotency_key": item.idempotency_key,
+                          "status": saves[-1][2], "duplicate": False}
+
+    # 被替代的条目与重复幂等键的条目共用生效条目的结果
+    for index in same_as:
+        target = index
+        while target in same_as:
+            target = same_as[target]
+        results[index] = {**results[target], "idempotency_key": items[index].idempotency_key}
+
+    if not saves:
+        return results
+
+    # 先记录幂等键：并发提交同一幂等键时在这里等待并失败，不会重复写入
+    record_applied(cursor, user['id'], [
+        (items[index].idempotency_key, result['image_id'], result['status'])
+        for index, result in enumerate(results)
+        if items[index].idempotency_key and not result.get('duplicate') and 'error' not in result
+        and first_by_key.get(items[index].idempotency_key) == index
+    ])
+
+    # 替换标注，同时按类别计算标注框数增量
+    saved_ids = [image['id'] for image, _, _ in saves]
+    placeholders = ','.join(['%s'] * len(saved_ids))
+    cursor.execute(
+        f"""SELECT c.dataset_id, a.category_id, COUNT(*) as count
+            FROM annotations a JOIN categories c ON a.category_id = c.id
+            WHERE a.image_id IN ({placeholders}) GROUP BY c.dataset_id, a.category_id""",
+        saved_ids
+    )
+    category_delta = {(row['dataset_id'], row['category_id']): -row['count'] for row in cursor.fetchall()}
+    cursor.execute(f"DELETE FROM annotations WHERE image_id IN ({placeholders})", saved_ids)
+    rows = [
+        (image['id'], ann.category_id, ann.x_center, ann.y_center, ann.width, ann.height, user['id'])
+        for image, item, new_status in saves if new_status != 'skipped'
+        for ann in item.annotations
+    ]
+    if rows:
+        cursor.executemany(
+            """INSERT INTO annotations (image_id, category_id, x_center, y_center, width, height, created_by)
+               VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+            rows
+        )
+        inserted = {}
+        for row in rows:
+            inserted[row[1]] = inserted.get(row[1], 0) + 1
+        cursor.execute(
+            f"SELECT id, dataset_id FROM categories WHERE id IN ({','.join(['%s'] * len(inserted))})",
+            list(inserted)
+        )
+        for category in cursor.fetchall():
+            key = (category['dataset_id'], category['id'])
+            category_delta[key] = category_delta.get(key, 0) + inserted[category['id']]
+    adjust_dataset_category(cursor, category_delta)
+
+    # 停留时间（必须在更新 labeled_at 之前计算）
+    cursor.execute("SELECT NOW() as now")
+    now = cursor.fetchone()['now']
+    dwell = {}
+    labeled_delta = {}
+    status_delta = {}
+    by_status = {}
+    for image, item, new_status in saves:
+        by_status.setdefault(new_status, []).append(image['id'])
+        for status, delta in ((image['status'], -1), (new_status, 1)):
+            key = (image['dataset_id'], status)
+            status_delta[key] = status_delta.get(key, 0) + delta
+        if new_status == 'pending':
+            continue
+        dwell[image['id']] = compute_dwell_seconds(cursor, image, user['id'], item.active_seconds, now)
+        # 维护用户已标注图片计数（图片改由其他人标注时转移计数）
+        if image['labeled_by'] != user['id']:
+            labeled_delta[user['id']] = labeled_delta.get(user['id'], 0) + 1
+            if image['labeled_by']:
+                labeled_delta[image['labeled_by']] = labeled_delta.get(image['labeled_by'], 0) - 1
+
+    for new_status, image_ids in by_status.items():
+        placeholders = ','.join(['%s'] * len(image_ids))
+        if new_status == 'pending':
+            # 无标注时释放图片分配，让其他人可以处理
             cursor.execute(
-                "UPDATE images SET status = %s, labeled_by = %s, labeled_at = NOW() WHERE id = %s",
-                (new_status, current_user['id'], image_id)
+                f"""UPDATE images SET status = 'pending', assigned_to = NULL, assigned_at = NULL,
+                           dwell_seconds = 0, last_heartbeat_at = NULL, annotation_version = annotation_version + 1
+                    WHERE id IN ({placeholders})""",
+                image_ids
             )
         else:
-            # 无标注时释放图片分配，让其他人可以处理
             cursor.execute(
-                "UPDATE images SET status = 'pending', assigned_to = NULL, assigned_at = NULL WHERE id = %s",
-                (image_id,)
+                f"""UPDATE images SET status = %s, labeled_by = %s, labeled_at = NOW(),
+                           dwell_seconds = 0, last_heartbeat_at = NULL, annotation_version = annotation_version + 1
+                    WHERE id IN ({placeholders})""",
+                [new_status, user['id'], *image_ids]
             )
-
-        # 更新数据集统计
-        cursor.execute(
-            "SELECT COUNT(*) as count FROM images WHERE dataset_id = %s AND status = 'labeled'",
-            (image['dataset_id'],)
-        )
-        labeled = cursor.fetchone()['count']
+    for user_id, delta in labeled_delta.items():
+        if delta:
+            adjust_images_labeled(cursor, user_id, delta)
+    adjust_dataset_status(cursor, status_delta)
+
+    # 更新数据集统计
+    dataset_ids = sorted({image['dataset_id'] for image, _, _ in saves})
+    cursor.execute(
+        f"""SELECT dataset_id, COUNT(*) as count FROM images
+            WHERE dataset_id IN ({','.join(['%s'] * len(dataset_ids))}) AND status = 'labeled'
+            GROUP BY dataset_id""",
+        dataset_ids
+    )
+    labeled = {row['dataset_id']: row['count'] for row in cursor.fetchall()}
+    for dataset_id in dataset_ids:
         cursor.execute(
             "UPDATE datasets SET labeled_images = %s WHERE id = %s",
-            (labeled, image['dataset_id'])
+            (labeled.get(dataset_id, 0), dataset_id)
         )
+        after_commit(cursor.connection, partial(progress_bus.publish, dataset_id))
+
+    # 更新工作量统计（只有 labeled 或 skipped 才计入），事务提交后交给聚合器批量写入，回滚时不计入
+    conn = cursor.connection
+    today = date.today()
+    for image, item, new_status in saves:
+        if new_status == 'pending':
+            continue
+        annotation_count = 0 if new_status == 'skipped' else len(item.annotations)
+        after_commit(conn, partial(work_stats.add, user['id'], image['dataset_id'], today, images_labeled=1,
+                                   annotations_created=annotation_count, time_spent=dwell[image['id']]))
+        after_commit(conn, partial(work_stats.add_dwell, user['id'], image['dataset_id'], dwell[image['id']],
+                                   annotation_count))
+
+    return results
+
+
+def save_image_annotations(cursor, image_id: int, data: SaveAnnotationsRequest, user: dict) -> dict:
+    """
+    保存单张图片的所有标注并更新图片状态（HTTP 接口与标注会话共用）
+
+    带幂等键的保存重复提交时返回上次的结果，不会重复应用。
+
+    Returns:
+        {"message", "status"}
+
+    Raises:
+        HTTPException: 图片不存在（404）；无效的类别（400）；相同幂等键的保存正在处理（409）
+    """
+    try:
+        result = save_annotations_batch(cursor, [BatchSaveItem(image_id=image_id, **data.model_dump())], user)[0]
+    except DuplicateSaveRequest:
+        raise HTTPException(status_code=409, detail="相同的保存请求正在处理，请稍后重试")
+    if 'error' in result:
+        raise HTTPException(status_code=404 if result['error'] == IMAGE_NOT_FOUND else 400, detail=result['error'])
+    return {"message": "保存成功", "status": result['status']}
+
+
+@router.post("/save/batch")
+async def save_annotations_batch_endpoint(
+    data: BatchSaveRequest,
+    conn = Depends(get_db_dependency),
+    current_user = Depends(get_current_user)
+):
+    """
+    批量保存多张图片的标注（客户端离线排队后一次提交）
 
-        # 更新工作量统计（只有 labeled 或 skipped 才计入）
-        if new_status != 'pending':
-            today = date.today()
-            cursor.execute(
-                "SELECT id FROM work_statistics WHERE user_id = %s AND dataset_id = %s AND date = %s",
-                (current_user['id'], image['dataset_id'], today)
-            )
-            stats = cursor.fetchone()
+    全部条目在同一事务中应用，按条目返回结果（图片不存在、类别无效的条目单独返回错误，不影响其他条目）；
+    带幂等键的条目重复提交时返回上次的结果，不会重复应用。
+    """
+    if len(data.items) > settings.BATCH_SAVE_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多保存 {settings.BATCH_SAVE_MAX_ITEMS} 条")
 
-            if stats:
-                cursor.execute(
-                    "UPDATE work_statistics SET images_labeled = images_labeled + 1, annotations_created = annotations_created + %s WHERE id = %s",
-                    (annotation_count, stats['id'])
-                )
-            else:
-                cursor.execute(
-                    "INSERT INTO work_statistics (user_id, dataset_id, date, images_labeled, annotations_created) VALUES (%s, %s, %s, %s, %s)",
-                    (current_user['id'], image['dataset_id'], today, 1, annotation_count)
-                )
+    try:
+        with conn.cursor() as cursor:
+            results = save_annotations_batch(cursor, data.items, current_user)
+    except DuplicateSaveRequest:
+        raise HTTPException(status_code=409, detail="相同的保存请求正在处理，请稍后重试")
+
+    return {"results": results}
+
+
+@router.post("/{image_id}/save")
+async def save_annotations(
+    image_id: int,
+    data: SaveAnnotationsRequest,
+    conn = Depends(get_db_dependency),
+    current_user = Depends(get_current_user)
+):
+    """保存图片的所有标注并完成"""
+    with conn.cursor() as cursor:
+        return save_image_annotations(cursor, image_id, data, current_user)
+
+
+def record_heartbeat(cursor, image_id: int, user_id: int):
+    """累加停留时间（HTTP 心跳与标注会话续期共用）"""
+    # 赋值从左到右执行，累加时使用的是旧的 last_heartbeat_at；保持 updated_at 不变，避免影响导出缓存版本
+    cursor.execute(
+        """UPDATE images
+           SET dwell_seconds = dwell_seconds + IF(
+                   last_heartbeat_at IS NOT NULL AND last_heartbeat_at >= NOW() - INTERVAL %s SECOND,
+                   TIMESTAMPDIFF(SECOND, last_heartbeat_at, NOW()), 0),
+               last_heartbeat_at = NOW(),
+               updated_at = updated_at
+           WHERE id = %s AND (assigned_to = %s OR labeled_by = %s)""",
+        (settings.DWELL_HEARTBEAT_GAP_SECONDS, image_id, user_id, user_id)
+    )
+
+
+@router.post("/{image_id}/heartbeat")
+async def heartbeat(
+    image_id: int,
+    conn = Depends(get_db_dependency),
+    current_user = Depends(get_current_user)
+):
+    """
+    停留心跳（客户端在图片显示且用户活跃时定期调用）
 
-    return {"message": "保存成功", "status": new_status}
+    距上一次心跳不超过 DWELL_HEARTBEAT_GAP_SECONDS 时累加间隔时长，否则视为离开后重新开始计时。
+    """
+    with conn.cursor() as cursor:
+        record_heartbeat(cursor, image_id, current_user['id'])
+
+    return {"message": "ok"}
 
 
 @router.get("/{image_id}/history")
@@ -366,6 +779,8 @@ async def get_annotation_history(
     current_user = Depends(get_current_user)
 ):
     """获取标注历史 (用于撤销)"""
+    # 先写入本进程中缓冲的历史，刚刚的操作也能查到（在线程池中写入，不阻塞事件循环）
+    await run_in_threadpool(history_writer.flush)
     with conn.cursor() as cursor:
         cursor.execute(
             """SELECT id, action, annotation_data, created_at FROM annotation_history
@@ -393,28 +808,54 @@ async def get_dataset_progress(
 ):
     """获取数据集标注进度"""
     with conn.cursor() as cursor:
-        cursor.execute("SELECT id FROM datasets WHERE id = %s", (dataset_id,))
-        if not cursor.fetchone():
+        if not get_dataset(cursor, dataset_id):
             raise HTTPException(status_code=404, detail="数据集不存在")
 
-        cursor.execute("SELECT COUNT(*) as count FROM images WHERE dataset_id = %s", (dataset_id,))
-        total = cursor.fetchone()['count']
+        return dataset_progress(cursor, dataset_id)
 
-        cursor.execute("SELECT COUNT(*) as count FROM images WHERE dataset_id = %s AND status = 'labeled'", (dataset_id,))
-        labeled = cursor.fetchone()['count']
 
-        cursor.execute("SELECT COUNT(*) as count FROM images WHERE dataset_id = %s AND status = 'skipped'", (dataset_id,))
-        skipped = cursor.fetchone()['count']
+PROGRESS_KEEPALIVE_SECONDS = 15
 
-        cursor.execute("SELECT COUNT(*) as count FROM images WHERE dataset_id = %s AND status = 'pending'", (dataset_id,))
-        pending = cursor.fetchone()['count']
 
-    # 进度计算：已标注 + 未见 = 已处理
-    processed = labeled + skipped
-    return {
-        "total": total,
-        "labeled": labeled,
-        "skipped": skipped,
-        "pending": pending,
-        "progress": round(processed / total * 100, 2) if total > 0 else 0
-    }
+def _sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+
+async def _progress_events(dataset_id: int, initial: dict):
+    queue = progress_bus.subscribe(dataset_id, initial)
+    try:
+        yield _sse_event("progress", initial)
+        while True:
+            try:
+                progress = await asyncio.wait_for(queue.get(), PROGRESS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                # 注释行保持连接，避免被代理按空闲超时断开
+                yield ": keepalive\n\n"
+                continue
+            yield _sse_event("progress", progress)
+    finally:
+        progress_bus.unsubscribe(dataset_id, queue)
+
+
+@router.get("/dataset/{dataset_id}/progress/stream")
+async def stream_dataset_progress(
+    dataset_id: int,
+    conn = Depends(get_db_dependency),
+    current_user = Depends(get_current_user)
+):
+    """
+    数据集标注进度推送（Server-Sent Events）
+
+    先发送当前进度，之后进度变化时推送 progress 事件；
+    同一数据集的所有订阅者共用一次计算，推送频率不超过 PROGRESS_PUSH_INTERVAL_SECONDS。
+    """
+    with conn.cursor() as cursor:
+        if not get_dataset(cursor, dataset_id):
+            raise HTTPException(status_code=404, detail="数据集不存在")
+        initial = dataset_progress(cursor, dataset_id)
+
+    return StreamingResponse(
+        _progress_events(dataset_id, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
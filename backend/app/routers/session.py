@@ -0,0 +1,268 @@
+"""
+标注会话（WebSocket）
+
+一个连接只认证一次，之后在同一连接上完成领取图片、保存、续期（停留心跳）和进度推送，
+每张图片只需一次消息往返；保存后服务端主动推送新分配的图片，把客户端队列保持在 SESSION_QUEUE_DEPTH。
+
+消息格式（JSON）：
+    客户端 -> 服务端：
+        {"type": "auth", "token": "..."}                      连接后的第一条消息
+        {"type": "next", "req": 1, "count": 20}               领取图片（同 /api/images/next/{id}/batch）
+        {"type": "save", "req": 2, "image_id": 1, "annotations": [...], "skip": false, "active_seconds": 12.5,
+         "idempotency_key": "..."}                            保存（同 /api/images/{id}/save，幂等键可选）
+        {"type": "renew", "image_id": 1}                      续期（同 /api/images/{id}/heartbeat）
+        {"type": "progress", "req": 3}                        查询进度
+    服务端 -> 客户端：
+        {"type": "ready", "user": {...}}
+        {"type": "reply", "req": 2, "data": {...}}
+        {"type": "error", "req": 2, "detail": "..."}
+        {"type": "assignment", "images": [...]}               主动推送的新分配图片
+        {"type": "progress", "data": {...}}                   进度（数据集进度变化时推送）
+
+Token 过期时以 4401 关闭连接，用户被禁用时以 4403 关闭，客户端随后退回 HTTP 接口。
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from app.core import get_db, get_user_by_token, settings
+from app.core.security import decode_token
+from app.routers.images import SaveAnnotationsRequest, assign_next_batch, record_heartbeat, save_image_annotations
+from app.services.lookup_cache import get_dataset
+from app.services.progress import dataset_progress, progress_bus
+
+router = APIRouter(prefix="/api/session", tags=["标注会话"])
+
+logger = logging.getLogger(__name__)
+
+AUTH_TIMEOUT_SECONDS = 10
+
+# 自定义关闭码（4000-4999）
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+
+
+class SessionClosed(Exception):
+    """需要关闭会话（凭据过期、用户被禁用）"""
+
+    def __init__(self, code: int, reason: str):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+
+
+class AnnotationSession:
+    """
+    一个标注会话：消息按顺序在线程池中处理，每条消息使用一个数据库连接，处理完即归还
+
+    会话不长期占用数据库连接，并发会话数不受 MySQL 连接数限制。
+    认证后每条消息都检查 Token 是否过期、用户是否被禁用（与消息在同一连接中按主键查询），
+    空闲的连接在 Token 过期时关闭。
+    delivered 记录已发给客户端、尚未保存的图片，推送新分配时只发送其中没有的图片。
+    """
+
+    def __init__(self, websocket: WebSocket, dataset_id: int):
+        self.websocket = websocket
+        self.dataset_id = dataset_id
+        self.user: Optional[dict] = None
+        self.expires_at: Optional[float] = None  # Token 过期时间（Unix 时间戳）
+        self.delivered = set()
+        self.last_progress: Optional[dict] = None
+
+    def _call_sync(self, func, *args):
+        with get_db() as conn:
+            with conn.cursor() as cursor:
+                if self.user is not None:
+                    self._check_user(cursor)
+                return func(cursor, *args)
+
+    async def call(self, func, *args):
+        """
+        在线程池中执行 func(cursor, *args) 并提交
+
+        Raises:
+            SessionClosed: Token 已过期或用户已被禁用
+        """
+        self._check_expiry()
+        return await run_in_threadpool(self._call_sync, func, *args)
+
+    def _check_expiry(self):
+        if self.expires_at is not None and time.time() >= self.expires_at:
+            raise SessionClosed(CLOSE_UNAUTHORIZED, "凭据已过期")
+
+    def _check_user(self, cursor):
+        cursor.execute("SELECT is_active FROM users WHERE id = %s", (self.user['id'],))
+        user = cursor.fetchone()
+        if not user or not user['is_active']:
+            raise SessionClosed(CLOSE_FORBIDDEN, "用户已被禁用")
+
+    async def receive(self) -> str:
+        """
+        接收下一条消息，Token 过期时不再等待
+
+        Raises:
+            SessionClosed: Token 已过期
+        """
+        if self.expires_at is None:
+            return await self.websocket.receive_text()
+        try:
+            return await asyncio.wait_for(self.websocket.receive_text(), max(self.expires_at - time.time(), 0))
+        except asyncio.TimeoutError:
+            raise SessionClosed(CLOSE_UNAUTHORIZED, "凭据已过期")
+
+    async def send(self, message: dict):
+        await self.websocket.send_text(json.dumps(jsonable_encoder(message), ensure_ascii=False))
+
+    async def authenticate(self) -> bool:
+        """等待第一条 auth 消息并检查用户和数据集，失败时关闭连接"""
+        try:
+            message = json.loads(await asyncio.wait_for(self.websocket.receive_text(), AUTH_TIMEOUT_SECONDS))
+        except (asyncio.TimeoutError, ValueError):
+            await self.websocket.close(code=CLOSE_UNAUTHORIZED, reason="未认证")
+            return False
+
+        token = message.get("token") if isinstance(message, dict) and message.get("type") == "auth" else None
+
+        def load(cursor):
+            user = get_user_by_token(cursor, token) if token else None
+            return user, get_dataset(cursor, self.dataset_id)
+
+        user, dataset = await self.call(load)
+        if user is None:
+            await self.websocket.close(code=CLOSE_UNAUTHORIZED, reason="无法验证凭据")
+            return False
+        if not user['is_active']:
+            await self.websocket.close(code=CLOSE_FORBIDDEN, reason="用户已被禁用")
+            return False
+        if not dataset or not dataset['is_active']:
+            await self.websocket.close(code=CLOSE_NOT_FOUND, reason="数据集不存在或未激活")
+            return False
+
+        self.user = user
+        exp = (decode_token(token) or {}).get("exp")
+        self.expires_at = float(exp) if exp is not None else None
+        # 连接前客户端通过 HTTP 领取的图片视为已发送
+        self.delivered = set(await self.call(self._assigned_ids))
+        await self.send({"type": "ready", "user": {"id": user['id'], "username": user['username']}})
+        return True
+
+    def _assigned_ids(self, cursor) -> list:
+        cursor.execute(
+            "SELECT id FROM images WHERE dataset_id = %s AND assigned_to = %s AND status = 'assigned'",
+            (self.dataset_id, self.user['id'])
+        )
+        return [row['id'] for row in cursor.fetchall()]
+
+    async def handle(self, message: dict):
+        """处理一条客户端消息"""
+        message_type = message.get("type")
+        req = message.get("req")
+        try:
+            if message_type == "next":
+                count = min(int(message.get("count") or settings.SESSION_QUEUE_DEPTH), 50)
+                images = await self.call(assign_next_batch, self.dataset_id, self.user['id'], count)
+                self.delivered.update(image['id'] for image in images)
+                data = images
+            elif message_type == "save":
+                image_id = int(message["image_id"])
+                request = SaveAnnotationsRequest(**{
+                    key: message[key] for key in ("annotations", "skip", "active_seconds", "idempotency_key")
+                    if key in message
+                })
+                result = await self.call(save_image_annotations, image_id, request, self.user)
+                self.delivered.discard(image_id)
+                data = {"message": result['message'], "status": result['status']}
+            elif message_type == "renew":
+                await self.call(record_heartbeat, int(message["image_id"]), self.user['id'])
+                data = {"message": "ok"}
+            elif message_type == "progress":
+                data = await self.call(dataset_progress, self.dataset_id)
+                self.last_progress = data
+            else:
+                raise HTTPException(status_code=400, detail=f"不支持的消息类型: {message_type}")
+        except SessionClosed:
+            raise
+        except HTTPException as e:
+            await self.send({"type": "error", "req": req, "detail": e.detail})
+            return
+        except (KeyError, TypeError, ValueError, ValidationError):
+            await self.send({"type": "error", "req": req, "detail": "消息格式错误"})
+            return
+        except Exception:
+            logger.exception("处理标注会话消息失败: %s", message_type)
+            await self.send({"type": "error", "req": req, "detail": "服务器内部错误"})
+            return
+
+        if req is not None:
+            await self.send({"type": "reply", "req": req, "data": data})
+
+        if message_type == "save":
+            # 回复之后再补充队列，不延迟保存确认；进度由 progress_bus 推送
+            await self.push_assignments()
+
+    async def push_assignments(self):
+        """把客户端队列补充到 SESSION_QUEUE_DEPTH，推送新分配的图片"""
+        images = await self.call(assign_next_batch, self.dataset_id, self.user['id'], settings.SESSION_QUEUE_DEPTH)
+        new_images = [image for image in images if image['id'] not in self.delivered]
+        if new_images:
+            self.delivered.update(image['id'] for image in new_images)
+            await self.send({"type": "assignment", "images": new_images})
+
+    async def push_progress(self):
+        """推送当前数据集进度"""
+        self.last_progress = await self.call(dataset_progress, self.dataset_id)
+        await self.send({"type": "progress", "data": self.last_progress})
+
+    async def progress_loop(self):
+        """订阅 progress_bus，数据集进度变化时推送（包括其他用户的标注）"""
+        queue = progress_bus.subscribe(self.dataset_id, self.last_progress)
+        try:
+            while True:
+                progress = await queue.get()
+                if progress != self.last_progress:
+                    self.last_progress = progress
+                    await self.send({"type": "progress", "data": progress})
+        finally:
+            progress_bus.unsubscribe(self.dataset_id, queue)
+
+
+@router.websocket("/{dataset_id}")
+async def annotation_session(websocket: WebSocket, dataset_id: int):
+    """标注会话：认证一次后在同一连接上领取、保存、续期并接收进度推送"""
+    await websocket.accept()
+    session = AnnotationSession(websocket, dataset_id)
+    progress_task = None
+    try:
+        if not await session.authenticate():
+            return
+
+        await session.push_progress()
+        progress_task = asyncio.create_task(session.progress_loop())
+
+        while True:
+            text = await session.receive()
+            try:
+                message = json.loads(text)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await session.send({"type": "error", "req": None, "detail": "消息格式错误"})
+                continue
+            await session.handle(message)
+    except SessionClosed as e:
+        await websocket.close(code=e.code, reason=e.reason)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if progress_task is not None:
+            progress_task.cancel()
+            await asyncio.gather(progress_task, return_exceptions=True)
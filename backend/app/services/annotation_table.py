@@ -0,0 +1,147 @@
+"""列式标注表导出（Parquet / NPZ）"""
+
+import importlib.util
+from array import array
+from datetime import datetime
+from typing import Dict, Optional
+
+SPLITS = ["train", "val", "test"]
+
+
+def check_table_format(table_format: str) -> bool:
+    """检查导出格式所需的依赖是否已安装（parquet 依赖 pyarrow，npz 依赖 numpy）"""
+    module = "pyarrow" if table_format == "parquet" else "numpy"
+    return importlib.util.find_spec(module) is not None
+
+
+def _timestamp(value: Optional[datetime]) -> int:
+    """转换为 Unix 秒，空值为 -1"""
+    return int(value.timestamp()) if value else -1
+
+
+class AnnotationTableBuilder:
+    """
+    收集导出样本的所有标注框，写出为单个列式表
+
+    与导出的图片和标签一致：只记录实际写出的样本，文件名、尺寸和坐标为切片 / 缩放 / letterbox 之后的值。
+    每行一个标注框，列包括：
+        image_id（原图 ID）, filename（导出文件名）, split, class_index,
+        x_center, y_center, width, height（相对于导出图片的归一化 xywh），
+        x_min, y_min, x_max, y_max（导出图片中的像素坐标，尺寸未知时为 NaN），
+        image_width, image_height（导出图片尺寸）, labeled_by（空值为 -1），
+        created_at, labeled_at（Unix 秒，空值为 -1；切片样本的 created_at 为 -1）
+
+    数值列使用紧凑的 array 存储，写出时转为 float32 / int32 / int64 数组。
+    """
+
+    def __init__(self, category_map: Dict[int, int]):
+        self.category_map = category_map
+        self.filenames = []
+        self.columns = {
+            "image_id": array("i"),
+            "split": array("b"),
+            "class_index": array("i"),
+            "x_center": array("f"),
+            "y_center": array("f"),
+            "width": array("f"),
+            "height": array("f"),
+            "x_min": array("f"),
+            "y_min": array("f"),
+            "x_max": array("f"),
+            "y_max": array("f"),
+            "image_width": array("i"),
+            "image_height": array("i"),
+            "labeled_by": array("i"),
+            "created_at": array("q"),
+            "labeled_at": array("q"),
+        }
+
+    def add_sample(self, split: str, image: dict, annotations: list, sample):
+        """
+        添加一个已写出的导出样本的标注框
+
+        记录的是切片 / 缩放 / letterbox 之后的结果：文件名、尺寸与标注框都取自样本。
+
+        Args:
+            image: 样本对应的原图（images 表的行）
+            annotations: 原图的标注（未切片时用于取各标注框的创建时间）
+            sample: ExportSample
+        """
+        columns = self.columns
+        img_width = sample.width or 0
+        img_height = sample.height or 0
+        labeled_at = _timestamp(image.get('labeled_at'))
+
+        # 未切片时样本的标注框与参与导出的标注一一对应；切片后标注框被裁剪、可能拆分，创建时间记为 -1
+        created = []
+        if sample.tile_index is None:
+            created = [_timestamp(ann.get('created_at')) for ann in annotations
+                       if ann['category_id'] in self.category_map]
+        if len(created) != len(sample.boxes):
+            created = [-1] * len(sample.boxes)
+
+        for (class_index, x_center, y_center, width, height), created_at in zip(sample.boxes, created):
+            self.filenames.append(sample.filename)
+            columns["image_id"].append(image['id'])
+            columns["split"].append(SPLITS.index(split))
+            columns["class_index"].append(class_index)
+            columns["x_center"].append(x_center)
+            columns["y_center"].append(y_center)
+            columns["width"].append(width)
+            columns["height"].append(height)
+            if img_width and img_height:
+                columns["x_min"].append((x_center - width / 2) * img_width)
+                columns["y_min"].append((y_center - height / 2) * img_height)
+                columns["x_max"].append((x_center + width / 2) * img_width)
+                columns["y_max"].append((y_center + height / 2) * img_height)
+            else:
+                for name in ("x_min", "y_min", "x_max", "y_max"):
+                    columns[name].append(float("nan"))
+            columns["image_width"].append(img_width)
+            columns["image_height"].append(img_height)
+            columns["labeled_by"].append(image.get('labeled_by') or -1)
+            columns["created_at"].append(created_at)
+            columns["labeled_at"].append(labeled_at)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def to_numpy(self) -> dict:
+        """转换为 NumPy 数组字典"""
+        import numpy as np
+
+        dtypes = {"f": np.float32, "i": np.int32, "b": np.int8, "q": np.int64}
+        arrays = {
+            name: np.frombuffer(column, dtype=dtypes[column.typecode]) if len(column)
+            else np.zeros(0, dtype=dtypes[column.typecode])
+            for name, column in self.columns.items()
+        }
+        arrays["filename"] = np.array(self.filenames, dtype=str)
+        arrays["split_names"] = np.array(SPLITS)
+        return arrays
+
+    def write(self, path: str, table_format: str):
+        """
+        写出标注表
+
+        Args:
+            path: 输出文件路径
+            table_format: parquet 或 npz
+        """
+        arrays = self.to_numpy()
+
+        if table_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            split_names = arrays.pop("split_names")
+            split_codes = arrays.pop("split")
+            table = pa.table({
+                "split": pa.DictionaryArray.from_arrays(split_codes, pa.array(split_names)),
+                **{name: pa.array(values) for name, values in arrays.items()}
+            })
+            pq.write_table(table, path, compression="zstd")
+        else:
+            import numpy as np
+
+            np.savez_compressed(path, **arrays)
@@ -0,0 +1,42 @@
+"""后台周期任务"""
+
+import asyncio
+import logging
+from typing import Callable, List
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+_tasks: List[asyncio.Task] = []
+
+
+def start_periodic(name: str, interval: float, func: Callable[[], None], run_immediately: bool = False):
+    """
+    启动周期任务，func 在线程池中执行（可以使用阻塞的数据库连接）
+
+    Args:
+        name: 任务名（用于日志）
+        interval: 执行间隔（秒）
+        func: 无参数的同步函数
+        run_immediately: 启动后立即执行一次，而不是等待第一个间隔
+    """
+    async def runner():
+        delay = 0 if run_immediately else interval
+        while True:
+            await asyncio.sleep(delay)
+            delay = interval
+            try:
+                await run_in_threadpool(func)
+            except Exception:
+                logger.exception("后台任务 %s 执行失败", name)
+
+    _tasks.append(asyncio.create_task(runner(), name=name))
+
+
+async def stop_periodic():
+    """停止所有周期任务"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
@@ -0,0 +1,77 @@
+"""流式 COCO JSON 写入器"""
+
+import json
+import os
+import shutil
+import tempfile
+
+
+class CocoJsonWriter:
+    """
+    流式写出 COCO JSON，内存占用与数据集大小无关
+
+    images 直接写入目标文件，annotations 先写入同目录下的临时文件，
+    关闭时再拼接到 images 之后。默认使用紧凑分隔符；pretty=True 时每个元素单独一行。
+    """
+
+    def __init__(self, path: str, info: dict, categories: list, pretty: bool = False):
+        self.path = path
+        self.categories = categories
+        self.pretty = pretty
+        self._separators = (", ", ": ") if pretty else (",", ":")
+        self._item_sep = ",\n" if pretty else ","
+        self._image_count = 0
+        self._annotation_count = 0
+
+        self._file = open(path, "w", encoding="utf-8")
+        self._annotations_file = tempfile.TemporaryFile(
+            "w+", encoding="utf-8", dir=os.path.dirname(path) or None
+        )
+
+        self._file.write("{")
+        self._write_key("info", info)
+        self._file.write(",")
+        self._write_key("licenses", [])
+        self._file.write(',"images":[' + ("\n" if pretty else ""))
+
+    def add_image(self, image: dict):
+        """写入一条 image 记录"""
+        if self._image_count:
+            self._file.write(self._item_sep)
+        self._file.write(self._dumps(image))
+        self._image_count += 1
+
+    def add_annotation(self, annotation: dict):
+        """写入一条 annotation 记录"""
+        if self._annotation_count:
+            self._annotations_file.write(self._item_sep)
+        self._annotations_file.write(self._dumps(annotation))
+        self._annotation_count += 1
+
+    def close(self):
+        """拼接 annotations 与 categories 并关闭文件"""
+        newline = "\n" if self.pretty else ""
+        self._file.write(newline + '],"annotations":[' + newline)
+        self._annotations_file.seek(0)
+        shutil.copyfileobj(self._annotations_file, self._file)
+        self._annotations_file.close()
+        self._file.write(newline + "],")
+        self._write_key("categories", self.categories)
+        self._file.write("}")
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._annotations_file.close()
+            self._file.close()
+
+    def _write_key(self, key: str, value):
+        self._file.write(f"{json.dumps(key)}:{self._dumps(value)}")
+
+    def _dumps(self, value) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=self._separators)
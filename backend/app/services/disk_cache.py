@@ -0,0 +1,175 @@
+"""基于磁盘的内容寻址 LRU 缓存"""
+
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Optional
+
+
+class DiskCache:
+    """
+    磁盘 LRU 缓存
+
+    条目按 key 存放在 root/<key[:2]>/<key><suffix>，可以是文件或目录。
+    命中时刷新 mtime，超出容量时按 mtime 从旧到新淘汰。
+    多个进程可以共享同一目录：写入通过重命名完成，淘汰只删除整个条目。
+    本进程刚写入或刚返回的条目在 pin_seconds 内不会被本进程淘汰；其他进程仍可能淘汰，
+    读取方在条目文件不存在时应重新生成。
+    """
+
+    def __init__(self, root: str, max_bytes: int, evict_interval: Optional[float] = 30.0,
+                 pin_seconds: float = 60.0):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self.pin_seconds = pin_seconds
+        self._last_evict = 0.0
+        self._pinned: Dict[str, float] = {}  # 条目路径 -> 解除保护的时间
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str, suffix: str = "") -> str:
+        """获取条目的存放路径"""
+        return os.path.join(self.root, key[:2], f"{key}{suffix}")
+
+    def get(self, key: str, suffix: str = "") -> Optional[str]:
+        """
+        查找缓存条目
+
+        Returns:
+            条目路径，不存在时返回 None
+        """
+        path = self.path_for(key, suffix)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        self._pin(path)
+        return path
+
+    def put(self, key: str, src: str, suffix: str = "") -> str:
+        """
+        将文件或目录移入缓存
+
+        若其他进程已写入相同条目，则丢弃 src 并返回已有条目。
+
+        Returns:
+            条目路径
+        """
+        path = self.path_for(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # 先移动到缓存目录内的临时名，再原子重命名
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        shutil.move(src, tmp_path)
+        try:
+            if os.path.exists(path):
+                raise FileExistsError(path)
+            os.replace(tmp_path, path)
+        except OSError:
+            _remove(tmp_path)
+            os.utime(path)
+
+        self._pin(path)
+        self.maybe_evict()
+        return path
+
+    def _pin(self, path: str):
+        with self._lock:
+            self._pinned[os.path.normpath(path)] = time.monotonic() + self.pin_seconds
+
+    def _pinned_paths(self) -> set:
+        now = time.monotonic()
+        with self._lock:
+            self._pinned = {path: until for path, until in self._pinned.items() if until > now}
+            return set(self._pinned)
+
+    def maybe_evict(self):
+        """距上次淘汰超过 evict_interval 时执行淘汰（evict_interval 为 None 时只由调用方显式淘汰）"""
+        if self.evict_interval is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_evict < self.evict_interval:
+                return
+            self._last_evict = now
+        self.evict()
+
+    def evict(self, max_bytes: Optional[int] = None, keep: Iterable[str] = ()) -> int:
+        """
+        按 LRU 淘汰条目直到总大小不超过 max_bytes
+
+        Args:
+            keep: 不淘汰的条目路径（仍被引用的条目），其大小仍计入总大小；本进程刚写入或刚返回的条目同样保留
+
+        Returns:
+            释放的字节数
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        keep = {os.path.normpath(path) for path in keep} | self._pinned_paths()
+        entries = []
+        total = 0
+        for entry_path in self._iter_entries():
+            try:
+                mtime = os.stat(entry_path).st_mtime
+            except OSError:
+                continue
+            size = path_size(entry_path)
+            total += size
+            if os.path.normpath(entry_path) not in keep:
+                entries.append((mtime, size, entry_path))
+
+        freed = 0
+        entries.sort()
+        for mtime, size, entry_path in entries:
+            if total <= limit:
+                break
+            _remove(entry_path)
+            total -= size
+            freed += size
+
+        return freed
+
+    def total_size(self) -> int:
+        """缓存占用的总字节数"""
+        return sum(path_size(p) for p in self._iter_entries())
+
+    def _iter_entries(self):
+        if not os.path.isdir(self.root):
+            return
+        for bucket in os.listdir(self.root):
+            bucket_path = os.path.join(self.root, bucket)
+            if not os.path.isdir(bucket_path):
+                continue
+            for name in os.listdir(bucket_path):
+                if name.endswith(".tmp"):
+                    continue
+                yield os.path.join(bucket_path, name)
+
+
+def path_size(path: str) -> int:
+    """文件或目录的总字节数"""
+    if not os.path.isdir(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
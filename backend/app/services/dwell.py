@@ -0,0 +1,81 @@
+"""标注停留时间：计算、分桶与分位数估计"""
+
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+# 直方图桶上界（秒），最后一个桶为溢出桶
+DWELL_BUCKETS = [1, 2, 3, 5, 7, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300, 600, 900, 1800]
+
+
+def compute_dwell_seconds(cursor, image: dict, user_id: int, client_active: Optional[float] = None,
+                          now: Optional[datetime] = None) -> int:
+    """
+    计算一张图片本次保存的停留时间
+
+    只依据该图片自己的心跳记录和客户端上报，批量保存（离线排队后补交）时各图片互不影响：
+    有心跳时为心跳累计时间加上最近一次心跳后的时长（间隔过长视为离开，不计入），客户端上报的有效操作时间只能缩短该值；
+    没有心跳时以客户端上报的有效操作时间为准；
+    两者都没有时（旧客户端）取分配时间与该用户上一次保存时间中较晚者到现在的时长。
+    结果不超过 DWELL_MAX_SECONDS。
+
+    Args:
+        image: images 表的行（保存前）
+        user_id: 保存的用户
+        client_active: 客户端上报的有效操作时间（秒）
+        now: 数据库当前时间（批量保存时查询一次），为 None 时查询
+    """
+    if image['last_heartbeat_at']:
+        if now is None:
+            cursor.execute("SELECT NOW() as now")
+            now = cursor.fetchone()['now']
+        dwell = image['dwell_seconds']
+        tail = (now - image['last_heartbeat_at']).total_seconds()
+        if 0 <= tail <= settings.DWELL_HEARTBEAT_GAP_SECONDS:
+            dwell += tail
+        if client_active is not None:
+            dwell = min(dwell, max(client_active, 0))
+    elif client_active is not None:
+        dwell = max(client_active, 0)
+    else:
+        cursor.execute(
+            "SELECT NOW() as now, MAX(labeled_at) as last_saved FROM images WHERE labeled_by = %s",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        starts = [t for t in (image['assigned_at'], row['last_saved']) if t]
+        dwell = max((row['now'] - max(starts)).total_seconds(), 0) if starts else 0
+
+    return int(round(min(dwell, settings.DWELL_MAX_SECONDS)))
+
+
+def dwell_bucket(seconds: float) -> int:
+    """停留秒数对应的桶序号"""
+    return bisect_left(DWELL_BUCKETS, seconds)
+
+
+def histogram_percentile(samples: Dict[int, int], percentile: float) -> Optional[float]:
+    """
+    由直方图估计分位数（桶内线性插值）
+
+    Args:
+        samples: 桶序号 -> 样本数
+        percentile: 0-100
+    """
+    total = sum(samples.values())
+    if total == 0:
+        return None
+
+    target = total * percentile / 100
+    cumulative = 0
+    for bucket in sorted(samples):
+        count = samples[bucket]
+        if count and cumulative + count >= target:
+            lower = DWELL_BUCKETS[bucket - 1] if bucket > 0 else 0
+            # 溢出桶没有上界，取下界
+            upper = DWELL_BUCKETS[bucket] if bucket < len(DWELL_BUCKETS) else lower
+            return round(lower + (upper - lower) * (target - cumulative) / count, 2)
+        cumulative += count
+    return float(DWELL_BUCKETS[-1])
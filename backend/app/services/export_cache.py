@@ -0,0 +1,105 @@
+"""导出产物缓存：按数据集内容版本 + 导出参数寻址"""
+
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+from app.core.config import settings
+from app.services.disk_cache import DiskCache
+
+META_FILENAME = "meta.json"
+
+# 只由导出清理任务淘汰（需要排除仍被导出任务引用的条目），写入时不自动淘汰
+export_cache = DiskCache(settings.EXPORT_CACHE_DIR, settings.EXPORT_CACHE_MAX_BYTES, evict_interval=None)
+
+
+def get_dataset_version(cursor, image_filter: str, image_params: list,
+                        annotation_filter: str, annotation_params: list, categories: List[dict]) -> str:
+    """
+    计算导出内容版本
+
+    只由导出实际读取的数据组成：符合筛选条件的图片（ID、文件名、路径、尺寸、标注人与标注时间）、
+    这些图片上参与导出的标注（类别、坐标与创建时间）和类别列表；标注人与时间写入列式标注表。
+    分配、心跳、停留时间等不影响导出结果的变更不会改变版本号。
+
+    Args:
+        image_filter / image_params: 导出图片的筛选条件（与导出使用的条件相同）
+        annotation_filter / annotation_params: 标注的附加条件（以 AND 开头）
+        categories: 参与导出的各数据集类别
+    """
+    cursor.execute(
+        f"""SELECT COUNT(*) as count, COALESCE(SUM(id), 0) as id_sum,
+                  COALESCE(SUM(CRC32(CONCAT_WS('|', id, dataset_id, filename, file_path, width, height,
+                                               COALESCE(labeled_by, ''), COALESCE(labeled_at, '')))), 0) as checksum
+           FROM images WHERE {image_filter}""",
+        image_params
+    )
+    images_marker = cursor.fetchone()
+
+    cursor.execute(
+        f"""SELECT COUNT(*) as count,
+                  COALESCE(SUM(CRC32(CONCAT_WS('|', id, image_id, category_id,
+                                               x_center, y_center, width, height, created_at))), 0) as checksum
+           FROM annotations
+           WHERE image_id IN (SELECT id FROM images WHERE {image_filter}){annotation_filter}""",
+        [*image_params, *annotation_params]
+    )
+    annotations_marker = cursor.fetchone()
+
+    categories_marker = [(cat['id'], cat['name'], cat['sort_order']) for cat in categories]
+
+    payload = json.dumps(
+        [images_marker, annotations_marker, categories_marker],
+        default=str, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_export_cache_key(dataset_version: str, options: dict) -> str:
+    """由数据集版本和导出参数（格式、分割比例、其它选项）生成缓存键"""
+    payload = json.dumps([dataset_version, options], default=str, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_cached_export(key: str) -> Optional[dict]:
+    """
+    查找已缓存的导出产物
+
+    Returns:
+        产物元数据（含 zip_path），未命中返回 None
+    """
+    entry_dir = export_cache.get(key)
+    if entry_dir is None:
+        return None
+
+    try:
+        with open(os.path.join(entry_dir, META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    zip_path = os.path.join(entry_dir, meta["filename"])
+    if not os.path.exists(zip_path):
+        return None
+
+    return {**meta, "zip_path": zip_path}
+
+
+def store_export(key: str, artifact_dir: str, meta: dict) -> dict:
+    """
+    将导出产物目录移入缓存
+
+    Args:
+        key: 缓存键
+        artifact_dir: 仅包含产物文件的目录，调用后该目录被移走
+        meta: 产物元数据，必须包含 filename（产物文件名）
+
+    Returns:
+        缓存中的产物元数据（含 zip_path）
+    """
+    with open(os.path.join(artifact_dir, META_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    entry_dir = export_cache.put(key, artifact_dir)
+    return {**meta, "zip_path": os.path.join(entry_dir, meta["filename"])}
@@ -0,0 +1,268 @@
+"""导出时的图片处理：切片 / 缩放 / letterbox / 转码，在进程池中执行"""
+
+import os
+import shutil
+from collections import deque
+from typing import List, NamedTuple, Optional, Tuple
+
+from app.services.workers import get_pool_size, get_process_pool
+
+# letterbox 填充色（与 Ultralytics 一致）
+LETTERBOX_COLOR = (114, 114, 114)
+
+FORMAT_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp"}
+
+
+def _axis_starts(length: int, tile: int, overlap: float) -> List[int]:
+    """单个方向上的窗口起点，最后一个窗口贴齐图片边缘"""
+    if length <= tile:
+        return [0]
+    stride = max(int(tile * (1 - overlap)), 1)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def tile_windows(width: int, height: int, tile: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    计算覆盖整张图片的重叠切片窗口
+
+    Returns:
+        (x1, y1, x2, y2) 像素坐标列表，按行优先排列
+    """
+    tile_w, tile_h = min(tile, width), min(tile, height)
+    return [
+        (x, y, x + tile_w, y + tile_h)
+        for y in _axis_starts(height, tile_h, overlap)
+        for x in _axis_starts(width, tile_w, overlap)
+    ]
+
+
+def clip_boxes_to_windows(boxes: list, width: int, height: int, windows: list,
+                          min_visibility: float) -> List[list]:
+    """
+    将归一化标注框裁剪到各个切片窗口内并重新归一化
+
+    Args:
+        boxes: (class_id, x_center, y_center, width, height) 列表，相对于整张图片
+        width: 图片宽度
+        height: 图片高度
+        windows: tile_windows 返回的窗口列表
+        min_visibility: 可见面积比例阈值
+
+    Returns:
+        与 windows 一一对应的标注框列表，坐标相对于各自的窗口
+    """
+    if not boxes:
+        return [[] for _ in windows]
+
+    import numpy as np
+
+    data = np.asarray(boxes, dtype=np.float64)
+    class_ids = data[:, 0].astype(int)
+    # 转为像素坐标 x1, y1, x2, y2，形状 (N, 1)
+    bx1 = ((data[:, 1] - data[:, 3] / 2) * width)[:, None]
+    by1 = ((data[:, 2] - data[:, 4] / 2) * height)[:, None]
+    bx2 = ((data[:, 1] + data[:, 3] / 2) * width)[:, None]
+    by2 = ((data[:, 2] + data[:, 4] / 2) * height)[:, None]
+    area = (bx2 - bx1) * (by2 - by1)
+
+    # 窗口坐标，形状 (1, M)
+    win = np.asarray(windows, dtype=np.float64)
+    wx1, wy1, wx2, wy2 = (win[:, i][None, :] for i in range(4))
+
+    # 交集 (N, M)
+    cx1 = np.maximum(bx1, wx1)
+    cy1 = np.maximum(by1, wy1)
+    cx2 = np.minimum(bx2, wx2)
+    cy2 = np.minimum(by2, wy2)
+    inter = np.clip(cx2 - cx1, 0, None) * np.clip(cy2 - cy1, 0, None)
+    visibility = np.divide(inter, area, out=np.zeros_like(inter), where=area > 0)
+    keep = (inter > 0) & (visibility >= min_visibility)
+
+    # 重新归一化到窗口坐标系
+    win_w = wx2 - wx1
+    win_h = wy2 - wy1
+    x_center = ((cx1 + cx2) / 2 - wx1) / win_w
+    y_center = ((cy1 + cy2) / 2 - wy1) / win_h
+    box_w = (cx2 - cx1) / win_w
+    box_h = (cy2 - cy1) / win_h
+
+    result = []
+    for j in range(len(windows)):
+        rows = np.nonzero(keep[:, j])[0]
+        result.append([
+            (int(class_ids[i]), float(x_center[i, j]), float(y_center[i, j]),
+             float(box_w[i, j]), float(box_h[i, j]))
+            for i in rows
+        ])
+    return result
+
+
+class ExportSample(NamedTuple):
+    """一个导出样本：输出文件名、输出尺寸及对应的归一化标注框"""
+    filename: str
+    width: Optional[int]
+    height: Optional[int]
+    boxes: List[Tuple[int, float, float, float, float]]  # (class_id, x_center, y_center, width, height)
+    src_path: str
+    op: Optional[dict]  # 图片处理参数，为 None 时直接复制原图
+    tile_index: Optional[int] = None  # 切片序号，未切片时为 None
+
+
+def process_image(src_path: str, dst_path: str, op: dict):
+    """按 op 处理单张图片并保存（在工作进程中执行）"""
+    from PIL import Image as PILImage
+
+    with PILImage.open(src_path) as img:
+        img.load()
+        if op.get("crop"):
+            img = img.crop(op["crop"])
+
+        out_w, out_h = op["resized"]
+        if img.size != (out_w, out_h):
+            img = img.resize((out_w, out_h), PILImage.Resampling.BILINEAR)
+
+        if op.get("canvas"):
+            canvas_w, canvas_h = op["canvas"]
+            mode = "RGB" if img.mode not in ("L", "RGB") else img.mode
+            fill = LETTERBOX_COLOR[0] if mode == "L" else LETTERBOX_COLOR
+            canvas = PILImage.new(mode, (canvas_w, canvas_h), fill)
+            canvas.paste(img.convert(mode), op["offset"])
+            img = canvas
+
+        save_format = op.get("format")
+        if save_format == "jpeg" and img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+
+        params = {}
+        if save_format in ("jpeg", "webp") or os.path.splitext(dst_path)[1].lower() in (".jpg", ".jpeg", ".webp"):
+            params["quality"] = op["quality"]
+        img.save(dst_path, format=save_format.upper() if save_format else None, **params)
+
+
+class ExportImageWriter:
+    """
+    导出图片写入器
+
+    不做任何处理时直接复制原图；设置切片、目标尺寸或输出格式时，图片在进程池中处理，
+    标注框随切片裁剪、letterbox 的缩放和填充一起换算。
+
+    Args:
+        size: 目标尺寸（长边），为 None 时保持原尺寸
+        mode: letterbox（等比缩放后填充为 size x size）或 resize（等比缩放，长边为 size，不放大）
+        image_format: 输出格式 jpeg / webp，为 None 时保持原格式
+        quality: JPEG / WebP 质量
+        tile_size: 切片窗口边长（像素），为 None 时不切片
+        tile_overlap: 相邻切片的重叠比例
+        tile_min_visibility: 标注框在切片内的可见面积比例低于该值时丢弃
+    """
+
+    def __init__(self, size: Optional[int] = None, mode: str = "letterbox",
+                 image_format: Optional[str] = None, quality: int = 90,
+                 tile_size: Optional[int] = None, tile_overlap: float = 0.2,
+                 tile_min_visibility: float = 0.3):
+        self.size = size
+        self.mode = mode
+        self.image_format = image_format
+        self.quality = quality
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tile_min_visibility = tile_min_visibility
+        self._pending = deque()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.size or self.image_format or self.tile_size)
+
+    @property
+    def tiled(self) -> bool:
+        return bool(self.tile_size)
+
+    def samples(self, image: dict, annotations: list, category_map: dict) -> List[ExportSample]:
+        """生成图片对应的导出样本"""
+        boxes = [
+            (category_map[ann['category_id']], ann['x_center'], ann['y_center'], ann['width'], ann['height'])
+            for ann in annotations if ann['category_id'] in category_map
+        ]
+
+        if not self.enabled:
+            return [ExportSample(image['filename'], image['width'], image['height'], boxes, image['file_path'], None)]
+
+        stem, ext = os.path.splitext(image['filename'])
+        if self.image_format:
+            ext = FORMAT_EXTENSIONS[self.image_format]
+
+        width, height = self._source_size(image)
+        if not width or not height:
+            return [ExportSample(image['filename'], image['width'], image['height'], boxes, image['file_path'], None)]
+
+        if not self.tiled:
+            return [self._sample(stem + ext, image['file_path'], (width, height), None, boxes)]
+
+        samples = []
+        windows = tile_windows(width, height, self.tile_size, self.tile_overlap)
+        tile_boxes = clip_boxes_to_windows(boxes, width, height, windows, self.tile_min_visibility)
+        for index, (window, window_boxes) in enumerate(zip(windows, tile_boxes)):
+            x1, y1 = window[0], window[1]
+            samples.append(self._sample(f"{stem}_{x1}_{y1}{ext}", image['file_path'],
+                                        (window[2] - x1, window[3] - y1), window, window_boxes, index))
+        return samples
+
+    def _sample(self, filename: str, src_path: str, size: Tuple[int, int], crop: Optional[tuple],
+                boxes: list, tile_index: Optional[int] = None) -> ExportSample:
+        """根据目标尺寸与缩放模式生成样本，并换算标注框"""
+        width, height = size
+        op = {"format": self.image_format, "quality": self.quality, "resized": (width, height), "crop": crop}
+        out_w, out_h = width, height
+
+        if self.size:
+            if self.mode == "letterbox":
+                scale = min(self.size / width, self.size / height)
+            else:
+                scale = min(self.size / max(width, height), 1.0)
+            new_w, new_h = max(round(width * scale), 1), max(round(height * scale), 1)
+            op["resized"] = (new_w, new_h)
+            out_w, out_h = new_w, new_h
+
+            if self.mode == "letterbox":
+                left, top = (self.size - new_w) // 2, (self.size - new_h) // 2
+                op["canvas"] = (self.size, self.size)
+                op["offset"] = (left, top)
+                out_w = out_h = self.size
+                # 归一化坐标换算到填充后的画布
+                boxes = [
+                    (class_id,
+                     (x * new_w + left) / self.size, (y * new_h + top) / self.size,
+                     w * new_w / self.size, h * new_h / self.size)
+                    for class_id, x, y, w, h in boxes
+                ]
+
+        return ExportSample(filename, out_w, out_h, boxes, src_path, op, tile_index)
+
+    def write(self, sample: ExportSample, dst_path: str):
+        """写出样本图片；需要处理时提交到进程池"""
+        if sample.op is None:
+            shutil.copy2(sample.src_path, dst_path)
+            return
+
+        pool = get_process_pool()
+        # 限制排队中的任务数量，避免大数据集时占用过多内存
+        if len(self._pending) >= get_pool_size() * 4:
+            self._pending.popleft().result()
+        self._pending.append(pool.submit(process_image, sample.src_path, dst_path, sample.op))
+
+    def wait(self):
+        """等待所有图片处理完成"""
+        while self._pending:
+            self._pending.popleft().result()
+
+    def _source_size(self, image: dict) -> Tuple[Optional[int], Optional[int]]:
+        if image['width'] and image['height']:
+            return image['width'], image['height']
+        try:
+            from PIL import Image as PILImage
+            with PILImage.open(image['file_path']) as img:
+                return img.size
+        except Exception:
+            return None, None
@@ -0,0 +1,231 @@
+"""导出任务登记与产物清理"""
+
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+from app.core.config import settings
+from app.core.database import get_db, named_lock
+from app.services.disk_cache import path_size
+from app.services.export_cache import export_cache
+
+logger = logging.getLogger(__name__)
+
+GC_LOCK_NAME = "torch_markup_export_gc"
+
+# 未登记且未加构建锁的导出临时目录在此时间后视为遗留
+ORPHAN_GRACE_SECONDS = 3600
+
+# 构建锁文件：与临时目录同名，位于导出工作目录下
+LOCK_SUFFIX = ".lock"
+
+
+class ExportDirs:
+    """
+    一次导出请求中创建的临时目录
+
+    构建期间持有每个目录的构建锁（同名 .lock 文件上的 flock 排他锁），清理任务跳过锁被持有的目录，
+    无论导出耗时多久都不会被误删；持有锁的进程退出时锁自动释放，遗留目录随后被清理。
+    """
+
+    def __init__(self):
+        self._locks = []
+
+    def create(self, prefix: str) -> str:
+        """在导出工作目录下创建临时目录并加构建锁"""
+        os.makedirs(settings.EXPORT_WORK_DIR, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=prefix, dir=settings.EXPORT_WORK_DIR)
+        fd = os.open(path + LOCK_SUFFIX, os.O_CREAT | os.O_RDWR, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._locks.append((path, fd))
+        return path
+
+    def release(self):
+        """释放构建锁（导出已登记或已移入缓存，或导出失败）"""
+        for path, fd in self._locks:
+            # 刷新目录时间，登记事务提交前的短暂间隔内由 ORPHAN_GRACE_SECONDS 保护
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            try:
+                os.remove(path + LOCK_SUFFIX)
+            except OSError:
+                pass
+            os.close(fd)
+        self._locks = []
+
+
+def export_dirs_dependency():
+    """FastAPI 依赖：请求结束（包括异常）时释放请求中创建的临时目录的构建锁"""
+    dirs = ExportDirs()
+    try:
+        yield dirs
+    finally:
+        dirs.release()
+
+
+def create_export_task(
+    cursor,
+    dataset_id: int,
+    format: str,
+    filename: str,
+    zip_path: str,
+    export_dir: Optional[str],
+    created_by: Optional[int]
+) -> str:
+    """
+    登记导出任务
+
+    Args:
+        export_dir: 导出临时目录，过期后整体删除；为 None 表示产物归导出缓存所有
+
+    Returns:
+        任务 ID
+    """
+    task_id = f"export_{dataset_id}_{uuid.uuid4().hex[:12]}"
+    # 过期时间由数据库计算，与查询、清理时的 NOW() 使用同一时钟和时区
+    cursor.execute(
+        """INSERT INTO export_tasks
+           (task_id, dataset_id, format, filename, zip_path, export_dir, file_size, created_by, expires_at)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW() + INTERVAL %s SECOND)""",
+        (task_id, dataset_id, format, filename, zip_path, export_dir,
+         path_size(zip_path), created_by, settings.EXPORT_TASK_TTL_SECONDS)
+    )
+    return task_id
+
+
+def get_export_task(cursor, task_id: str) -> Optional[dict]:
+    """获取未过期的导出任务"""
+    cursor.execute(
+        "SELECT * FROM export_tasks WHERE task_id = %s AND expires_at > NOW()",
+        (task_id,)
+    )
+    return cursor.fetchone()
+
+
+def collect_export_garbage():
+    """
+    清理导出产物
+
+    1. 删除过期任务及其临时目录
+    2. 删除未被任何任务引用的遗留临时目录（如导出中途失败）
+    3. 产物总大小超出 EXPORT_MAX_DISK_BYTES 时，先删除最旧的任务，再淘汰导出缓存中未被任务引用的条目
+
+    通过 MySQL 命名锁保证多个 worker 中同一时刻只有一个执行清理。
+    """
+    with get_db() as conn:
+        with named_lock(conn, GC_LOCK_NAME) as acquired:
+            if not acquired:
+                return
+
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT task_id, export_dir FROM export_tasks WHERE expires_at <= NOW()")
+                expired = cursor.fetchall()
+                for task in expired:
+                    if task['export_dir']:
+                        shutil.rmtree(task['export_dir'], ignore_errors=True)
+                    cursor.execute("DELETE FROM export_tasks WHERE task_id = %s", (task['task_id'],))
+                conn.commit()
+
+                cursor.execute(
+                    """SELECT task_id, export_dir FROM export_tasks
+                       WHERE export_dir IS NOT NULL ORDER BY created_at"""
+                )
+                live_tasks = cursor.fetchall()
+
+                # 未过期任务引用的缓存条目（产物文件位于条目目录下）不参与淘汰，避免下载时文件已不存在
+                cursor.execute("SELECT zip_path FROM export_tasks WHERE export_dir IS NULL")
+                cached_entries = {os.path.dirname(task['zip_path']) for task in cursor.fetchall()}
+
+            live_dirs = {os.path.normpath(task['export_dir']) for task in live_tasks}
+            _remove_orphan_dirs(live_dirs)
+
+            # 磁盘配额：临时目录中的产物优先清理，剩余额度留给缓存
+            work_size = path_size(settings.EXPORT_WORK_DIR) if os.path.isdir(settings.EXPORT_WORK_DIR) else 0
+            with conn.cursor() as cursor:
+                for task in live_tasks:
+                    if work_size <= settings.EXPORT_MAX_DISK_BYTES:
+                        break
+                    size = path_size(task['export_dir'])
+                    shutil.rmtree(task['export_dir'], ignore_errors=True)
+                    cursor.execute("DELETE FROM export_tasks WHERE task_id = %s", (task['task_id'],))
+                    work_size -= size
+                conn.commit()
+
+            export_cache.evict(min(max(settings.EXPORT_MAX_DISK_BYTES - work_size, 0), settings.EXPORT_CACHE_MAX_BYTES),
+                               keep=cached_entries)
+
+    if expired:
+        logger.info("已清理 %d 个过期导出任务", len(expired))
+
+
+def _remove_orphan_dirs(live_dirs: set):
+    if not os.path.isdir(settings.EXPORT_WORK_DIR):
+        return
+
+    now = time.time()
+    for name in os.listdir(settings.EXPORT_WORK_DIR):
+        path = os.path.normpath(os.path.join(settings.EXPORT_WORK_DIR, name))
+        if name.endswith(LOCK_SUFFIX):
+            # 临时目录已不存在、构建进程已退出的锁文件
+            dir_path = path[:-len(LOCK_SUFFIX)]
+            if not os.path.exists(dir_path) and _lock_state(dir_path) == "stale":
+                _remove_lock_file(path)
+            continue
+        if path in live_dirs:
+            continue
+
+        state = _lock_state(path)
+        if state == "building":
+            continue
+        if state != "stale":
+            # 没有构建锁：旧版本遗留或刚释放锁、等待登记提交的目录
+            try:
+                if now - os.stat(path).st_mtime < ORPHAN_GRACE_SECONDS:
+                    continue
+            except OSError:
+                continue
+        shutil.rmtree(path, ignore_errors=True)
+        if state == "stale":
+            _remove_lock_file(path + LOCK_SUFFIX)
+
+
+def _lock_state(path: str) -> Optional[str]:
+    """
+    临时目录的构建锁状态
+
+    Returns:
+        "building"（构建中）、"stale"（构建进程已退出）或 None（没有锁文件，或锁已正常释放）
+    """
+    lock_path = path + LOCK_SUFFIX
+    try:
+        fd = os.open(lock_path, os.O_RDWR)
+    except OSError:
+        return None
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return "building"
+        # 取得锁后确认锁文件没有在此期间被正常释放（删除）
+        try:
+            if os.stat(lock_path).st_ino != os.fstat(fd).st_ino:
+                return None
+        except OSError:
+            return None
+        return "stale"
+    finally:
+        os.close(fd)
+
+
+def _remove_lock_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
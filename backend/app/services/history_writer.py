@@ -0,0 +1,236 @@
+"""标注历史（annotation_history）的写后批量写入"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import pymysql
+
+from app.core.config import settings
+from app.core.database import get_db
+
+logger = logging.getLogger(__name__)
+
+INSERT_SQL = """
+    INSERT INTO annotation_history (image_id, user_id, action, annotation_data, created_at)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# 认领后超过该时间仍未完成的 spool 文件视为认领进程已退出（秒）
+STALE_CLAIM_SECONDS = 600
+
+# 已写入的 spool 文件名的保留天数（只在写入后、删除文件前退出的文件重新读回时需要）
+SPOOL_APPLIED_RETENTION_DAYS = 7
+
+# (image_id, user_id, action, annotation_data, created_at)
+Entry = Tuple[int, int, str, dict, datetime]
+
+
+class HistoryWriter:
+    """
+    在进程内缓冲标注历史，按间隔或缓冲区满时以多行 INSERT 写入，请求事务中不再写历史
+
+    created_at 取记录时的时间，写入时换算到数据库时钟（与其他时间列一致），延迟写入不影响历史顺序。
+    写入失败的条目放回缓冲区，下次重试；缓冲条目超过 max_buffered（数据库长时间不可用）
+    或进程退出时仍未写入的条目追加到 spool_dir 下的文件，之后由任一 worker 读回写入。
+    """
+
+    def __init__(self, max_pending: int, max_buffered: int, spool_dir: str):
+        self.max_pending = max_pending
+        self.max_buffered = max_buffered
+        self.spool_dir = spool_dir
+        self._pending: List[Entry] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_scheduled = False
+
+    def add(self, image_id: int, user_id: int, action: str, data: dict):
+        """记录一条历史（不访问数据库）"""
+        with self._lock:
+            self._pending.append((image_id, user_id, action, data, datetime.now()))
+            full = len(self._pending) >= self.max_pending and not self._flush_scheduled
+            if full:
+                self._flush_scheduled = True
+
+        if full:
+            # 在后台线程写入，不占用请求的时间
+            threading.Thread(target=self.flush, name="history-flush", daemon=True).start()
+
+    def flush(self):
+        """写入缓冲区中的全部历史，之后读回 spool 文件（后台任务调用）"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._flush_scheduled = False
+
+            try:
+                if pending:
+                    _write(pending)
+            except Exception:
+                logger.exception("标注历史写入失败，%d 条将在下次重试", len(pending))
+                with self._lock:
+                    self._pending[:0] = pending
+                    overflow = len(self._pending) > self.max_buffered
+                    if overflow:
+                        pending, self._pending = self._pending, []
+                if overflow:
+                    self._spool(pending)
+                return
+
+            try:
+                self._recover_spool()
+            except Exception:
+                logger.exception("读回 spool 中的标注历史失败，稍后重试")
+
+    def close(self):
+        """进程退出时调用：写入剩余历史，失败时保存到 spool 文件"""
+        self.flush()
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                self._spool(pending)
+
+    def _spool(self, entries: List[Entry]):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = os.path.join(self.spool_dir, f"history-{os.getpid()}-{uuid.uuid4().hex}.jsonl")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for image_id, user_id, action, data, created_at in entries:
+                f.write(json.dumps({
+                    "image_id": image_id,
+                    "user_id": user_id,
+                    "action": action,
+                    "data": data,
+                    "created_at": created_at.isoformat(),
+                }, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        logger.warning("%d 条标注历史已保存到 %s", len(entries), path)
+
+    def _recover_spool(self):
+        # 认领时重命名为 <文件>.<pid>.recovering，避免多个 worker 同时写入；
+        # 认领进程中途退出留下的文件（进程已不存在或超过 STALE_CLAIM_SECONDS）重新认领
+        sources = [(path, path) for path in glob.glob(os.path.join(self.spool_dir, "history-*.jsonl"))]
+        sources += [
+            (claim, claim.rsplit(".", 2)[0])
+            for claim in glob.glob(os.path.join(self.spool_dir, "history-*.jsonl.*.recovering"))
+            if _is_stale_claim(claim)
+        ]
+        for source, path in sources:
+            claimed = f"{path}.{os.getpid()}.recovering"
+            try:
+                os.rename(source, claimed)
+                # 重命名保留原文件时间，刷新后其他 worker 才不会把刚认领的文件当作遗留
+                os.utime(claimed)
+                with open(claimed, encoding="utf-8") as f:
+                    entries = []
+                    for line in f:
+                        item = json.loads(line)
+                        entries.append((item["image_id"], item["user_id"], item["action"], item["data"],
+                                        datetime.fromisoformat(item["created_at"])))
+            except OSError:
+                continue
+            try:
+                applied = _write(entries, spool_name=os.path.basename(path))
+            except Exception:
+                os.rename(claimed, path)
+                raise
+            os.remove(claimed)
+            if applied:
+                logger.info("已从 %s 写入 %d 条标注历史", path, len(entries))
+            else:
+                logger.info("%s 中的标注历史此前已写入，删除文件", path)
+
+
+def _is_stale_claim(path: str) -> bool:
+    """认领文件的进程是否已不存在（同一进程的认领只在持有 _flush_lock 时存在，也视为遗留）"""
+    try:
+        if time.time() - os.stat(path).st_mtime > STALE_CLAIM_SECONDS:
+            return True
+        pid = int(path.rsplit(".", 2)[1])
+    except (OSError, ValueError):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+
+def _write(entries: List[Entry], spool_name: Optional[str] = None) -> bool:
+    """
+    在一个事务中写入历史
+
+    条目的时间取自应用服务器时钟，写入时按同一事务中数据库 NOW() 与本机时间之差换算到数据库时钟，
+    应用服务器与数据库的时钟、时区不一致时历史时间也与 CURRENT_TIMESTAMP 写入的时间一致。
+
+    Args:
+        spool_name: 从 spool 文件读回时的文件名，与历史在同一事务中记录，重复读回同一文件时不再写入
+
+    Returns:
+        是否写入（spool 文件此前已写入时返回 False）
+    """
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cursor:
+                if spool_name and not _mark_spool_applied(cursor, spool_name, len(entries)):
+                    return False
+                cursor.executemany(INSERT_SQL, _rows(cursor, entries))
+    except pymysql.err.IntegrityError:
+        # 图片或用户已被删除（外键），逐条写入并丢弃这些条目，避免整批反复失败
+        with get_db() as conn:
+            with conn.cursor() as cursor:
+                if spool_name and not _mark_spool_applied(cursor, spool_name, len(entries)):
+                    return False
+                for row in _rows(cursor, entries):
+                    try:
+                        cursor.execute(INSERT_SQL, row)
+                    except pymysql.err.IntegrityError:
+                        logger.warning("丢弃无法写入的标注历史: image_id=%s user_id=%s", row[0], row[1])
+    return True
+
+
+def _rows(cursor, entries: List[Entry]) -> list:
+    # 本机时间到数据库时钟的偏移（包括时区差）
+    cursor.execute("SELECT NOW() as now")
+    offset = cursor.fetchone()['now'] - datetime.now()
+    return [
+        (image_id, user_id, action, json.dumps(data), created_at + offset)
+        for image_id, user_id, action, data, created_at in entries
+    ]
+
+
+def _mark_spool_applied(cursor, spool_name: str, count: int) -> bool:
+    try:
+        cursor.execute(
+            "INSERT INTO history_spool_applied (name, entries) VALUES (%s, %s)",
+            (spool_name, count)
+        )
+    except pymysql.err.IntegrityError:
+        return False
+    return True
+
+
+def purge_spool_applied():
+    """删除超过 SPOOL_APPLIED_RETENTION_DAYS 的已写入 spool 文件名（后台任务调用）"""
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM history_spool_applied WHERE applied_at < NOW() - INTERVAL %s DAY",
+                (SPOOL_APPLIED_RETENTION_DAYS,)
+            )
+
+
+history_writer = HistoryWriter(settings.HISTORY_MAX_PENDING, settings.HISTORY_MAX_BUFFERED, settings.HISTORY_SPOOL_DIR)
@@ -0,0 +1,224 @@
+"""
+图片派生图：缩略图 / 预览图与显示用转码（WebP / AVIF）
+
+在进程池中生成，按源文件内容标识缓存到磁盘；原图不做任何修改，导出始终使用原图。
+"""
+
+import hashlib
+import mimetypes
+import os
+import threading
+import uuid
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.services.disk_cache import DiskCache
+from app.services.image_files import ImageFile
+from app.services.workers import get_process_pool
+
+FORMAT_SUFFIXES = {"jpeg": ".jpg", "webp": ".webp", "avif": ".avif"}
+FORMAT_MEDIA_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "avif": "image/avif"}
+
+mimetypes.add_type("image/avif", ".avif")
+
+derivative_cache = DiskCache(settings.IMAGE_DERIVATIVE_CACHE_DIR, settings.IMAGE_DERIVATIVE_CACHE_MAX_BYTES)
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_avif_available: Optional[bool] = None
+
+
+class DerivativeStats:
+    """派生图缓存命中率与节省的传输字节数（当前 worker）"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.responses = 0
+        self.original_bytes = 0
+        self.served_bytes = 0
+        self._lock = threading.Lock()
+
+    def record_lookup(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def record_response(self, original: ImageFile, served: ImageFile):
+        """记录一次以派生图代替原图的完整响应"""
+        with self._lock:
+            self.responses += 1
+            self.original_bytes += original.stat.st_size
+            self.served_bytes += served.stat.st_size
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "responses": self.responses,
+                "original_bytes": self.original_bytes,
+                "served_bytes": self.served_bytes,
+                "bytes_saved": self.original_bytes - self.served_bytes,
+            }
+
+
+derivative_stats = DerivativeStats()
+
+
+def get_derivative_sizes() -> Dict[str, int]:
+    """尺寸名称 -> 长边像素（full 为原图尺寸）"""
+    return {"thumb": settings.IMAGE_THUMB_SIZE, "preview": settings.IMAGE_PREVIEW_SIZE}
+
+
+def get_format_quality(image_format: str) -> int:
+    return {
+        "jpeg": settings.IMAGE_DERIVATIVE_QUALITY,
+        "webp": settings.IMAGE_WEBP_QUALITY,
+        "avif": settings.IMAGE_AVIF_QUALITY,
+    }[image_format]
+
+
+def avif_available() -> bool:
+    """是否可以编码 AVIF（需要安装 pillow-avif-plugin）"""
+    global _avif_available
+    if _avif_available is None:
+        try:
+            import pillow_avif  # noqa: F401
+            _avif_available = True
+        except ImportError:
+            _avif_available = False
+    return _avif_available
+
+
+def negotiate_format(accept: Optional[str]) -> Optional[str]:
+    """
+    按 Accept 请求头和 IMAGE_TRANSCODE_FORMATS 的优先级选择输出格式
+
+    Returns:
+        webp / avif；客户端不接受或未启用转码时返回 None
+    """
+    if not accept:
+        return None
+
+    # 只认明确列出的类型（image/* 不代表客户端能解码 AVIF / WebP）
+    accepted = set()
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    pass
+        if weight > 0:
+            accepted.add(media_type.lower())
+
+    for image_format in settings.IMAGE_TRANSCODE_FORMATS:
+        if image_format == "avif" and not avif_available():
+            continue
+        if FORMAT_MEDIA_TYPES.get(image_format) in accepted:
+            return image_format
+    return None
+
+
+def should_transcode(image: ImageFile) -> bool:
+    """原尺寸请求是否按 Accept 转码（只转码 BMP / PNG 等体积大的原图格式）"""
+    return bool(settings.IMAGE_TRANSCODE_FORMATS) and \
+        os.path.splitext(image.path)[1].lower() in settings.IMAGE_TRANSCODE_EXTENSIONS
+
+
+def make_derivative(src_path: str, dst_path: str, max_edge: Optional[int], image_format: str, quality: int):
+    """等比缩小到长边不超过 max_edge（为 None 时保持原尺寸）并按指定格式保存（在工作进程中执行）"""
+    from PIL import Image as PILImage
+
+    if image_format == "avif":
+        import pillow_avif  # noqa: F401
+
+    with PILImage.open(src_path) as img:
+        if max_edge:
+            # thumbnail 对 JPEG 使用 draft 模式按 1/2、1/4、1/8 解码，大图无需完整解码
+            img.thumbnail((max_edge, max_edge), PILImage.Resampling.BILINEAR)
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        img.save(dst_path, format=image_format.upper(), quality=quality)
+
+
+def derivative_key(image: ImageFile, size: str, image_format: str) -> str:
+    """缓存键：源文件标识 (路径, inode, 大小, 修改时间) + 尺寸 + 格式 + 质量，源文件变化后自动失效"""
+    payload = "|".join(str(part) for part in (
+        image.path, image.etag, size, get_derivative_sizes().get(size), image_format, get_format_quality(image_format)
+    ))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get_derivative(image: ImageFile, size: str, image_format: Optional[str] = None) -> ImageFile:
+    """
+    获取图片的派生图，缓存未命中时在进程池中生成
+
+    同一进程内对同一条目的并发请求只生成一次。
+
+    Args:
+        image: 原图
+        size: thumb / preview / full（full 为原尺寸转码）
+        image_format: jpeg / webp / avif，为 None 时使用 JPEG
+
+    Returns:
+        缓存中的派生图
+    """
+    image_format = image_format or "jpeg"
+    suffix = FORMAT_SUFFIXES[image_format]
+    key = derivative_key(image, size, image_format)
+    path = derivative_cache.get(key, suffix)
+    derivative_stats.record_lookup(path is not None)
+    if path is not None:
+        try:
+            return ImageFile(path, os.stat(path))
+        except FileNotFoundError:
+            # 查找后被其他进程淘汰，重新生成
+            pass
+
+    path = _generate_once(image, size, image_format, key)
+    return ImageFile(path, os.stat(path))
+
+
+def _generate_once(image: ImageFile, size: str, image_format: str, key: str) -> str:
+    """生成派生图；同一进程内对同一条目的并发请求只生成一次"""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+
+    if owner:
+        try:
+            future.set_result(_generate(image, size, image_format, key))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+    return future.result()
+
+
+def _generate(image: ImageFile, size: str, image_format: str, key: str) -> str:
+    suffix = FORMAT_SUFFIXES[image_format]
+    tmp_path = f"{derivative_cache.path_for(key, suffix)}.{uuid.uuid4().hex}.part.tmp"
+    os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+    try:
+        get_process_pool().submit(
+            make_derivative, image.path, tmp_path,
+            get_derivative_sizes().get(size), image_format, get_format_quality(image_format)
+        ).result()
+        return derivative_cache.put(key, tmp_path, suffix)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
@@ -0,0 +1,208 @@
+"""图片文件读取：路径缓存、条件请求与 Range 请求"""
+
+import mimetypes
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+
+from app.core.config import settings
+from app.core.database import get_db
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageFile:
+    """图片文件路径及其状态"""
+
+    __slots__ = ("path", "stat", "checked_at")
+
+    def __init__(self, path: str, stat: os.stat_result):
+        self.path = path
+        self.stat = stat
+        self.checked_at = time.monotonic()
+
+    @property
+    def etag(self) -> str:
+        """强 ETag：(inode, 大小, 修改时间) 任一变化即视为新文件"""
+        return f'"{self.stat.st_ino:x}-{self.stat.st_size:x}-{self.stat.st_mtime_ns:x}"'
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.stat.st_mtime, usegmt=True)
+
+
+class ImagePathCache:
+    """
+    image_id -> 文件路径与状态的 LRU 缓存
+
+    命中时不访问数据库；文件状态每 stat_ttl 秒复查一次，文件被替换或删除时重新查库。
+    """
+
+    def __init__(self, max_entries: int, stat_ttl: float):
+        self.max_entries = max_entries
+        self.stat_ttl = stat_ttl
+        self._entries: "OrderedDict[int, ImageFile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, image_id: int, file_path: Optional[str] = None) -> Optional[ImageFile]:
+        """
+        获取图片文件，图片或文件不存在返回 None
+
+        Args:
+            image_id: 图片 ID
+            file_path: 调用方已查出的文件路径，缓存未命中时直接使用，不再查库
+        """
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry:
+                self._entries.move_to_end(image_id)
+
+        if entry and time.monotonic() - entry.checked_at >= self.stat_ttl:
+            try:
+                entry = ImageFile(entry.path, os.stat(entry.path))
+            except OSError:
+                entry = None
+            self._put(image_id, entry)
+
+        if entry:
+            return entry
+
+        if file_path is None:
+            with get_db() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT file_path FROM images WHERE id = %s", (image_id,))
+                    image = cursor.fetchone()
+            if not image:
+                return None
+            file_path = image['file_path']
+
+        try:
+            entry = ImageFile(file_path, os.stat(file_path))
+        except OSError:
+            return None
+        self._put(image_id, entry)
+        return entry
+
+    def _put(self, image_id: int, entry: Optional[ImageFile]):
+        with self._lock:
+            if entry is None:
+                self._entries.pop(image_id, None)
+                return
+            self._entries[image_id] = entry
+            self._entries.move_to_end(image_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+image_paths = ImagePathCache(settings.IMAGE_PATH_CACHE_SIZE, settings.IMAGE_FILE_STAT_TTL_SECONDS)
+
+
+def _not_modified(request: Request, image: ImageFile) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or image.etag in tags or f"W/{image.etag}" in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(image.stat.st_mtime) <= since
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 请求头
+
+    Returns:
+        (起始, 结束) 闭区间；多段或格式不正确时返回 None（按完整文件响应）
+
+    Raises:
+        ValueError: 范围无法满足
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # 后缀范围：最后 N 个字节
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _iter_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def image_file_response(request: Request, image: ImageFile, vary: Optional[str] = None) -> Response:
+    """
+    返回图片文件，支持 If-None-Match / If-Modified-Since 与单段 Range 请求
+
+    图片文件导入后不会修改，默认使用 immutable 长期缓存；
+    IMAGE_FILE_CACHE_MAX_AGE 为 0 时改为每次重新验证。
+    同一 URL 按请求头返回不同内容时通过 vary 指定 Vary 响应头。
+    """
+    max_age = settings.IMAGE_FILE_CACHE_MAX_AGE
+    headers = {
+        "ETag": image.etag,
+        "Last-Modified": image.last_modified,
+        "Cache-Control": f"public, max-age={max_age}, immutable" if max_age > 0 else "public, no-cache",
+        "Accept-Ranges": "bytes",
+    }
+    if vary:
+        headers["Vary"] = vary
+
+    if _not_modified(request, image):
+        return Response(status_code=304, headers=headers)
+
+    size = image.stat.st_size
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() in (image.etag, image.last_modified)):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _iter_range(image.path, start, end),
+                status_code=206,
+                media_type=mimetypes.guess_type(image.path)[0] or "application/octet-stream",
+                headers=headers
+            )
+
+    return FileResponse(image.path, stat_result=image.stat, headers=headers)
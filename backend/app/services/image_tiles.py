@@ -0,0 +1,252 @@
+"""大图切片金字塔（Deep Zoom 风格）：整个金字塔在后台一次生成，未生成的切片按需单独生成，缓存到磁盘"""
+
+import hashlib
+import math
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import Future
+from typing import Dict, Optional, Union
+
+from app.core.config import settings
+from app.services.disk_cache import DiskCache
+from app.services.image_files import ImageFile
+from app.services.workers import get_process_pool
+
+tile_cache = DiskCache(settings.IMAGE_TILE_CACHE_DIR, settings.IMAGE_TILE_CACHE_MAX_BYTES)
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def pyramid_info(image: ImageFile) -> dict:
+    """
+    切片金字塔描述
+
+    第 max_level 层为原图，每向下一层宽高减半，第 0 层为 1x1。
+    第 level 层的切片 (col, row) 覆盖该层像素 [col*tile_size, (col+1)*tile_size)。
+    """
+    from PIL import Image as PILImage
+
+    # 只读取文件头
+    with PILImage.open(image.path) as img:
+        width, height = img.size
+
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    return {
+        "width": width,
+        "height": height,
+        "tile_size": settings.IMAGE_TILE_SIZE,
+        "max_level": max_level,
+        "format": "jpeg",
+    }
+
+
+def level_size(width: int, height: int, level: int, max_level: int) -> tuple:
+    """第 level 层的宽高"""
+    factor = 2 ** (max_level - level)
+    return max(math.ceil(width / factor), 1), max(math.ceil(height / factor), 1)
+
+
+def tile_box(width: int, height: int, level: int, max_level: int, col: int, row: int, tile_size: int) -> tuple:
+    """切片在第 level 层中的像素范围"""
+    out_w, out_h = level_size(width, height, level, max_level)
+    return (col * tile_size, row * tile_size,
+            min((col + 1) * tile_size, out_w), min((row + 1) * tile_size, out_h))
+
+
+def build_pyramid(src_path: str, dst_dirs: Dict[int, str], max_level: int, tile_size: int, quality: int):
+    """
+    生成金字塔中 dst_dirs 指定的各层（在工作进程中执行）
+
+    原图只解码一次：从原图层开始逐层缩小一半，每层由上一层缩小得到，
+    切片保存为 dst_dirs[level]/{col}_{row}.jpg。
+    """
+    from PIL import Image as PILImage
+
+    with PILImage.open(src_path) as src:
+        img = src.convert("RGB") if src.mode not in ("L", "RGB") else src.copy()
+    width, height = img.size
+
+    lowest = min(dst_dirs)
+    for level in range(max_level, lowest - 1, -1):
+        size = level_size(width, height, level, max_level)
+        if img.size != size:
+            img = img.resize(size, PILImage.Resampling.BILINEAR, reducing_gap=2.0)
+        if level not in dst_dirs:
+            continue
+
+        os.makedirs(dst_dirs[level], exist_ok=True)
+        out_w, out_h = size
+        for row in range(math.ceil(out_h / tile_size)):
+            for col in range(math.ceil(out_w / tile_size)):
+                box = tile_box(width, height, level, max_level, col, row, tile_size)
+                img.crop(box).save(os.path.join(dst_dirs[level], f"{col}_{row}.jpg"), format="JPEG", quality=quality)
+
+
+def render_tile(src_path: str, dst_path: str, level: int, max_level: int, col: int, row: int,
+                tile_size: int, quality: int):
+    """
+    只生成一个切片（在工作进程中执行）
+
+    JPEG 使用 draft 模式按该层尺寸直接以 1/2、1/4、1/8 解码，越低的层解码开销越小；
+    先裁剪出切片对应的区域再缩放，只编码这一个切片。
+    """
+    from PIL import Image as PILImage
+
+    with PILImage.open(src_path) as src:
+        width, height = src.size
+        out_w, out_h = level_size(width, height, level, max_level)
+        x0, y0, x1, y1 = tile_box(width, height, level, max_level, col, row, tile_size)
+        src.draft("RGB", (out_w, out_h))
+
+        # 切片在解码后图片中的范围（draft 之后尺寸可能已缩小）
+        scale_x, scale_y = src.size[0] / out_w, src.size[1] / out_h
+        region = (x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y)
+        crop = (math.floor(region[0]), math.floor(region[1]),
+                min(math.ceil(region[2]), src.size[0]), min(math.ceil(region[3]), src.size[1]))
+        tile = src.crop(crop)
+
+    if tile.mode not in ("L", "RGB"):
+        tile = tile.convert("RGB")
+    tile = tile.resize((x1 - x0, y1 - y0), PILImage.Resampling.BILINEAR,
+                       box=(region[0] - crop[0], region[1] - crop[1], region[2] - crop[0], region[3] - crop[1]))
+    tile.save(dst_path, format="JPEG", quality=quality)
+
+
+def _level_key(image: ImageFile, level: Union[int, str]) -> str:
+    payload = "|".join(str(part) for part in (
+        image.path, image.etag, level, settings.IMAGE_TILE_SIZE, settings.IMAGE_DERIVATIVE_QUALITY
+    ))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _tile_key(image: ImageFile, level: int, col: int, row: int) -> str:
+    return _level_key(image, f"{level}/{col}_{row}")
+
+
+def schedule_pyramid(image: ImageFile, info: dict) -> Optional[Future]:
+    """
+    在后台生成金字塔中尚未缓存的层（不等待）
+
+    打开大图时即调用，浏览器请求切片时通常已经生成完毕；同一进程内同一张图片只生成一次。
+
+    Returns:
+        生成任务；各层均已缓存时返回 None
+    """
+    key = _level_key(image, "pyramid")
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+
+    missing = {
+        level: _level_key(image, level) for level in range(info["max_level"] + 1)
+        if tile_cache.get(_level_key(image, level)) is None
+    }
+    if not missing:
+        return None
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = Future()
+        _inflight[key] = future
+
+    tmp_dirs = {
+        level: f"{tile_cache.path_for(level_key)}.{uuid.uuid4().hex}.part.tmp"
+        for level, level_key in missing.items()
+    }
+
+    def done(task):
+        try:
+            task.result()
+            for level, level_key in missing.items():
+                tile_cache.put(level_key, tmp_dirs[level])
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            for tmp_dir in tmp_dirs.values():
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            with _inflight_lock:
+                _inflight.pop(key, None)
+
+    get_process_pool().submit(
+        build_pyramid, image.path, tmp_dirs, info["max_level"],
+        settings.IMAGE_TILE_SIZE, settings.IMAGE_DERIVATIVE_QUALITY
+    ).add_done_callback(done)
+    return future
+
+
+def _render_once(image: ImageFile, info: dict, level: int, col: int, row: int) -> str:
+    """生成单个切片并缓存；同一进程内对同一切片的并发请求只生成一次"""
+    key = _tile_key(image, level, col, row)
+    path = tile_cache.get(key, ".jpg")
+    if path is not None:
+        return path
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[key] = future
+
+    if owner:
+        tmp_path = f"{tile_cache.path_for(key, '.jpg')}.{uuid.uuid4().hex}.part.tmp"
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+        try:
+            get_process_pool().submit(
+                render_tile, image.path, tmp_path, level, info["max_level"], col, row,
+                settings.IMAGE_TILE_SIZE, settings.IMAGE_DERIVATIVE_QUALITY
+            ).result()
+            future.set_result(tile_cache.put(key, tmp_path, ".jpg"))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with _inflight_lock:
+                _inflight.pop(key, None)
+
+    return future.result()
+
+
+def get_tile(image: ImageFile, info: dict, level: int, col: int, row: int) -> Optional[ImageFile]:
+    """
+    获取切片
+
+    所在层已由后台生成时直接返回；否则（尚未生成，或查找后被其他进程淘汰）确保后台生成已提交，
+    并只生成请求的这一个切片，不等待整层。
+
+    Returns:
+        切片文件；层号或行列号超出范围时返回 None
+    """
+    max_level = info["max_level"]
+    if not 0 <= level <= max_level:
+        return None
+    tile_size = info["tile_size"]
+    out_w, out_h = level_size(info["width"], info["height"], level, max_level)
+    if not (0 <= col < math.ceil(out_w / tile_size) and 0 <= row < math.ceil(out_h / tile_size)):
+        return None
+
+    level_dir = tile_cache.get(_level_key(image, level))
+    if level_dir is not None:
+        path = os.path.join(level_dir, f"{col}_{row}.jpg")
+        try:
+            return ImageFile(path, os.stat(path))
+        except FileNotFoundError:
+            pass
+
+    schedule_pyramid(image, info)
+    for _ in range(2):
+        path = _render_once(image, info, level, col, row)
+        try:
+            return ImageFile(path, os.stat(path))
+        except FileNotFoundError:
+            # 查找后被其他进程淘汰，重新生成
+            continue
+    return None
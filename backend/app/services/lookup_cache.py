@@ -0,0 +1,144 @@
+"""数据集、类别、数据集配置的进程内读穿缓存"""
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+
+DATASETS = "datasets"
+CATEGORIES = "categories"
+DATASET_CONFIGS = "dataset_configs"
+NAMESPACES = (DATASETS, CATEGORIES, DATASET_CONFIGS)
+
+# 数据集只缓存不随标注变化的列（total_images / labeled_images 等计数不缓存）
+DATASET_COLUMNS = "id, name, description, image_path, label_path, is_active, created_at"
+
+_MISSING = object()
+
+
+class LookupCache:
+    """
+    按命名空间划分的进程内缓存
+
+    每个命名空间在 cache_versions 表中有一个版本号。写入方在同一事务中递增版本号并清空本地缓存；
+    读取时最多每 LOOKUP_CACHE_CHECK_SECONDS 秒查询一次版本表（一次主键小表查询），
+    版本变化则清空对应命名空间，从而让其他 worker 的修改也能及时生效。
+    """
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self._entries: Dict[str, dict] = {name: {} for name in NAMESPACES}
+        self._versions: Dict[str, Optional[int]] = {name: None for name in NAMESPACES}
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.hits: Dict[str, int] = {name: 0 for name in NAMESPACES}
+        self.misses: Dict[str, int] = {name: 0 for name in NAMESPACES}
+
+    def get(self, cursor, namespace: str, key, loader):
+        """
+        读取缓存，未命中时调用 loader() 加载并写入
+
+        Args:
+            cursor: 当前请求的游标（用于版本检查）
+            namespace: 命名空间
+            key: 缓存键
+            loader: 无参数函数，返回要缓存的值（可以为 None）
+        """
+        self._check_versions(cursor)
+
+        entries = self._entries[namespace]
+        value = entries.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits[namespace] += 1
+            return value
+
+        self.misses[namespace] += 1
+        value = loader()
+        entries[key] = value
+        return value
+
+    def version(self, cursor, namespace: str) -> Optional[int]:
+        """
+        当前 worker 所见的命名空间版本号
+
+        与缓存内容使用同一次版本检查，用作 ETag 标记时不会出现新版本号对应旧缓存内容的情况。
+        """
+        self._check_versions(cursor)
+        return self._versions[namespace]
+
+    def invalidate(self, cursor, *namespaces: str):
+        """递增版本号并清空本地缓存（在写入所在的事务中调用）"""
+        cursor.execute(
+            f"UPDATE cache_versions SET version = version + 1 WHERE name IN ({','.join(['%s'] * len(namespaces))})",
+            namespaces
+        )
+        with self._lock:
+            for name in namespaces:
+                self._entries[name] = {}
+                self._versions[name] = None
+            # 事务提交前其他请求可能重新载入旧数据，下一次读取时重新检查版本
+            self._checked_at = 0.0
+
+    def stats(self) -> dict:
+        """命中率统计（当前 worker）"""
+        return {
+            name: {
+                "entries": len(self._entries[name]),
+                "hits": self.hits[name],
+                "misses": self.misses[name],
+                "hit_rate": round(self.hits[name] / (self.hits[name] + self.misses[name]), 4)
+                if self.hits[name] + self.misses[name] else None,
+            }
+            for name in NAMESPACES
+        }
+
+    def _check_versions(self, cursor):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+
+        cursor.execute("SELECT name, version FROM cache_versions")
+        versions = {row['name']: row['version'] for row in cursor.fetchall()}
+        with self._lock:
+            for name in NAMESPACES:
+                version = versions.get(name)
+                if version != self._versions[name]:
+                    self._entries[name] = {}
+                    self._versions[name] = version
+            self._checked_at = now
+
+
+lookup_cache = LookupCache(settings.LOOKUP_CACHE_CHECK_SECONDS)
+
+
+def get_dataset(cursor, dataset_id: int) -> Optional[dict]:
+    """获取数据集（不含图片计数列），不存在返回 None"""
+    def load():
+        cursor.execute(f"SELECT {DATASET_COLUMNS} FROM datasets WHERE id = %s", (dataset_id,))
+        return cursor.fetchone()
+
+    dataset = lookup_cache.get(cursor, DATASETS, dataset_id, load)
+    return dict(dataset) if dataset else None
+
+
+def get_categories(cursor, dataset_id: int) -> List[dict]:
+    """获取数据集的类别列表（按 sort_order 排序）"""
+    def load():
+        cursor.execute(
+            "SELECT * FROM categories WHERE dataset_id = %s ORDER BY sort_order",
+            (dataset_id,)
+        )
+        return cursor.fetchall()
+
+    return [dict(cat) for cat in lookup_cache.get(cursor, CATEGORIES, dataset_id, load)]
+
+
+def get_dataset_config(cursor, dataset_id: int) -> Optional[dict]:
+    """获取数据集配置，未配置返回 None"""
+    def load():
+        cursor.execute("SELECT * FROM dataset_configs WHERE dataset_id = %s", (dataset_id,))
+        return cursor.fetchone()
+
+    config = lookup_cache.get(cursor, DATASET_CONFIGS, dataset_id, load)
+    return dict(config) if config else None
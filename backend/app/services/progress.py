@@ -0,0 +1,153 @@
+"""
+数据集标注进度与进度推送
+
+图片状态变化时发布（publish），后台任务按 PROGRESS_PUSH_INTERVAL_SECONDS 合并：
+同一数据集在一个间隔内的多次变化只计算一次，结果推送给该数据集的所有订阅者（SSE / 标注会话）。
+其他 worker 中的变化不会发布到本进程，有订阅者的数据集每 PROGRESS_REFRESH_SECONDS 秒重新计算一次。
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, Optional, Set
+
+from app.core.config import settings
+from app.core.database import get_db
+
+
+def datasets_progress(cursor, dataset_ids: Iterable[int]) -> Dict[int, dict]:
+    """多个数据集的标注进度（一次分组统计）"""
+    dataset_ids = list(dataset_ids)
+    if not dataset_ids:
+        return {}
+
+    cursor.execute(
+        f"""SELECT dataset_id, status, COUNT(*) as count FROM images
+            WHERE dataset_id IN ({','.join(['%s'] * len(dataset_ids))})
+            GROUP BY dataset_id, status""",
+        dataset_ids
+    )
+    counts = {dataset_id: {} for dataset_id in dataset_ids}
+    for row in cursor.fetchall():
+        counts[row['dataset_id']][row['status']] = row['count']
+
+    result = {}
+    for dataset_id, by_status in counts.items():
+        total = sum(by_status.values())
+        labeled = by_status.get('labeled', 0)
+        skipped = by_status.get('skipped', 0)
+        # 进度计算：已标注 + 未见 = 已处理
+        processed = labeled + skipped
+        result[dataset_id] = {
+            "total": total,
+            "labeled": labeled,
+            "skipped": skipped,
+            "pending": by_status.get('pending', 0),
+            "progress": round(processed / total * 100, 2) if total > 0 else 0
+        }
+    return result
+
+
+def dataset_progress(cursor, dataset_id: int) -> dict:
+    """数据集标注进度"""
+    return datasets_progress(cursor, [dataset_id])[dataset_id]
+
+
+class ProgressBus:
+    """
+    按数据集发布 / 订阅进度
+
+    订阅者是事件循环中的 asyncio.Queue（容量 1，只保留最新进度）；
+    publish 可以在任意线程调用，flush 在线程池中执行，结果切回事件循环投递。
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._latest: Dict[int, dict] = {}
+        self._refreshed_at: Dict[int, float] = {}
+        self._dirty: Set[int] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        self.computations = 0
+
+    def publish(self, dataset_id: int):
+        """标记数据集进度已变化（下一次 flush 时重新计算）"""
+        with self._lock:
+            self._dirty.add(dataset_id)
+
+    def subscribe(self, dataset_id: int, initial: Optional[dict] = None) -> asyncio.Queue:
+        """
+        订阅数据集进度（在事件循环中调用）
+
+        Args:
+            dataset_id: 数据集 ID
+            initial: 订阅方已取得的进度，之后只推送与之不同的进度
+        """
+        queue = asyncio.Queue(maxsize=1)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.setdefault(dataset_id, set()).add(queue)
+            if initial is not None and dataset_id not in self._latest:
+                self._latest[dataset_id] = initial
+                self._refreshed_at[dataset_id] = time.monotonic()
+        return queue
+
+    def unsubscribe(self, dataset_id: int, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(dataset_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[dataset_id]
+                self._latest.pop(dataset_id, None)
+                self._refreshed_at.pop(dataset_id, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def flush(self):
+        """计算有订阅者且已变化（或到了定期刷新时间）的数据集进度并推送（后台任务调用）"""
+        now = time.monotonic()
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            due = [
+                dataset_id for dataset_id in self._subscribers
+                if dataset_id in dirty or now - self._refreshed_at.get(dataset_id, 0) >= self.refresh_seconds
+            ]
+            loop = self._loop
+        if not due:
+            return
+
+        with get_db() as conn:
+            with conn.cursor() as cursor:
+                results = datasets_progress(cursor, due)
+
+        changed = {}
+        with self._lock:
+            self.computations += 1
+            for dataset_id, progress in results.items():
+                if dataset_id not in self._subscribers:
+                    continue
+                self._refreshed_at[dataset_id] = now
+                if self._latest.get(dataset_id) != progress:
+                    self._latest[dataset_id] = progress
+                    changed[dataset_id] = progress
+
+        if changed and loop is not None:
+            loop.call_soon_threadsafe(self._deliver, changed)
+
+    def _deliver(self, changed: Dict[int, dict]):
+        with self._lock:
+            targets = [(queue, changed[dataset_id]) for dataset_id in changed
+                       for queue in self._subscribers.get(dataset_id, ())]
+        for queue, progress in targets:
+            # 订阅者还没取走上一次的进度时直接替换为最新值
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(progress)
+
+
+progress_bus = ProgressBus(settings.PROGRESS_REFRESH_SECONDS)
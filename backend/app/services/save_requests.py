@@ -0,0 +1,69 @@
+"""批量保存的幂等键：记录已应用的保存，重复提交时返回上次的结果"""
+
+from typing import Dict, Iterable, List, Tuple
+
+import pymysql
+
+from app.core.config import settings
+from app.core.database import get_db
+
+# MySQL 唯一键冲突
+ER_DUP_ENTRY = 1062
+
+
+class DuplicateSaveRequest(Exception):
+    """相同幂等键的保存已由并发的请求应用"""
+
+
+def find_applied(cursor, user_id: int, keys: Iterable[str]) -> Dict[str, dict]:
+    """
+    查询已应用的幂等键
+
+    Returns:
+        幂等键 -> {"image_id", "status"}
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    cursor.execute(
+        f"""SELECT idempotency_key, image_id, status FROM save_requests
+            WHERE user_id = %s AND idempotency_key IN ({','.join(['%s'] * len(keys))})""",
+        [user_id, *keys]
+    )
+    return {row['idempotency_key']: row for row in cursor.fetchall()}
+
+
+def record_applied(cursor, user_id: int, rows: List[Tuple[str, int, str]]):
+    """
+    记录本次应用的幂等键（与保存在同一事务中）
+
+    同一幂等键被并发提交时，后到的事务在主键上等待，先到的事务提交后插入失败，
+    调用方回滚后客户端重试即可得到上次的结果。
+
+    Args:
+        rows: [(幂等键, 图片 ID, 保存后的状态)]
+
+    Raises:
+        DuplicateSaveRequest: 幂等键已被并发的请求写入（只有主键冲突，其他完整性错误照常抛出）
+    """
+    if not rows:
+        return
+    try:
+        cursor.executemany(
+            "INSERT INTO save_requests (user_id, idempotency_key, image_id, status) VALUES (%s, %s, %s, %s)",
+            [(user_id, key, image_id, status) for key, image_id, status in rows]
+        )
+    except pymysql.err.IntegrityError as e:
+        if e.args and e.args[0] == ER_DUP_ENTRY:
+            raise DuplicateSaveRequest() from e
+        raise
+
+
+def purge_save_requests():
+    """删除超过 SAVE_IDEMPOTENCY_TTL_HOURS 的幂等键（后台任务调用）"""
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM save_requests WHERE created_at < NOW() - INTERVAL %s HOUR",
+                (settings.SAVE_IDEMPOTENCY_TTL_HOURS,)
+            )
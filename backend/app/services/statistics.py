@@ -0,0 +1,283 @@
+"""统计汇总表的增量维护、按数据集校准与用户计数维护"""
+
+import logging
+import threading
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.core.database import get_db, named_lock
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_LOCK_NAME = "torch_markup_stats_reconcile"
+
+# 汇总表：(表名, 数据集内的键列, 计数列, 从明细表汇总一个数据集的语句)
+# 汇总表由各写入路径在同一事务中按增量维护，明细表汇总只用于按数据集校准
+ROLLUPS = [
+    ("stats_dataset_status", ("status",), ("image_count",), """
+        SELECT status, COUNT(*) as image_count FROM images WHERE dataset_id = %s GROUP BY status
+    """),
+    ("stats_dataset_category", ("category_id",), ("annotation_count",), """
+        SELECT a.category_id, COUNT(*) as annotation_count
+        FROM annotations a JOIN categories c ON a.category_id = c.id
+        WHERE c.dataset_id = %s GROUP BY a.category_id
+    """),
+    ("stats_daily", ("date",), ("images_labeled", "annotations_created", "time_spent"), """
+        SELECT date, SUM(images_labeled) as images_labeled, SUM(annotations_created) as annotations_created,
+               SUM(time_spent) as time_spent
+        FROM work_statistics WHERE dataset_id = %s GROUP BY date
+    """),
+    ("stats_user_totals", ("user_id",), ("images_labeled", "annotations_created", "time_spent"), """
+        SELECT user_id, SUM(images_labeled) as images_labeled, SUM(annotations_created) as annotations_created,
+               SUM(time_spent) as time_spent
+        FROM work_statistics WHERE dataset_id = %s GROUP BY user_id
+    """),
+]
+
+
+def _add_sql(table: str, keys: tuple, values: tuple) -> str:
+    # 累加增量：行不存在时以增量为初值
+    columns = ("dataset_id", *keys, *values)
+    updates = ", ".join(f"{column} = {column} + VALUES({column})" for column in values)
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+def _apply(cursor, table: str, keys: tuple, values: tuple, deltas: Dict[tuple, list]):
+    # 按主键排序写入，并发事务以相同顺序加锁，避免死锁
+    rows = [(*key, *delta) for key, delta in sorted(deltas.items()) if any(delta)]
+    if rows:
+        cursor.executemany(_add_sql(table, keys, values), rows)
+
+
+def adjust_dataset_status(cursor, deltas: Dict[Tuple[int, str], int]):
+    """
+    在调用方的事务中增减各数据集各状态的图片数
+
+    Args:
+        deltas: (数据集 ID, 状态) -> 图片数增量
+    """
+    _apply(cursor, "stats_dataset_status", ("status",), ("image_count",),
+           {key: [delta] for key, delta in deltas.items()})
+
+
+def adjust_dataset_category(cursor, deltas: Dict[Tuple[int, int], int]):
+    """
+    在调用方的事务中增减各数据集各类别的标注框数
+
+    Args:
+        deltas: (数据集 ID, 类别 ID) -> 标注框数增量
+    """
+    _apply(cursor, "stats_dataset_category", ("category_id",), ("annotation_count",),
+           {key: [delta] for key, delta in deltas.items()})
+
+
+def adjust_work_totals(cursor, deltas: Dict[Tuple[int, int, date], list]):
+    """
+    按工作量增量维护每日汇总与用户累计汇总（与 work_statistics 在同一事务中写入）
+
+    Args:
+        deltas: (用户 ID, 数据集 ID, 日期) -> [images_labeled, annotations_created, time_spent]
+    """
+    daily: Dict[tuple, list] = {}
+    user_totals: Dict[tuple, list] = {}
+    for (user_id, dataset_id, day), delta in deltas.items():
+        for target, key in ((daily, (dataset_id, day)), (user_totals, (dataset_id, user_id))):
+            current = target.setdefault(key, [0, 0, 0])
+            for i, value in enumerate(delta):
+                current[i] += value
+
+    values = ("images_labeled", "annotations_created", "time_spent")
+    _apply(cursor, "stats_daily", ("date",), values, daily)
+    _apply(cursor, "stats_user_totals", ("user_id",), values, user_totals)
+
+
+def remove_dataset_statistics(cursor, dataset_id: int):
+    """删除数据集时在同一事务中删除其汇总行（明细随数据集级联删除）"""
+    for table, _, _, _ in ROLLUPS:
+        cursor.execute(f"DELETE FROM {table} WHERE dataset_id = %s", (dataset_id,))
+
+
+def remove_category_statistics(cursor, category_id: int):
+    """删除类别时在同一事务中删除其汇总行（标注随类别级联删除）"""
+    cursor.execute("DELETE FROM stats_dataset_category WHERE category_id = %s", (category_id,))
+
+
+def remove_user_statistics(cursor, user_id: int):
+    """删除用户时在同一事务中从汇总表减去其工作量（work_statistics 随用户级联删除）"""
+    cursor.execute(
+        """UPDATE stats_daily d
+           JOIN work_statistics w ON w.date = d.date AND w.dataset_id = d.dataset_id
+           SET d.images_labeled = d.images_labeled - w.images_labeled,
+               d.annotations_created = d.annotations_created - w.annotations_created,
+               d.time_spent = d.time_spent - w.time_spent
+           WHERE w.user_id = %s""",
+        (user_id,)
+    )
+    cursor.execute("DELETE FROM stats_user_totals WHERE user_id = %s", (user_id,))
+
+
+# 自上次校准以来计数有变化的用户（本进程内）
+_touched_users = set()
+_touched_lock = threading.Lock()
+
+
+def adjust_images_labeled(cursor, user_id: int, delta: int):
+    """增减用户已标注图片计数（不改变 users.updated_at）"""
+    cursor.execute(
+        """UPDATE users SET images_labeled = GREATEST(images_labeled + %s, 0), updated_at = updated_at
+           WHERE id = %s""",
+        (delta, user_id)
+    )
+    with _touched_lock:
+        _touched_users.add(user_id)
+
+
+def release_dataset_labels(cursor, dataset_id: int):
+    """
+    删除数据集前调用：从用户计数中减去该数据集中各用户标注的图片
+
+    图片随数据集级联删除，不经过保存接口，在同一事务中按增量调整计数。
+    """
+    cursor.execute(
+        """SELECT labeled_by, COUNT(*) as count FROM images
+           WHERE dataset_id = %s AND labeled_by IS NOT NULL GROUP BY labeled_by""",
+        (dataset_id,)
+    )
+    for row in cursor.fetchall():
+        adjust_images_labeled(cursor, row['labeled_by'], -row['count'])
+
+
+def reconcile_user_counters(user_ids: Optional[Iterable[int]] = None):
+    """
+    按 images.labeled_by 重新校准用户已标注图片计数
+
+    日常由 adjust_images_labeled 按增量维护，这里只低频校准自上次校准以来计数有变化的用户
+    （每个用户走 idx_labeled_by 索引计数，不扫描整个 images 表），纠正并发等原因造成的偏差。
+
+    Args:
+        user_ids: 要校准的用户，默认取本进程内自上次校准以来计数有变化的用户
+    """
+    if user_ids is None:
+        with _touched_lock:
+            user_ids = list(_touched_users)
+            _touched_users.clear()
+    else:
+        user_ids = list(user_ids)
+    if not user_ids:
+        return
+
+    try:
+        with get_db() as conn:
+            with conn.cursor() as cursor:
+                for user_id in user_ids:
+                    cursor.execute(
+                        """UPDATE users SET images_labeled = (
+                               SELECT COUNT(*) FROM images WHERE labeled_by = %s
+                           ), updated_at = updated_at
+                           WHERE id = %s""",
+                        (user_id, user_id)
+                    )
+    except Exception:
+        # 下次再校准这些用户
+        with _touched_lock:
+            _touched_users.update(user_ids)
+        raise
+
+    logger.debug("已校准 %d 个用户的已标注图片计数", len(user_ids))
+
+
+def compact_statistics():
+    """
+    更新全局计数（用户数、启用的数据集数）
+
+    各数据集的汇总表由写入路径按增量维护，这里只执行两个小表的计数，不扫描明细表。
+    """
+    with get_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) as count FROM users")
+            total_users = cursor.fetchone()['count']
+            cursor.execute("SELECT COUNT(*) as count FROM datasets WHERE is_active = TRUE")
+            total_datasets = cursor.fetchone()['count']
+
+            cursor.executemany(
+                """INSERT INTO stats_global (name, value) VALUES (%s, %s)
+                   ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = CURRENT_TIMESTAMP""",
+                [("total_users", total_users), ("total_datasets", total_datasets)]
+            )
+
+    logger.debug("统计汇总完成")
+
+
+def reconcile_dataset(conn, dataset_id: int):
+    """
+    从明细表重新汇总一个数据集，纠正汇总表的偏差
+
+    在一致性快照中同时读取汇总行与明细（普通 SELECT，不加锁，不阻塞保存），
+    把两者之差作为增量写回：快照之后提交的增量已在汇总行中，不会被覆盖。
+    """
+    corrections = []
+    with conn.cursor() as cursor:
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+        for table, keys, values, sql in ROLLUPS:
+            cursor.execute(
+                f"SELECT {', '.join((*keys, *values))} FROM {table} WHERE dataset_id = %s",
+                (dataset_id,)
+            )
+            deltas = {}
+            for row in cursor.fetchall():
+                deltas[(dataset_id, *(row[k] for k in keys))] = [-int(row[v]) for v in values]
+            cursor.execute(sql, (dataset_id,))
+            for row in cursor.fetchall():
+                current = deltas.setdefault((dataset_id, *(row[k] for k in keys)), [0] * len(values))
+                for i, v in enumerate(values):
+                    current[i] += int(row[v] or 0)
+            corrections.append((table, keys, values, deltas))
+    conn.commit()
+
+    # 写回差值（短事务），之后删除计数全为 0 的行
+    with conn.cursor() as cursor:
+        for table, keys, values, deltas in corrections:
+            _apply(cursor, table, keys, values, deltas)
+            cursor.execute(
+                f"DELETE FROM {table} WHERE dataset_id = %s AND {' AND '.join(f'{v} = 0' for v in values)}",
+                (dataset_id,)
+            )
+    conn.commit()
+
+
+def reconcile_statistics():
+    """
+    按数据集轮流校准汇总表（低频后台任务，每次一个数据集）
+
+    校准进度保存在 stats_global 的 reconcile_dataset_id 中，多个 worker 通过 MySQL 命名锁互斥。
+    """
+    with get_db() as conn:
+        with named_lock(conn, RECONCILE_LOCK_NAME) as acquired:
+            if not acquired:
+                return
+
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT value FROM stats_global WHERE name = 'reconcile_dataset_id'")
+                row = cursor.fetchone()
+                last_id = row['value'] if row else 0
+                cursor.execute("SELECT MIN(id) as id FROM datasets WHERE id > %s", (last_id,))
+                dataset_id = cursor.fetchone()['id']
+                if dataset_id is None:
+                    cursor.execute("SELECT MIN(id) as id FROM datasets")
+                    dataset_id = cursor.fetchone()['id']
+            conn.commit()
+            if dataset_id is None:
+                return
+
+            reconcile_dataset(conn, dataset_id)
+
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    """INSERT INTO stats_global (name, value) VALUES ('reconcile_dataset_id', %s)
+                       ON DUPLICATE KEY UPDATE value = VALUES(value)""",
+                    (dataset_id,)
+                )
+            conn.commit()
+
+    logger.debug("已校准数据集 %s 的统计汇总", dataset_id)
@@ -0,0 +1,82 @@
+"""WebDataset 风格的 tar 分片写入器"""
+
+import io
+import json
+import os
+import tarfile
+from typing import Dict, List, Union
+
+
+class TarShardWriter:
+    """
+    按大小滚动的顺序 tar 分片写入器
+
+    同一样本的所有成员（如 000123.jpg / 000123.txt）连续写入同一个分片，
+    分片达到 max_bytes 后切换到下一个分片。
+    每个分片旁写一个索引 <分片名>.index.jsonl（每行一个样本的键和偏移），随样本写入追加，
+    不在内存中保留样本列表。
+    """
+
+    def __init__(self, directory: str, prefix: str, max_bytes: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.shards: List[dict] = []
+        self._tar = None
+        self._index = None
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, key: str, members: Dict[str, Union[str, bytes]]):
+        """
+        写入一个样本
+
+        Args:
+            key: 样本键（不含扩展名，不能包含 "."）
+            members: 扩展名 -> 文件路径或内容字节
+        """
+        sizes = {
+            ext: os.path.getsize(data) if isinstance(data, str) else len(data)
+            for ext, data in members.items()
+        }
+        # 每个成员额外占用 512 字节头部，并按 512 字节对齐
+        sample_bytes = sum(512 + (size + 511) // 512 * 512 for size in sizes.values())
+
+        if self._tar is None or (self.shards[-1]["samples"] > 0
+                                 and self._tar.offset + sample_bytes > self.max_bytes):
+            self._next_shard()
+
+        shard = self.shards[-1]
+        self._index.write(json.dumps({"key": key, "offset": self._tar.offset}, ensure_ascii=False) + "\n")
+
+        for ext, data in members.items():
+            info = tarfile.TarInfo(f"{key}.{ext}")
+            info.size = sizes[ext]
+            info.mode = 0o644
+            if isinstance(data, str):
+                with open(data, "rb") as f:
+                    self._tar.addfile(info, f)
+            else:
+                self._tar.addfile(info, io.BytesIO(data))
+
+        shard["samples"] += 1
+
+    def close(self):
+        """关闭当前分片"""
+        self._close_shard()
+
+    def _close_shard(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        self._index.close()
+        self._tar = None
+        self._index = None
+        shard = self.shards[-1]
+        shard["size"] = os.path.getsize(os.path.join(self.directory, shard["name"]))
+
+    def _next_shard(self):
+        self._close_shard()
+        name = f"{self.prefix}-{len(self.shards):06d}.tar"
+        self._tar = tarfile.open(os.path.join(self.directory, name), "w", format=tarfile.USTAR_FORMAT)
+        self._index = open(os.path.join(self.directory, f"{name}.index.jsonl"), "w", encoding="utf-8")
+        self.shards.append({"name": name, "index": f"{name}.index.jsonl", "samples": 0, "size": 0})
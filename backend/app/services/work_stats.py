@@ -0,0 +1,111 @@
+"""工作量统计与停留时间直方图的写后聚合"""
+
+import logging
+import threading
+from datetime import date
+from typing import Dict, Tuple
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.services.dwell import dwell_bucket
+from app.services.statistics import adjust_work_totals
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SQL = """
+    INSERT INTO work_statistics (user_id, dataset_id, date, images_labeled, annotations_created, time_spent)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        images_labeled = images_labeled + VALUES(images_labeled),
+        annotations_created = annotations_created + VALUES(annotations_created),
+        time_spent = time_spent + VALUES(time_spent)
+"""
+
+FLUSH_HISTOGRAM_SQL = """
+    INSERT INTO stats_dwell_histogram (user_id, dataset_id, metric, bucket, samples, total_seconds)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        samples = samples + VALUES(samples),
+        total_seconds = total_seconds + VALUES(total_seconds)
+"""
+
+
+class WorkStatsAggregator:
+    """
+    在进程内累加 (用户, 数据集, 日期) 的工作量增量与停留时间直方图增量，
+    批量写入 work_statistics / stats_dwell_histogram
+
+    写入使用 INSERT ... ON DUPLICATE KEY UPDATE 累加，多个 worker 各自聚合、各自写入，
+    结果与逐条写入一致。按间隔、待写入条目数（在后台线程中写入）或进程退出时写入；
+    写入失败的增量会合并回缓冲区，下次重试。
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._pending: Dict[Tuple[int, int, date], list] = {}
+        self._histogram: Dict[Tuple[int, int, str, int], list] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_scheduled = False
+
+    def add(self, user_id: int, dataset_id: int, day: date,
+            images_labeled: int = 0, annotations_created: int = 0, time_spent: int = 0):
+        """累加一次工作量"""
+        with self._lock:
+            _accumulate(self._pending, (user_id, dataset_id, day), [images_labeled, annotations_created, time_spent])
+            full = len(self._pending) >= self.max_pending and not self._flush_scheduled
+            if full:
+                self._flush_scheduled = True
+
+        if full:
+            # 在后台线程写入，不占用请求的时间
+            threading.Thread(target=self.flush, name="work-stats-flush", daemon=True).start()
+
+    def add_dwell(self, user_id: int, dataset_id: int, seconds: int, boxes: int):
+        """
+        记录一张图片的停留时间
+
+        每张图片计入 image 直方图一个样本；有标注框时按每框耗时计入 box 直方图，样本数为框数。
+        """
+        with self._lock:
+            _accumulate(self._histogram, (user_id, dataset_id, "image", dwell_bucket(seconds)), [1, seconds])
+            if boxes:
+                _accumulate(self._histogram, (user_id, dataset_id, "box", dwell_bucket(seconds / boxes)),
+                            [boxes, seconds])
+
+    def flush(self):
+        """写入所有待写入的增量"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                histogram, self._histogram = self._histogram, {}
+                self._flush_scheduled = False
+            if not pending and not histogram:
+                return
+
+            try:
+                with get_db() as conn:
+                    with conn.cursor() as cursor:
+                        if pending:
+                            cursor.executemany(FLUSH_SQL, [(*key, *delta) for key, delta in pending.items()])
+                            # 每日汇总与用户累计汇总在同一事务中按相同增量更新
+                            adjust_work_totals(cursor, pending)
+                        if histogram:
+                            cursor.executemany(FLUSH_HISTOGRAM_SQL,
+                                               [(*key, *delta) for key, delta in histogram.items()])
+            except Exception:
+                logger.exception("工作量统计写入失败，%d 条增量将在下次重试", len(pending) + len(histogram))
+                with self._lock:
+                    for key, delta in pending.items():
+                        _accumulate(self._pending, key, delta)
+                    for key, delta in histogram.items():
+                        _accumulate(self._histogram, key, delta)
+
+
+def _accumulate(target: dict, key: tuple, delta: list):
+    current = target.setdefault(key, [0] * len(delta))
+    for i, value in enumerate(delta):
+        current[i] += value
+
+
+work_stats = WorkStatsAggregator(settings.WORK_STATS_MAX_PENDING)
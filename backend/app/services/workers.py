@@ -0,0 +1,39 @@
+"""共享进程池，用于图片处理、打包压缩等 CPU 密集任务"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.core.config import settings
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_pool_size() -> int:
+    """进程池的工作进程数"""
+    return settings.WORKER_PROCESSES or os.cpu_count() or 1
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """获取共享进程池（首次调用时创建）"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            # 使用 spawn 避免在多线程的服务进程中 fork
+            _pool = ProcessPoolExecutor(
+                max_workers=get_pool_size(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown_process_pool():
+    """关闭共享进程池"""
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,99 @@
+"""分卷 ZIP64 打包：各卷独立压缩，带校验和与清单"""
+
+import hashlib
+import json
+import os
+import zipfile
+from typing import List, Tuple
+
+from app.services.workers import get_process_pool
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def plan_volumes(files: List[Tuple[str, str]], max_bytes: int) -> List[List[Tuple[str, str]]]:
+    """
+    按文件大小顺序切分分卷
+
+    Args:
+        files: [(文件路径, 压缩包内路径), ...]
+        max_bytes: 单卷大小上限（超过上限的单个文件独占一卷）
+    """
+    volumes = []
+    current = []
+    current_size = 0
+    for file_path, arcname in files:
+        size = os.path.getsize(file_path)
+        if current and current_size + size > max_bytes:
+            volumes.append(current)
+            current = []
+            current_size = 0
+        current.append((file_path, arcname))
+        current_size += size
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+def write_volume(zip_path: str, files: List[Tuple[str, str]], compression: int) -> dict:
+    """写出一个分卷并计算 SHA-256（在工作进程中执行）"""
+    with zipfile.ZipFile(zip_path, "w", compression, allowZip64=True) as zipf:
+        for file_path, arcname in files:
+            zipf.write(file_path, arcname)
+
+    sha256 = hashlib.sha256()
+    with open(zip_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+
+    return {
+        "filename": os.path.basename(zip_path),
+        "size": os.path.getsize(zip_path),
+        "sha256": sha256.hexdigest(),
+        "files": len(files)
+    }
+
+
+def write_volumes(source_dir: str, base_dir: str, dest_dir: str, name: str,
+                  volume_bytes: int, compression: int = zipfile.ZIP_DEFLATED) -> str:
+    """
+    将 source_dir 打包为多个独立的 ZIP64 分卷，分卷在进程池中并行压缩
+
+    每个分卷都是完整的 ZIP 文件，可以单独下载、校验和解压。
+
+    Args:
+        source_dir: 待打包目录
+        base_dir: 压缩包内路径的相对根目录
+        dest_dir: 分卷输出目录
+        name: 分卷文件名前缀
+        volume_bytes: 单卷大小上限（按原始文件大小计算）
+
+    Returns:
+        清单文件路径
+    """
+    files = []
+    for root, dirs, filenames in os.walk(source_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(root, filename)
+            files.append((file_path, os.path.relpath(file_path, base_dir)))
+
+    planned = plan_volumes(files, volume_bytes)
+    pool = get_process_pool()
+    futures = [
+        pool.submit(write_volume, os.path.join(dest_dir, f"{name}.part{idx + 1:03d}.zip"), volume, compression)
+        for idx, volume in enumerate(planned)
+    ]
+    volumes = [{"index": idx + 1, **future.result()} for idx, future in enumerate(futures)]
+
+    manifest = {
+        "name": name,
+        "volume_count": len(volumes),
+        "total_size": sum(volume["size"] for volume in volumes),
+        "volumes": volumes
+    }
+    manifest_path = os.path.join(dest_dir, f"{name}{MANIFEST_SUFFIX}")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    return manifest_path
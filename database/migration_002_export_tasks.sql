@@ -0,0 +1,18 @@
+-- Migration 002: 创建导出任务表
+-- 导出任务状态持久化，供多个 worker 共享，并支持过期清理
+
+CREATE TABLE IF NOT EXISTS export_tasks (
+    task_id VARCHAR(64) PRIMARY KEY,
+    dataset_id INT NOT NULL,
+    format VARCHAR(20) NOT NULL,
+    filename VARCHAR(255) NOT NULL COMMENT '下载文件名',
+    zip_path VARCHAR(1000) NOT NULL COMMENT '产物路径',
+    export_dir VARCHAR(1000) COMMENT '导出临时目录，为空表示产物归导出缓存所有',
+    file_size BIGINT DEFAULT 0,
+    created_by INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL COMMENT '过期时间',
+    downloaded_at TIMESTAMP NULL,
+    FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL,
+    INDEX idx_expires (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
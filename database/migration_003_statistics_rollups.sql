@@ -0,0 +1,73 @@
+-- Migration 003: 创建统计汇总表
+-- 管理后台统计直接读取汇总表；汇总表由各写入路径按增量维护，后台任务按数据集轮流从明细表校准
+-- 建表后从明细表回填现有数据（可重复执行）
+
+-- 各数据集各状态的图片数
+CREATE TABLE IF NOT EXISTS stats_dataset_status (
+    dataset_id INT NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    image_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dataset_id, status)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 各数据集各类别的标注框数
+CREATE TABLE IF NOT EXISTS stats_dataset_category (
+    dataset_id INT NOT NULL,
+    category_id INT NOT NULL,
+    annotation_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (dataset_id, category_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 每日工作量（按数据集汇总所有用户）
+CREATE TABLE IF NOT EXISTS stats_daily (
+    date DATE NOT NULL,
+    dataset_id INT NOT NULL,
+    images_labeled INT NOT NULL DEFAULT 0,
+    annotations_created INT NOT NULL DEFAULT 0,
+    time_spent INT NOT NULL DEFAULT 0 COMMENT '花费时间(秒)',
+    PRIMARY KEY (date, dataset_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 用户累计工作量（按数据集汇总所有日期）
+CREATE TABLE IF NOT EXISTS stats_user_totals (
+    user_id INT NOT NULL,
+    dataset_id INT NOT NULL,
+    images_labeled INT NOT NULL DEFAULT 0,
+    annotations_created INT NOT NULL DEFAULT 0,
+    time_spent INT NOT NULL DEFAULT 0 COMMENT '花费时间(秒)',
+    PRIMARY KEY (user_id, dataset_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 全局计数（用户数、启用的数据集数、最近汇总时间等）
+CREATE TABLE IF NOT EXISTS stats_global (
+    name VARCHAR(50) PRIMARY KEY,
+    value BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 回填现有数据
+INSERT INTO stats_dataset_status (dataset_id, status, image_count)
+SELECT dataset_id, status, COUNT(*) FROM images GROUP BY dataset_id, status
+ON DUPLICATE KEY UPDATE image_count = VALUES(image_count);
+
+INSERT INTO stats_dataset_category (dataset_id, category_id, annotation_count)
+SELECT c.dataset_id, a.category_id, COUNT(*)
+FROM annotations a JOIN categories c ON a.category_id = c.id
+GROUP BY c.dataset_id, a.category_id
+ON DUPLICATE KEY UPDATE annotation_count = VALUES(annotation_count);
+
+INSERT INTO stats_daily (date, dataset_id, images_labeled, annotations_created, time_spent)
+SELECT date, dataset_id, SUM(images_labeled), SUM(annotations_created), SUM(time_spent)
+FROM work_statistics GROUP BY date, dataset_id
+ON DUPLICATE KEY UPDATE
+    images_labeled = VALUES(images_labeled),
+    annotations_created = VALUES(annotations_created),
+    time_spent = VALUES(time_spent);
+
+INSERT INTO stats_user_totals (user_id, dataset_id, images_labeled, annotations_created, time_spent)
+SELECT user_id, dataset_id, SUM(images_labeled), SUM(annotations_created), SUM(time_spent)
+FROM work_statistics GROUP BY user_id, dataset_id
+ON DUPLICATE KEY UPDATE
+    images_labeled = VALUES(images_labeled),
+    annotations_created = VALUES(annotations_created),
+    time_spent = VALUES(time_spent);
@@ -0,0 +1,17 @@
+-- Migration 004: 用户已标注图片计数
+-- 用户列表直接读取计数列，不再按 labeled_by 关联整个 images 表
+
+ALTER TABLE users
+    ADD COLUMN images_labeled INT NOT NULL DEFAULT 0 COMMENT '已标注（含跳过）图片数',
+    ADD INDEX idx_images_labeled (images_labeled, id),
+    ADD INDEX idx_created_at (created_at, id);
+
+ALTER TABLE images
+    ADD INDEX idx_labeled_by (labeled_by, labeled_at);
+
+-- 回填现有计数
+UPDATE users u
+LEFT JOIN (
+    SELECT labeled_by, COUNT(*) as count FROM images WHERE labeled_by IS NOT NULL GROUP BY labeled_by
+) t ON t.labeled_by = u.id
+SET u.images_labeled = COALESCE(t.count, 0), u.updated_at = u.updated_at;
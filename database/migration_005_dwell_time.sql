@@ -0,0 +1,20 @@
+-- Migration 005: 标注停留时间
+-- 图片上记录本次标注累计的停留时间与最近一次心跳，保存时计入工作量统计
+
+ALTER TABLE images
+    ADD COLUMN dwell_seconds INT NOT NULL DEFAULT 0 COMMENT '本次标注累计停留时间(秒)',
+    ADD COLUMN last_heartbeat_at TIMESTAMP NULL COMMENT '最近一次停留心跳';
+
+-- 停留时间直方图，用于计算吞吐量分位数
+-- metric = image: 每张图片一个样本，值为停留秒数
+-- metric = box:   每个标注框一个样本，值为图片停留秒数 / 标注框数
+CREATE TABLE IF NOT EXISTS stats_dwell_histogram (
+    user_id INT NOT NULL,
+    dataset_id INT NOT NULL,
+    metric ENUM('image', 'box') NOT NULL,
+    bucket TINYINT NOT NULL COMMENT '桶序号，见 services/dwell.py',
+    samples INT NOT NULL DEFAULT 0,
+    total_seconds DOUBLE NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, dataset_id, metric, bucket),
+    INDEX idx_dataset (dataset_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,13 @@
+-- Migration 006: 缓存版本表
+-- 进程内查询缓存按命名空间记录版本号，写入时递增，其他 worker 发现版本变化后清空本地缓存
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+INSERT INTO cache_versions (name, version) VALUES
+    ('datasets', 0),
+    ('categories', 0),
+    ('dataset_configs', 0)
+ON DUPLICATE KEY UPDATE name = name;
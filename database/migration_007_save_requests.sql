@@ -0,0 +1,12 @@
+-- Migration 007: 批量保存的幂等键
+-- 客户端离线排队的保存请求可能重复提交，按 (用户, 幂等键) 记录已应用的保存及其结果，重复提交时直接返回
+
+CREATE TABLE IF NOT EXISTS save_requests (
+    user_id INT NOT NULL,
+    idempotency_key VARCHAR(64) NOT NULL,
+    image_id INT NOT NULL,
+    status VARCHAR(20) NOT NULL COMMENT '保存后的图片状态',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    INDEX idx_created (created_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
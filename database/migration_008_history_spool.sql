@@ -0,0 +1,9 @@
+-- Migration 008: 已写入的标注历史 spool 文件
+-- spool 文件的历史与文件名在同一事务中写入，进程在写入后、删除文件前退出时，重新读回不会重复写入
+
+CREATE TABLE IF NOT EXISTS history_spool_applied (
+    name VARCHAR(255) PRIMARY KEY COMMENT 'spool 文件名',
+    entries INT NOT NULL DEFAULT 0,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_applied (applied_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
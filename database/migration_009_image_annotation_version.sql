@@ -0,0 +1,5 @@
+-- Migration 009: 图片的标注版本号
+-- 标注的每次增删都递增所在图片的版本号，图片详情的 ETag 只读取图片行，不再关联标注表
+
+ALTER TABLE images
+    ADD COLUMN annotation_version INT NOT NULL DEFAULT 0 COMMENT '标注版本号，标注增删时递增';
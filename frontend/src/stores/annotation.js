@@ -1,6 +1,10 @@
 import { defineStore } from 'pinia'
-import { ref, computed } from 'vue'
-import api from '../utils/api'
+import { ref, computed, watch } from 'vue'
+import api, { getAuthHeaders } from '../utils/api'
+import { readImageBundle } from '../utils/bundle'
+import { openAnnotationSession } from '../utils/annotationSession'
+import { createSaveQueue, createIdempotencyKey } from '../utils/saveQueue'
+import { createDwellTracker } from '../utils/dwellTracker'
 
 const PREFETCH_SIZE = 20       // 预加载数量
 const PREFETCH_THRESHOLD = 5   // 剩余多少张时触发预加载
@@ -26,6 +30,37 @@ export const useAnnotationStore = defineStore('annotation', () => {
   const historyPosition = ref(-1)      // 当前位置 (-1 表示在最新)
   const isInHistory = ref(false)       // 是否正在浏览历史
 
+  // 标注会话（WebSocket），未连接时使用 HTTP 接口
+  let session = null
+  let sessionGeneration = 0            // reset 后丢弃仍在连接中的会话
+  const sessionOpen = ref(false)
+  const liveProgress = ref(null)       // 服务端推送的数据集进度
+
+  // 离线保存队列（网络不可用时暂存，恢复后批量提交）
+  const pendingSaves = ref(0)
+  const rejectedSaves = ref(null)       // 最近一次被服务端拒绝而丢弃的暂存保存
+  const saveQueue = createSaveQueue(count => {
+    pendingSaves.value = count
+  }, rejected => {
+    rejectedSaves.value = { count: rejected.length, detail: rejected[0].detail }
+  })
+
+  // 停留时间统计：当前图片变化时重新计时
+  const dwellTracker = createDwellTracker(imageId => {
+    if (session?.isOpen) {
+      session.notify('renew', { image_id: imageId })
+    } else {
+      api.post(`/images/${imageId}/heartbeat`).catch(() => {})
+    }
+  })
+  watch(() => currentImage.value?.id, imageId => {
+    if (imageId) {
+      dwellTracker.start(imageId)
+    } else {
+      dwellTracker.stop()
+    }
+  })
+
   // 计算属性
   const canUndo = computed(() => historyIndex.value > 0)
   const canRedo = computed(() => historyIndex.value < history.value.length - 1)
@@ -63,12 +98,56 @@ export const useAnnotationStore = defineStore('annotation', () => {
     }
   }
 
-  // 预加载图片文件
+  // 一次请求获取一批图片及其预览图（失败时返回 null，由调用方退回逐张请求）
+  async function fetchImageBundle(datasetId, count, onProgress) {
+    try {
+      // 队列中已预加载的图片（服务端会再次返回已分配的图片）只返回元数据
+      const params = new URLSearchParams({ count, size: 'preview' })
+      for (const image of imageQueue.value) {
+        if (prefetchedImages.value.has(image.id)) params.append('known', image.id)
+      }
+      const response = await fetch(`/api/images/next/${datasetId}/bundle?${params}`, {
+        headers: { ...getAuthHeaders(), Accept: 'image/avif,image/webp,image/*;q=0.8' }
+      })
+      if (!response.ok) throw new Error(`HTTP ${response.status}`)
+
+      return await readImageBundle(response, (imageId, blob, index, total) => {
+        if (blob && !prefetchedImages.value.has(imageId)) {
+          prefetchedImages.value.set(imageId, URL.createObjectURL(blob))
+        }
+        onProgress(Math.round(((index + 1) / total) * 100))
+      })
+    } catch (error) {
+      console.error('Failed to fetch image bundle', error)
+      return null
+    }
+  }
+
+  // 逐张获取一批图片及其预览图
+  async function fetchImagesSeparately(datasetId, count, onProgress) {
+    const images = await fetchImageBatch(datasetId, count)
+    for (let i = 0; i < images.length; i++) {
+      await prefetchImageFile(images[i])
+      onProgress(Math.round(((i + 1) / images.length) * 100))
+    }
+    return images
+  }
+
+  // 获取一批图片并预加载预览图
+  async function prefetchImages(datasetId, count, onProgress) {
+    const images = await fetchImageBundle(datasetId, count, onProgress)
+    return images ?? await fetchImagesSeparately(datasetId, count, onProgress)
+  }
+
+  // 预加载图片预览（长边缩小后的 JPEG，画布先显示预览，原图加载完成后替换）
   async function prefetchImageFile(imageData) {
     if (prefetchedImages.value.has(imageData.id)) return
 
     try {
-      const response = await fetch(`/api/images/${imageData.id}/file`)
+      // fetch 默认 Accept 为 */*，显式声明以便服务端返回 AVIF / WebP
+      const response = await fetch(`/api/images/${imageData.id}/file?size=preview`, {
+        headers: { Accept: 'image/avif,image/webp,image/*;q=0.8' }
+      })
       const blob = await response.blob()
       const url = URL.createObjectURL(blob)
       prefetchedImages.value.set(imageData.id, url)
@@ -83,7 +162,9 @@ export const useAnnotationStore = defineStore('annotation', () => {
     isPrefetching.value = true
     prefetchProgress.value = 0
 
-    const images = await fetchImageBatch(datasetId, PREFETCH_SIZE)
+    const images = await prefetchImages(datasetId, PREFETCH_SIZE, (progress) => {
+      prefetchProgress.value = progress
+    })
     if (images.length === 0) {
       isPrefetching.value = false
       isInitialLoad.value = false
@@ -92,12 +173,6 @@ export const useAnnotationStore = defineStore('annotation', () => {
 
     imageQueue.value = images
 
-    // 预加载所有图片文件
-    for (let i = 0; i < images.length; i++) {
-      await prefetchImageFile(images[i])
-      prefetchProgress.value = Math.round(((i + 1) / images.length) * 100)
-    }
-
     isPrefetching.value = false
     isInitialLoad.value = false
 
@@ -117,25 +192,54 @@ export const useAnnotationStore = defineStore('annotation', () => {
     return nextImage
   }
 
-  // 后台预加载更多图片
+  // 建立标注会话：保存后服务端主动推送新分配的图片和进度
+  async function connectSession(datasetId) {
+    if (session || sessionOpen.value) return
+    const generation = ++sessionGeneration
+    let opened = null
+    opened = await openAnnotationSession(datasetId, {
+      onAssignment: images => {
+        const existingIds = new Set(imageQueue.value.map(img => img.id))
+        if (currentImage.value) existingIds.add(currentImage.value.id)
+        const newImages = images.filter(img => !existingIds.has(img.id))
+        imageQueue.value.push(...newImages)
+        newImages.forEach(prefetchImageFile)
+      },
+      onProgress: progress => {
+        liveProgress.value = progress
+      },
+      onClose: () => {
+        if (session === opened) {
+          session = null
+          sessionOpen.value = false
+        }
+      }
+    })
+    if (generation !== sessionGeneration) {
+      opened?.close()
+      return
+    }
+    session = opened
+    sessionOpen.value = !!opened
+  }
+
+  // 后台预加载更多图片（会话连接时由服务端推送，不需要）
   async function backgroundPrefetch(datasetId) {
-    if (isPrefetching.value) return
+    if (isPrefetching.value || session?.isOpen) return
     if (imageQueue.value.length >= PREFETCH_THRESHOLD) return
 
     isPrefetching.value = true
     prefetchProgress.value = 0
 
-    const images = await fetchImageBatch(datasetId, PREFETCH_SIZE)
+    const images = await prefetchImages(datasetId, PREFETCH_SIZE, (progress) => {
+      prefetchProgress.value = progress
+    })
 
     // 过滤已在队列中的图片
     const existingIds = new Set(imageQueue.value.map(img => img.id))
     const newImages = images.filter(img => !existingIds.has(img.id))
 
     if (newImages.length > 0) {
-      for (let i = 0; i < newImages.length; i++) {
-        await prefetchImageFile(newImages[i])
-        prefetchProgress.value = Math.round(((i + 1) / newImages.length) * 100)
-      }
       imageQueue.value.push(...newImages)
     }
 
@@ -149,6 +253,7 @@ export const useAnnotationStore = defineStore('annotation', () => {
       // 首次加载，初始化预加载队列
       if (imageQueue.value.length === 0 && !currentImage.value) {
         const result = await initializePrefetch(datasetId)
+        connectSession(datasetId)
         return result
       }
 
@@ -363,6 +468,27 @@ export const useAnnotationStore = defineStore('annotation', () => {
     historyPosition.value = processedHistory.value.length - 1
   }
 
+  // 提交保存：优先通过标注会话，其次 HTTP；网络不可用时转入离线队列
+  // 幂等键在第一次提交前生成，各条路径共用：已送达但响应丢失的保存转入队列重发时不会重复应用
+  async function submitSave(imageId, payload) {
+    const item = { ...payload, idempotency_key: createIdempotencyKey() }
+    // 离线队列非空时继续排队，保证同一图片的多次保存按顺序应用
+    if (pendingSaves.value === 0) {
+      const viaSession = !!session?.isOpen
+      try {
+        return viaSession
+          ? await session.request('save', { image_id: imageId, ...item })
+          : (await api.post(`/images/${imageId}/save`, item)).data
+      } catch (error) {
+        // 服务端返回的错误（如图片不存在）直接抛出
+        const offline = viaSession ? error.disconnected : !error.response
+        if (!offline) throw error
+      }
+    }
+    saveQueue.enqueue({ image_id: imageId, ...item })
+    return { status: 'queued' }
+  }
+
   // 保存标注
   async function saveAnnotations(skip = false) {
     if (!currentImage.value) return
@@ -382,12 +508,13 @@ export const useAnnotationStore = defineStore('annotation', () => {
       skip
     })
 
-    const response = await api.post(`/images/${currentImage.value.id}/save`, {
+    const result = await submitSave(currentImage.value.id, {
       annotations: annotationsData,
-      skip
+      skip,
+      active_seconds: dwellTracker.activeSeconds()
     })
 
-    console.log('Save response:', response.data)
+    console.log('Save response:', result)
 
     // 记录到已处理历史（如果不在历史模式中）
     if (!isInHistory.value) {
@@ -420,6 +547,11 @@ export const useAnnotationStore = defineStore('annotation', () => {
     historyPosition.value = -1
     isInHistory.value = false
     clearPrefetchCache()
+    session?.close()
+    session = null
+    sessionGeneration++
+    sessionOpen.value = false
+    liveProgress.value = null
   }
 
   return {
@@ -436,6 +568,11 @@ export const useAnnotationStore = defineStore('annotation', () => {
     prefetchProgress,
     isPrefetching,
     isInitialLoad,
+    // 标注会话
+    sessionOpen,
+    liveProgress,
+    pendingSaves,
+    rejectedSaves,
     // 已处理历史相关
     processedHistory,
     isInHistory,
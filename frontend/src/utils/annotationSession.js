@@ -0,0 +1,96 @@
+// 标注会话（WebSocket）：认证一次后在同一连接上领取、保存、续期，并接收服务端推送的新图片和进度
+
+const STORAGE_KEY = 'torch-markup-token'
+const CONNECT_TIMEOUT = 5000  // 连接并认证的超时时间（毫秒）
+
+// 连接断开导致的失败（请求可能未送达服务端），与服务端返回的错误区分
+function disconnectedError() {
+  const error = new Error('标注会话已断开')
+  error.disconnected = true
+  return error
+}
+
+// 建立会话；连接或认证失败时返回 null，由调用方退回 HTTP 接口
+export function openAnnotationSession(datasetId, { onAssignment, onProgress, onClose } = {}) {
+  const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws'
+  const socket = new WebSocket(`${protocol}://${window.location.host}/api/session/${datasetId}`)
+  const pending = new Map()  // req -> { resolve, reject }
+  let nextReq = 1
+  let open = false
+
+  const session = {
+    get isOpen() {
+      return open
+    },
+
+    // 发送请求并等待回复
+    request(type, payload = {}) {
+      if (!open) return Promise.reject(disconnectedError())
+      const req = nextReq++
+      return new Promise((resolve, reject) => {
+        pending.set(req, { resolve, reject })
+        socket.send(JSON.stringify({ ...payload, type, req }))
+      })
+    },
+
+    // 发送不需要回复的消息（如续期）
+    notify(type, payload = {}) {
+      if (open) socket.send(JSON.stringify({ ...payload, type }))
+    },
+
+    close() {
+      socket.close()
+    }
+  }
+
+  return new Promise(resolve => {
+    const timer = setTimeout(() => {
+      socket.close()
+      resolve(null)
+    }, CONNECT_TIMEOUT)
+
+    socket.onopen = () => {
+      socket.send(JSON.stringify({ type: 'auth', token: localStorage.getItem(STORAGE_KEY) }))
+    }
+
+    socket.onmessage = event => {
+      const message = JSON.parse(event.data)
+      switch (message.type) {
+        case 'ready':
+          open = true
+          clearTimeout(timer)
+          resolve(session)
+          break
+        case 'reply':
+          pending.get(message.req)?.resolve(message.data)
+          pending.delete(message.req)
+          break
+        case 'error':
+          pending.get(message.req)?.reject(new Error(message.detail))
+          pending.delete(message.req)
+          break
+        case 'assignment':
+          onAssignment?.(message.images)
+          break
+        case 'progress':
+          onProgress?.(message.data)
+          break
+      }
+    }
+
+    socket.onclose = () => {
+      const wasOpen = open
+      open = false
+      clearTimeout(timer)
+      for (const { reject } of pending.values()) {
+        reject(disconnectedError())
+      }
+      pending.clear()
+      if (wasOpen) {
+        onClose?.()
+      } else {
+        resolve(null)
+      }
+    }
+  })
+}
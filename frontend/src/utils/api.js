@@ -42,4 +42,10 @@ api.interceptors.response.use(
   }
 )
 
+// 需要自行使用 fetch 的场景（如流式读取响应）使用的认证头
+export function getAuthHeaders() {
+  const token = localStorage.getItem(STORAGE_KEY)
+  return token ? { Authorization: `Bearer ${token}` } : {}
+}
+
 export default api
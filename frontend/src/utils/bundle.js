@@ -0,0 +1,54 @@
+// 打包预加载响应解析：长度前缀帧（4 字节大端长度 + 内容）
+// 第一帧为图片元数据 JSON 列表，之后每张图片依次为 {id, content_type} JSON 帧和图片字节帧（文件不存在时为空帧）
+
+function concat(a, b) {
+  if (a.length === 0) return b
+  const merged = new Uint8Array(a.length + b.length)
+  merged.set(a, 0)
+  merged.set(b, a.length)
+  return merged
+}
+
+/**
+ * 边接收边解析打包响应
+ * @param {Response} response fetch 响应
+ * @param {Function} onImage 每张图片接收完成时调用 (id, blob | null, index, total)
+ * @returns {Promise<Array>} 图片元数据列表
+ */
+export async function readImageBundle(response, onImage) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder()
+  let buffer = new Uint8Array(0)
+  let images = null
+  let part = null
+  let index = 0
+
+  for (;;) {
+    const { done, value } = await reader.read()
+    if (value) buffer = concat(buffer, value)
+
+    while (buffer.length >= 4) {
+      const length = new DataView(buffer.buffer, buffer.byteOffset, 4).getUint32(0)
+      if (buffer.length < 4 + length) break
+      const payload = buffer.subarray(4, 4 + length)
+      buffer = buffer.subarray(4 + length)
+
+      if (images === null) {
+        images = JSON.parse(decoder.decode(payload))
+      } else if (part === null) {
+        part = JSON.parse(decoder.decode(payload))
+      } else {
+        const blob = payload.length ? new Blob([payload], { type: part.content_type }) : null
+        onImage(part.id, blob, index++, images.length)
+        part = null
+      }
+    }
+
+    if (done) break
+  }
+
+  if (images === null || index < images.length) {
+    throw new Error('Incomplete image bundle')
+  }
+  return images
+}
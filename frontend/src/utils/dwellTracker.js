@@ -0,0 +1,67 @@
+// 标注停留时间统计：图片显示且用户活跃时累计有效时间，并定期发送心跳
+
+const HEARTBEAT_INTERVAL = 15000  // 心跳间隔（毫秒）
+const IDLE_TIMEOUT = 60000        // 超过该时间无操作视为离开（毫秒）
+const ACTIVITY_EVENTS = ['mousedown', 'mousemove', 'keydown', 'wheel', 'touchstart']
+
+export function createDwellTracker(sendHeartbeat) {
+  let imageId = null
+  let activeMs = 0
+  let lastTick = 0
+  let lastActivity = 0
+  let timer = null
+
+  function markActivity() {
+    lastActivity = Date.now()
+  }
+
+  function isActive(now) {
+    return document.visibilityState === 'visible' && now - lastActivity < IDLE_TIMEOUT
+  }
+
+  // 累计上一次计时以来的有效时间
+  function tick() {
+    const now = Date.now()
+    if (isActive(now)) {
+      activeMs += now - lastTick
+    }
+    lastTick = now
+  }
+
+  function beat() {
+    tick()
+    if (imageId !== null && isActive(Date.now())) {
+      sendHeartbeat(imageId)
+    }
+  }
+
+  // 切换到新图片时重新计时
+  function start(id) {
+    if (timer === null) {
+      ACTIVITY_EVENTS.forEach(name => window.addEventListener(name, markActivity, { passive: true }))
+      timer = setInterval(beat, HEARTBEAT_INTERVAL)
+    }
+    imageId = id
+    activeMs = 0
+    lastTick = Date.now()
+    markActivity()
+    sendHeartbeat(id)
+  }
+
+  function stop() {
+    if (timer !== null) {
+      clearInterval(timer)
+      timer = null
+      ACTIVITY_EVENTS.forEach(name => window.removeEventListener(name, markActivity))
+    }
+    imageId = null
+  }
+
+  // 当前图片的有效操作时间（秒）
+  function activeSeconds() {
+    tick()
+    return Math.round(activeMs / 1000)
+  }
+
+  return { start, stop, activeSeconds }
+}
@@ -0,0 +1,59 @@
+// 数据集进度推送（Server-Sent Events）：使用 fetch 读取以便携带认证头，断开后自动重连
+
+import { getAuthHeaders } from './api'
+
+const RECONNECT_DELAY = 3000  // 断开后重连的等待时间（毫秒）
+
+// 订阅数据集进度，返回取消订阅的函数
+export function subscribeProgress(datasetId, onProgress) {
+  const controller = new AbortController()
+  let stopped = false
+
+  async function connect() {
+    const response = await fetch(`/api/images/dataset/${datasetId}/progress/stream`, {
+      headers: { ...getAuthHeaders(), Accept: 'text/event-stream' },
+      signal: controller.signal
+    })
+    if (!response.ok) throw new Error(`HTTP ${response.status}`)
+
+    const reader = response.body.getReader()
+    const decoder = new TextDecoder()
+    let buffer = ''
+    while (true) {
+      const { done, value } = await reader.read()
+      if (done) break
+      buffer += decoder.decode(value, { stream: true })
+
+      // 事件之间以空行分隔；以 ':' 开头的注释行（保活）忽略
+      let end
+      while ((end = buffer.indexOf('\n\n')) !== -1) {
+        const lines = buffer.slice(0, end).split('\n')
+        buffer = buffer.slice(end + 2)
+        const event = lines.find(line => line.startsWith('event:'))?.slice(6).trim()
+        const data = lines.filter(line => line.startsWith('data:')).map(line => line.slice(5).trim()).join('\n')
+        if (event === 'progress' && data) {
+          onProgress(JSON.parse(data))
+        }
+      }
+    }
+  }
+
+  async function run() {
+    while (!stopped) {
+      try {
+        await connect()
+      } catch (error) {
+        if (stopped) return
+        console.error('Progress stream disconnected', error)
+      }
+      if (!stopped) await new Promise(resolve => setTimeout(resolve, RECONNECT_DELAY))
+    }
+  }
+
+  run()
+
+  return () => {
+    stopped = true
+    controller.abort()
+  }
+}
@@ -0,0 +1,130 @@
+// 离线保存队列：网络不可用时保存请求暂存在 localStorage，恢复后通过批量保存接口一次提交
+// 每条保存带幂等键，重复提交（如提交成功但响应丢失）不会重复应用；被服务端拒绝的保存丢弃并通知调用方
+
+import { getAuthHeaders } from './api'
+
+const STORAGE_KEY = 'torch-markup-pending-saves'
+const RETRY_INTERVAL = 30000  // 提交失败后的重试间隔（毫秒）
+const MAX_BATCH = 500         // 单次提交条数，与服务端 BATCH_SAVE_MAX_ITEMS 一致
+
+function loadItems() {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_KEY)) || []
+  } catch {
+    return []
+  }
+}
+
+function storeItems(items) {
+  localStorage.setItem(STORAGE_KEY, JSON.stringify(items))
+}
+
+function removeItems(keys) {
+  const remaining = loadItems().filter(item => !keys.has(item.idempotency_key))
+  storeItems(remaining)
+  return remaining.length
+}
+
+// 生成幂等键：crypto.randomUUID 只在安全上下文（HTTPS / localhost）中可用，内网 HTTP 部署时用 getRandomValues 生成 v4 UUID
+export function createIdempotencyKey() {
+  if (typeof crypto.randomUUID === 'function') return crypto.randomUUID()
+  const bytes = crypto.getRandomValues(new Uint8Array(16))
+  bytes[6] = (bytes[6] & 0x0f) | 0x40
+  bytes[8] = (bytes[8] & 0x3f) | 0x80
+  const hex = Array.from(bytes, byte => byte.toString(16).padStart(2, '0')).join('')
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`
+}
+
+// onRejected 接收被服务端拒绝而丢弃的保存：[{ item, detail }]
+export function createSaveQueue(onChange, onRejected = () => {}) {
+  let flushing = null
+  let retryTimer = null
+
+  function scheduleRetry() {
+    if (retryTimer === null) {
+      retryTimer = setTimeout(() => {
+        retryTimer = null
+        flush()
+      }, RETRY_INTERVAL)
+    }
+  }
+
+  // 网络错误、5xx 与 409（相同幂等键的保存正在处理）抛出，稍后重试；其他 4xx 返回给调用方丢弃
+  async function post(items) {
+    const response = await fetch('/api/images/save/batch', {
+      method: 'POST',
+      headers: { ...getAuthHeaders(), 'Content-Type': 'application/json' },
+      body: JSON.stringify({ items })
+    })
+    if (response.status >= 500 || response.status === 409) throw new Error(`HTTP ${response.status}`)
+    const body = await response.json().catch(() => ({}))
+    const detail = typeof body.detail === 'string' ? body.detail : `HTTP ${response.status}`
+    return { ok: response.ok, results: body.results || [], detail }
+  }
+
+  function rejectedResults(items, results) {
+    return results
+      .map((result, index) => ({ item: items[index], detail: result.error }))
+      .filter(result => result.detail)
+  }
+
+  async function submit() {
+    while (true) {
+      const items = loadItems().slice(0, MAX_BATCH)
+      if (items.length === 0) return
+
+      const { ok, results, detail } = await post(items)
+      let rejected = []
+      if (ok) {
+        // 每条都有结果（已应用、重复提交或被拒绝，如图片已不存在），全部移出队列
+        rejected = rejectedResults(items, results)
+        onChange(removeItems(new Set(items.map(item => item.idempotency_key))))
+      } else if (items.length === 1) {
+        rejected = [{ item: items[0], detail }]
+        onChange(removeItems(new Set([items[0].idempotency_key])))
+      } else {
+        // 整批被拒绝（如某条格式不合法）：逐条提交，只丢弃被拒绝的条目，不阻塞之后的保存
+        for (const item of items) {
+          const single = await post([item])
+          rejected.push(...(single.ok ? rejectedResults([item], single.results) : [{ item, detail: single.detail }]))
+          onChange(removeItems(new Set([item.idempotency_key])))
+        }
+      }
+      if (rejected.length > 0) {
+        console.warn('Queued saves rejected', rejected)
+        onRejected(rejected)
+      }
+    }
+  }
+
+  // 提交队列中的全部保存；失败时稍后重试
+  function flush() {
+    if (!flushing) {
+      flushing = submit()
+        .catch(error => {
+          console.error('Failed to flush queued saves', error)
+          scheduleRetry()
+        })
+        .finally(() => {
+          flushing = null
+        })
+    }
+    return flushing
+  }
+
+  // 保留调用方已生成的幂等键（提交过但结果未知的保存），否则新生成
+  function enqueue(item) {
+    const items = loadItems()
+    items.push({ ...item, idempotency_key: item.idempotency_key || createIdempotencyKey() })
+    storeItems(items)
+    onChange(items.length)
+    flush()
+  }
+
+  window.addEventListener('online', flush)
+  const initial = loadItems().length
+  onChange(initial)
+  if (initial > 0) flush()
+
+  return { enqueue, flush }
+}